@@ -0,0 +1,349 @@
+"""
+module Archive for storing long runs of spectra
+
+A SpectrogramArchive is a directory of fixed-size chunks.  Each chunk holds
+a block of spectra, one per row, in a preallocated file which is memory
+mapped, the time of each row in a second file, and the frequency of its
+first channel and the channel width in a small JSON file.  Adding a row
+writes it into the mapped chunk, so it takes the same time however long the
+archive is, and reading a time range returns views of the mapped files
+without loading anything else.
+
+Rows are float32, or uint16 for half the space, scaled so that the stored
+value is (value - offset)/scale.  For spectra in dB, offset=-100 and
+scale=0.01 cover -100 to 555 dB in 0.01 dB steps.
+
+Layout::
+
+  <path>/archive.json   - version, number of channels, type, scaling
+  <path>/NNNNNN.rows    - rows_per_chunk x num_bins values
+  <path>/NNNNNN.times   - rows_per_chunk float64 times; NaN for unused rows
+  <path>/NNNNNN.json    - start_freq, channel_width
+
+Times must not decrease, since rows are found by searching the times.
+"""
+import glob
+import json
+import logging
+import os
+import time
+from numpy import arange, asarray, clip, concatenate, empty, float32, float64
+from numpy import inf, memmap, nan, rint, searchsorted, uint16
+from numpy import dtype as np_dtype
+
+module_logger = logging.getLogger(__name__)
+
+ARCHIVE_VERSION = 1
+DEFAULT_ROWS = 4096
+
+class SpectrogramArchive(object):
+  """
+  Chunked, append-only store of spectra
+
+  Public attributes::
+
+   path           - directory holding the archive
+   mode           - "a" to append and read, "r" to read only
+   num_bins       - number of channels in a row
+   dtype          - type of the stored values, float32 or uint16
+   rows_per_chunk - number of rows in each chunk
+   offset, scale  - value = stored*scale + offset for uint16
+  """
+  def __init__(self, path, num_bins=None, dtype=float32,
+               rows_per_chunk=DEFAULT_ROWS, offset=0., scale=1., mode="a"):
+    """
+    Opens an archive, creating it if it does not exist and mode is "a".
+
+    The other arguments are only used when the archive is created.
+
+    @param path : directory for the archive
+    @type  path : str
+
+    @param num_bins : number of channels in a row
+    @type  num_bins : int
+
+    @param dtype : float32 or uint16
+    @type  dtype : numpy type
+
+    @param rows_per_chunk : number of rows in each chunk
+    @type  rows_per_chunk : int
+
+    @param offset : value of a stored 0 for uint16
+    @type  offset : float
+
+    @param scale : value of one uint16 step
+    @type  scale : float
+
+    @param mode : "a" to append and read, "r" to read only
+    @type  mode : str
+    """
+    self.logger = logging.getLogger(module_logger.name+".SpectrogramArchive")
+    self.path = path
+    self.mode = mode
+    metafile = os.path.join(path, "archive.json")
+    if os.path.exists(metafile):
+      fd = open(metafile)
+      meta = json.load(fd)
+      fd.close()
+      if meta["version"] > ARCHIVE_VERSION:
+        raise ValueError("%s has archive format %d; this reads up to %d"
+                         % (path, meta["version"], ARCHIVE_VERSION))
+      num_bins = meta["num_bins"]
+      dtype = meta["dtype"]
+      rows_per_chunk = meta["rows_per_chunk"]
+      offset = meta["offset"]
+      scale = meta["scale"]
+    elif mode == "r":
+      raise IOError("no archive at %s" % path)
+    elif not num_bins:
+      raise ValueError("a new archive needs the number of channels")
+    self.num_bins = num_bins
+    self.dtype = np_dtype(dtype)
+    if self.dtype not in (np_dtype(float32), np_dtype(uint16)):
+      raise ValueError("archive rows must be float32 or uint16")
+    self.rows_per_chunk = rows_per_chunk
+    self.offset = offset
+    self.scale = scale
+    if not os.path.exists(metafile):
+      if not os.path.isdir(path):
+        os.makedirs(path)
+      fd = open(metafile, "w")
+      json.dump({"version": ARCHIVE_VERSION, "num_bins": num_bins,
+                 "dtype": self.dtype.name, "rows_per_chunk": rows_per_chunk,
+                 "offset": offset, "scale": scale}, fd, indent=2)
+      fd.close()
+    self._chunks = []
+    self._maps = {}
+    self.refresh()
+    if self._chunks:
+      self._fill = self._count(self._chunks[-1])
+    else:
+      self._fill = 0
+
+  def refresh(self):
+    """
+    Finds chunks added since the archive was opened by another writer
+    """
+    names = sorted(glob.glob(os.path.join(self.path, "[0-9]"*6+".json")))
+    for name in names[len(self._chunks):]:
+      fd = open(name)
+      info = json.load(fd)
+      fd.close()
+      self._chunks.append(info)
+
+  def chunks(self):
+    """
+    Descriptions of the chunks
+
+    @return: list of dict with 'index', 'start_freq' and 'channel_width'
+    """
+    return list(self._chunks)
+
+  def _map(self, info):
+    """
+    Returns the (times, rows) memmaps of a chunk
+    """
+    index = info["index"]
+    try:
+      return self._maps[index]
+    except KeyError:
+      pass
+    base = os.path.join(self.path, "%06d" % index)
+    if self.mode == "r":
+      mapmode = "r"
+    else:
+      mapmode = "r+"
+    times = memmap(base+".times", dtype=float64, mode=mapmode,
+                   shape=(self.rows_per_chunk,))
+    rows = memmap(base+".rows", dtype=self.dtype, mode=mapmode,
+                  shape=(self.rows_per_chunk, self.num_bins))
+    self._maps[index] = (times, rows)
+    return times, rows
+
+  def _count(self, info):
+    """
+    Number of rows written in a chunk
+    """
+    times, rows = self._map(info)
+    # unused rows have NaN times, which sort after everything else
+    return int(searchsorted(times, inf, side="right"))
+
+  def _new_chunk(self, start_freq, channel_width):
+    """
+    Creates an empty chunk and makes it the current one
+    """
+    info = {"index": len(self._chunks), "start_freq": start_freq,
+            "channel_width": channel_width}
+    base = os.path.join(self.path, "%06d" % info["index"])
+    times = memmap(base+".times", dtype=float64, mode="w+",
+                   shape=(self.rows_per_chunk,))
+    times[:] = nan
+    times.flush()
+    memmap(base+".rows", dtype=self.dtype, mode="w+",
+           shape=(self.rows_per_chunk, self.num_bins)).flush()
+    del times
+    # the description is written last, so readers only see whole chunks
+    fd = open(base+".json", "w")
+    json.dump(info, fd)
+    fd.close()
+    self._chunks.append(info)
+    self._fill = 0
+    self.logger.debug("_new_chunk: %d", info["index"])
+
+  def set_frequency(self, start_freq, channel_width):
+    """
+    Sets the frequencies of the rows which follow
+
+    A new chunk is started unless the current one has the same frequencies.
+
+    @param start_freq : frequency of the first channel, Hz
+    @type  start_freq : float
+
+    @param channel_width : channel spacing, Hz
+    @type  channel_width : float
+    """
+    if self._chunks:
+      info = self._chunks[-1]
+      if (info["start_freq"] == start_freq and
+          info["channel_width"] == channel_width):
+        return
+    self._new_chunk(start_freq, channel_width)
+
+  def frequencies(self, info):
+    """
+    Channel frequencies of a chunk
+
+    @param info : chunk description
+    @type  info : dict
+
+    @return: numpy array of float, Hz
+    """
+    return info["start_freq"] + arange(self.num_bins)*info["channel_width"]
+
+  def append(self, spectra, times=None):
+    """
+    Adds one spectrum or a block of them
+
+    @param spectra : one row, or one row per spectrum
+    @type  spectra : numpy 1D or 2D array
+
+    @param times : time of each row, s; default is now
+    @type  times : float or numpy array of float
+    """
+    if self.mode == "r":
+      raise IOError("archive %s is open read-only" % self.path)
+    spectra = asarray(spectra)
+    if spectra.ndim == 1:
+      spectra = spectra.reshape(1, -1)
+    num_rows = len(spectra)
+    if times is None:
+      times = time.time()
+    row_times = empty(num_rows, dtype=float64)
+    row_times[:] = times
+    done = 0
+    while done < num_rows:
+      if not self._chunks:
+        self._new_chunk(None, None)
+      elif self._fill == self.rows_per_chunk:
+        info = self._chunks[-1]
+        self._new_chunk(info["start_freq"], info["channel_width"])
+      times_map, rows_map = self._map(self._chunks[-1])
+      num = min(num_rows - done, self.rows_per_chunk - self._fill)
+      block = spectra[done:done+num]
+      if self.dtype == uint16:
+        block = clip(rint((block - self.offset)/self.scale), 0, 65535)
+      rows_map[self._fill:self._fill+num] = block
+      # the times go in after the rows, so a row is complete once timed
+      times_map[self._fill:self._fill+num] = row_times[done:done+num]
+      self._fill += num
+      done += num
+
+  def select(self, start=None, stop=None):
+    """
+    Rows with times from 'start' up to 'stop'
+
+    The times and rows are views of the archive files.
+
+    @param start : earliest time; default is the beginning
+    @type  start : float
+
+    @param stop : time after the last row; default is the end
+    @type  stop : float
+
+    @return: list of (chunk description, times, rows) for each chunk
+    """
+    if self.mode == "r":
+      self.refresh()
+    if start == None:
+      start = -inf
+    if stop == None:
+      stop = inf
+    segments = []
+    for info in self._chunks:
+      times, rows = self._map(info)
+      count = self._count(info)
+      if not count or times[0] >= stop or times[count-1] < start:
+        continue
+      first = searchsorted(times[:count], start)
+      last = searchsorted(times[:count], stop)
+      if last > first:
+        segments.append((info, times[first:last], rows[first:last]))
+    return segments
+
+  def last(self, num_rows):
+    """
+    The most recent rows, oldest first
+
+    This is a view if the rows are all in one chunk and a copy otherwise.
+
+    @param num_rows : number of rows wanted; fewer if the archive is short
+    @type  num_rows : int
+
+    @return: numpy 2D array
+    """
+    if self.mode == "r":
+      self.refresh()
+    pieces = []
+    wanted = num_rows
+    for info in reversed(self._chunks):
+      if not wanted:
+        break
+      times, rows = self._map(info)
+      count = self._count(info)
+      take = min(wanted, count)
+      if take:
+        pieces.insert(0, rows[count-take:count])
+        wanted -= take
+    if len(pieces) == 1:
+      return pieces[0]
+    if not pieces:
+      return empty((0, self.num_bins), dtype=self.dtype)
+    return concatenate(pieces)
+
+  def decode(self, rows):
+    """
+    Values of stored rows
+
+    @param rows : rows from 'select' or 'last'
+    @type  rows : numpy array
+
+    @return: numpy array of float32; 'rows' itself if they are float32
+    """
+    if self.dtype == uint16:
+      return (rows*float32(self.scale) + float32(self.offset)).astype(float32)
+    return rows
+
+  def flush(self):
+    """
+    Writes changes in the current chunk to disk
+    """
+    if self._chunks and self.mode != "r":
+      for mapped in self._map(self._chunks[-1]):
+        mapped.flush()
+
+  def close(self):
+    """
+    Flushes and unmaps everything
+    """
+    self.flush()
+    self._maps.clear()
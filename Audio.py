@@ -0,0 +1,59 @@
+"""
+module Audio for writing demodulated audio
+"""
+import logging
+import wave
+from numpy import clip, int16
+
+module_logger = logging.getLogger(__name__)
+
+class WAVSink(object):
+  """
+  Writes blocks of float audio to a mono 16-bit WAV file
+
+  Public attributes::
+
+   filename   - name of the WAV file
+   audio_rate - samples per second
+   gain       - multiplier applied before conversion; 1.0 is full scale
+   written    - number of samples written
+  """
+  def __init__(self, filename, audio_rate, gain=0.5):
+    """
+    Creates a WAVSink instance.
+
+    @param filename : name of the WAV file
+    @type  filename : str
+
+    @param audio_rate : samples per second; rounded to an integer
+    @type  audio_rate : float
+
+    @param gain : multiplier applied before conversion
+    @type  gain : float
+    """
+    self.filename = filename
+    self.audio_rate = int(round(audio_rate))
+    self.gain = gain
+    self.written = 0
+    self._wav = wave.open(filename, "wb")
+    self._wav.setnchannels(1)
+    self._wav.setsampwidth(2)
+    self._wav.setframerate(self.audio_rate)
+
+  def write(self, audio):
+    """
+    Appends a block of audio
+
+    @param audio : samples in the range -1 to 1
+    @type  audio : numpy array of float
+    """
+    samples = clip(audio*(self.gain*32767), -32768, 32767).astype(int16)
+    self._wav.writeframes(samples.astype('<i2').tobytes())
+    self.written += len(samples)
+
+  def close(self):
+    """
+    Finishes the WAV header and closes the file
+    """
+    self._wav.close()
+    module_logger.debug("close: %d samples in %s", self.written, self.filename)
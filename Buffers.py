@@ -0,0 +1,229 @@
+"""
+module Buffers for preallocated sample storage
+
+The librtlsdr read functions write unsigned 8-bit I/Q pairs into memory that
+the caller provides.  Instead of allocating a new buffer for every read, the
+classes here own a fixed set of numpy arrays which are handed to the library
+by address and then viewed, without copying, as the types the rest of the
+package wants.
+"""
+import ctypes as ct
+import logging
+import threading
+from numpy import empty, float32, uint8, zeros
+
+module_logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_BUFS = 4
+DEFAULT_NUM_BLOCKS = 32
+
+class BufferPool(object):
+  """
+  Ring of preallocated byte buffers for synchronous reads
+
+  Each call to 'next' returns the following buffer in the ring, so an array
+  obtained from the pool stays valid until 'num_bufs' more buffers have been
+  taken.  A consumer which keeps data longer than that must copy it.
+
+  Every byte buffer has a float32 companion, allocated on first use, into
+  which converted samples can be written without a new allocation.
+
+  Public attributes::
+
+   blk_size - number of bytes in each buffer
+   num_bufs - number of buffers in the ring
+  """
+  def __init__(self, blk_size, num_bufs=DEFAULT_NUM_BUFS):
+    """
+    Creates a BufferPool instance.
+
+    @param blk_size : number of bytes in each buffer
+    @type  blk_size : int
+
+    @param num_bufs : number of buffers in the ring
+    @type  num_bufs : int
+    """
+    self.logger = logging.getLogger(module_logger.name+".BufferPool")
+    self.num_bufs = num_bufs
+    self._allocate(blk_size)
+
+  def _allocate(self, blk_size):
+    """
+    (Re)creates the byte buffers; the float companions are made when needed
+    """
+    self.blk_size = blk_size
+    self._bytes = [empty(blk_size, dtype=uint8) for i in range(self.num_bufs)]
+    self._floats = [None]*self.num_bufs
+    self._index = -1
+
+  def next(self, num=None):
+    """
+    Returns the next byte buffer in the ring
+
+    If more bytes are requested than the buffers hold, all the buffers are
+    replaced by larger ones.
+
+    @param num : number of bytes needed
+    @type  num : int
+
+    @return: numpy array of uint8, 'num' long
+    """
+    if num == None:
+      num = self.blk_size
+    elif num > self.blk_size:
+      self.logger.debug("next: enlarging buffers from %d to %d bytes",
+                        self.blk_size, num)
+      self._allocate(num)
+    self._index = (self._index + 1) % self.num_bufs
+    return self._bytes[self._index][:num]
+
+  def floats(self, num):
+    """
+    Returns the float32 companion of the buffer last given out by 'next'
+
+    @param num : number of values needed
+    @type  num : int
+
+    @return: numpy array of float32, 'num' long
+    """
+    if self._floats[self._index] is None:
+      self._floats[self._index] = empty(self.blk_size, dtype=float32)
+    return self._floats[self._index][:num]
+
+class BlockRing(object):
+  """
+  Fixed ring of equal-sized byte blocks between one producer and one consumer
+
+  The producer (normally the librtlsdr asynchronous read callback) copies
+  each block into the next free slot with 'put'; the consumer takes them in
+  order with 'get'.  Each side only advances its own counter so no lock is
+  taken on the data path; an Event just wakes a waiting consumer.
+
+  When the consumer falls behind and the ring is full, new blocks are
+  dropped and counted rather than overwriting data not yet consumed.  A
+  producer which can wait, such as a file being replayed, calls 'wait_space'
+  first so that nothing is dropped.  The block last returned by 'get'
+  belongs to the consumer until the next call.
+
+  Public attributes::
+
+   blk_size   - number of bytes in each block
+   num_blocks - number of slots in the ring
+   received   - number of blocks offered by the producer
+   dropped    - blocks lost because the ring was full, or lost upstream
+   gap        - blocks lost just before the block last returned by 'get'
+  """
+  def __init__(self, blk_size, num_blocks=DEFAULT_NUM_BLOCKS):
+    """
+    Creates a BlockRing instance.
+
+    @param blk_size : number of bytes in each block
+    @type  blk_size : int
+
+    @param num_blocks : number of slots in the ring
+    @type  num_blocks : int
+    """
+    self.logger = logging.getLogger(module_logger.name+".BlockRing")
+    self.blk_size = blk_size
+    self.num_blocks = num_blocks
+    self._blocks = empty((num_blocks, blk_size), dtype=uint8)
+    self._lengths = zeros(num_blocks, dtype=int)
+    self._dropped_at = zeros(num_blocks, dtype=int)
+    self._head = 0         # blocks written; advanced by the producer only
+    self._tail = 0         # blocks released; advanced by the consumer only
+    self._holding = False  # consumer has the block at _tail
+    self._ready = threading.Event()
+    self._space = threading.Event()
+    self._closed = False
+    self.received = 0
+    self.dropped = 0
+    self.gap = 0
+    self._dropped_seen = 0
+
+  def put(self, source, length, skipped=0):
+    """
+    Copies a block into the ring
+
+    @param source : address, ctypes pointer or byte string
+    @type  source : int, ctypes pointer or str
+
+    @param length : number of bytes
+    @type  length : int
+
+    @param skipped : blocks lost upstream just before this one
+    @type  skipped : int
+
+    @return: False if the block was dropped
+    """
+    # blocks lost before reaching the ring count as dropped here, so 'gap'
+    # covers them too
+    self.dropped += skipped
+    self.received += 1
+    if self._head - self._tail >= self.num_blocks:
+      self.dropped += 1
+      return False
+    slot = self._head % self.num_blocks
+    length = min(length, self.blk_size)
+    ct.memmove(self._blocks[slot].ctypes.data, source, length)
+    self._lengths[slot] = length
+    self._dropped_at[slot] = self.dropped
+    self._head += 1
+    self._ready.set()
+    return True
+
+  def get(self, timeout=None):
+    """
+    Returns the next block, waiting for one if necessary
+
+    The array is a view of a ring slot and is valid until the next call.
+
+    @param timeout : seconds to wait for data
+    @type  timeout : float
+
+    @return: numpy array of uint8, or None if closed and empty or timed out
+    """
+    if self._holding:
+      self._tail += 1
+      self._holding = False
+      self._space.set()
+    while True:
+      self._ready.clear()
+      if self._head > self._tail:
+        break
+      if self._closed:
+        return None
+      if not self._ready.wait(timeout) and timeout != None:
+        return None
+    slot = self._tail % self.num_blocks
+    self._holding = True
+    self.gap = int(self._dropped_at[slot] - self._dropped_seen)
+    self._dropped_seen = self._dropped_at[slot]
+    return self._blocks[slot][:self._lengths[slot]]
+
+  def wait_space(self, timeout=None):
+    """
+    Waits until 'put' would not drop a block
+
+    @param timeout : seconds to wait
+    @type  timeout : float
+
+    @return: True if there is a free slot, False if timed out or closed
+    """
+    while True:
+      self._space.clear()
+      if self._head - self._tail < self.num_blocks:
+        return True
+      if self._closed:
+        return False
+      if not self._space.wait(timeout) and timeout != None:
+        return False
+
+  def close(self):
+    """
+    Tells the consumer that no more blocks will come
+    """
+    self._closed = True
+    self._ready.set()
+    self._space.set()
+    self.logger.debug("close: %d blocks received, %d dropped",
+                      self.received, self.dropped)
@@ -0,0 +1,570 @@
+"""
+module Calibration for correcting the shape of the receiver passband
+
+A baseline is a Chebyshev fit to the normalized power across the band,
+measured with no signals present, against the offset from the tuned
+frequency in MHz.  Dividing a spectrum by it flattens the passband.
+
+GainSweep measures the power at a range of frequencies for several gains,
+from which the response to gain can be calibrated.
+"""
+import logging
+import os
+import re
+import time
+from numpy import abs, all, arange, array, asarray, complex64, concatenate
+from numpy import empty, float32, float64, int64, isnan, load, loadtxt
+from numpy import median, nan, savez, where
+from numpy.polynomial.chebyshev import chebfit, chebval
+
+from RealtekSDR.Archive import SpectrogramArchive
+from RealtekSDR.Signals import sideband_power
+
+module_logger = logging.getLogger(__name__)
+
+BASELINE_FILE = "baselines.npz"
+STORE_VERSION = 1
+BASELINE_DEGREE = 11
+SWEEP_DTYPE = [('lsb', float64), ('usb', float64), ('total', float64)]
+
+def bin_offsets(sample_rate, num_bins):
+  """
+  Offsets of the channel centers from the tuned frequency
+
+  The channels are placed symmetrically about zero, which is how the
+  baseline spectra were written by hires_scan and fitted.
+
+  @param sample_rate : samples per second (= bandwidth)
+  @type  sample_rate : float
+
+  @param num_bins : number of channels
+  @type  num_bins : int
+
+  @return: numpy array of float, MHz
+  """
+  return (arange(num_bins) - (num_bins-1)/2.)*sample_rate/num_bins/1e6
+
+class BaselineStore(object):
+  """
+  Baseline fits and the normalizers made from them
+
+  Each fit is filed under the sample rate, the tuner gain and the band of
+  tuned frequencies it is good for.  A gain or band of None means any.  When
+  a normalizer is asked for, a fit for the same gain is preferred to one for
+  any gain, and one whose band includes the tuned frequency to one for any
+  band.
+
+  A normalizer is the reciprocal of a fit evaluated at the channel centers.
+  It is computed once per fit and number of channels and kept as a read-only
+  float32 array, so every hop of a scan is handed the same array.
+
+  The fits and the normalizers already computed are saved in an npz file
+  with a format version.  It is read with allow_pickle=False, so loading a
+  file cannot run code.
+
+  Public attributes::
+
+   filename     - npz file the store is loaded from and saved to
+   calibrations - Chebyshev coefficients keyed by (sample rate, gain, band)
+  """
+  def __init__(self, filename=BASELINE_FILE):
+    """
+    Creates a BaselineStore instance, loading 'filename' if it exists.
+
+    @param filename : npz file; None for a store kept only in memory
+    @type  filename : str
+    """
+    self.logger = logging.getLogger(module_logger.name+".BaselineStore")
+    self.filename = filename
+    self.calibrations = {}
+    self._normalizers = {}
+    if filename and os.path.exists(filename):
+      self.load()
+
+  def _key(self, sample_rate, gain, band):
+    """
+    Makes a calibration key with consistent types
+    """
+    if gain != None:
+      gain = int(gain)
+    if band != None:
+      band = (float(band[0]), float(band[1]))
+    return (float(sample_rate), gain, band)
+
+  def add(self, coefs, sample_rate, gain=None, band=None):
+    """
+    Files a baseline fit, replacing any with the same key
+
+    @param coefs : Chebyshev coefficients of power against offset in MHz
+    @type  coefs : sequence of float
+
+    @param sample_rate : samples per second (= bandwidth)
+    @type  sample_rate : float
+
+    @param gain : tuner gain, tenths of dB; None for any gain
+    @type  gain : int
+
+    @param band : (low, high) tuned frequencies, Hz; None for any
+    @type  band : tuple of float
+    """
+    key = self._key(sample_rate, gain, band)
+    self.calibrations[key] = asarray(coefs, dtype=float64)
+    for cached in list(self._normalizers.keys()):
+      if cached[0] == key:
+        del self._normalizers[cached]
+    self.logger.debug("add: %s", key)
+
+  def find(self, sample_rate, gain=None, freq=None):
+    """
+    Key of the calibration which best fits the conditions
+
+    @param sample_rate : samples per second
+    @type  sample_rate : float
+
+    @param gain : tuner gain, tenths of dB
+    @type  gain : int
+
+    @param freq : tuned frequency, Hz
+    @type  freq : float
+
+    @return: tuple (sample rate, gain, band)
+    """
+    best = None
+    best_score = -1
+    for key in self.calibrations.keys():
+      rate, cal_gain, band = key
+      if rate != float(sample_rate):
+        continue
+      if cal_gain != None and cal_gain != gain:
+        continue
+      if band != None and (freq == None or not band[0] <= freq <= band[1]):
+        continue
+      score = 2*(cal_gain != None) + (band != None)
+      if score > best_score:
+        best, best_score = key, score
+    if best == None:
+      raise KeyError("no baseline for %s Hz at gain %s and %s Hz"
+                     % (sample_rate, gain, freq))
+    return best
+
+  def normalizer(self, sample_rate, num_bins, gain=None, freq=None):
+    """
+    Multiplier which flattens a power spectrum
+
+    The array is shared by every caller and must not be changed.
+
+    @param sample_rate : samples per second
+    @type  sample_rate : float
+
+    @param num_bins : number of channels, in frequency order
+    @type  num_bins : int
+
+    @param gain : tuner gain, tenths of dB
+    @type  gain : int
+
+    @param freq : tuned frequency, Hz
+    @type  freq : float
+
+    @return: numpy array of float32, num_bins long
+    """
+    key = self.find(sample_rate, gain, freq)
+    try:
+      return self._normalizers[(key, num_bins)]
+    except KeyError:
+      pass
+    model = chebval(bin_offsets(sample_rate, num_bins), self.calibrations[key])
+    normalizer = (1./model).astype(float32)
+    normalizer.flags.writeable = False
+    self._normalizers[(key, num_bins)] = normalizer
+    self.logger.debug("normalizer: new for %s with %d bins", key, num_bins)
+    return normalizer
+
+  def save(self, filename=None):
+    """
+    Writes the fits and the normalizers computed from them
+
+    @param filename : npz file; default is the one the store was made with
+    @type  filename : str
+    """
+    if filename == None:
+      filename = self.filename
+    keys = list(self.calibrations.keys())
+    rates = array([key[0] for key in keys], dtype=float64)
+    gains = array([nan if key[1] == None else key[1] for key in keys],
+                  dtype=float64)
+    bands = array([(nan, nan) if key[2] == None else key[2] for key in keys],
+                  dtype=float64).reshape(len(keys), 2)
+    arrays = {"version": array(STORE_VERSION),
+              "rates": rates, "gains": gains, "bands": bands}
+    for index in range(len(keys)):
+      arrays["coefs%d" % index] = self.calibrations[keys[index]]
+    cached = list(self._normalizers.keys())
+    arrays["norm_index"] = array([keys.index(key) for key, num_bins in cached],
+                                 dtype=int64)
+    for index in range(len(cached)):
+      arrays["norm%d" % index] = self._normalizers[cached[index]]
+    savez(filename, **arrays)
+    self.logger.info("save: %d baselines to %s", len(keys), filename)
+
+  def load(self, filename=None):
+    """
+    Reads fits and normalizers written by 'save'
+
+    @param filename : npz file; default is the one the store was made with
+    @type  filename : str
+    """
+    if filename == None:
+      filename = self.filename
+    stored = load(filename, allow_pickle=False)
+    version = int(stored["version"])
+    if version > STORE_VERSION:
+      raise ValueError("%s has baseline format %d; this reads up to %d"
+                       % (filename, version, STORE_VERSION))
+    keys = []
+    for index in range(len(stored["rates"])):
+      gain = stored["gains"][index]
+      band = stored["bands"][index]
+      key = self._key(stored["rates"][index],
+                      None if isnan(gain) else gain,
+                      None if isnan(band[0]) else tuple(band))
+      self.calibrations[key] = stored["coefs%d" % index]
+      keys.append(key)
+    for index in range(len(stored["norm_index"])):
+      normalizer = stored["norm%d" % index].astype(float32)
+      normalizer.flags.writeable = False
+      key = keys[stored["norm_index"][index]]
+      self._normalizers[(key, len(normalizer))] = normalizer
+    self.logger.info("load: %d baselines from %s", len(keys), filename)
+
+def convert_pickle(pklfile, store):
+  """
+  Copies the fits from an old baseline_coefs.pkl file into a store
+
+  The old file is a pickled dict of coefficients keyed by bandwidth in MHz.
+  Unpickling can run arbitrary code, so only convert files you made.
+
+  @param pklfile : name of the pickle file
+  @type  pklfile : str
+
+  @param store : where the fits go
+  @type  store : BaselineStore instance
+  """
+  try:
+    from cPickle import load as load_pickle
+  except ImportError:
+    from pickle import load as load_pickle
+  coeffile = open(pklfile, "rb")
+  coef_dict = load_pickle(coeffile)
+  coeffile.close()
+  for bandwidth in coef_dict.keys():
+    store.add(coef_dict[bandwidth], bandwidth*1e6)
+  module_logger.info("convert_pickle: %d baselines from %s",
+                     len(coef_dict), pklfile)
+
+def robust_average(spectra, method="median", sigma=3., iterations=3):
+  """
+  Average of many spectra which is not pulled about by signals in a few
+
+  With "clip", values more than 'sigma' robust standard deviations (1.4826
+  times the median absolute deviation) from the median of their channel
+  are left out of the mean, and this is repeated 'iterations' times.
+
+  @param spectra : one spectrum per row
+  @type  spectra : numpy 2D array
+
+  @param method : "median", "clip" or "mean"
+  @type  method : str
+
+  @param sigma : clipping limit in standard deviations
+  @type  sigma : float
+
+  @param iterations : number of clipping passes
+  @type  iterations : int
+
+  @return: numpy array, one value per channel
+  """
+  if method == "median":
+    return median(spectra, axis=0)
+  if method == "mean":
+    return spectra.mean(axis=0)
+  if method != "clip":
+    raise ValueError("unknown averaging method %s" % method)
+  keep = spectra == spectra
+  for iteration in range(iterations):
+    kept = where(keep, spectra, nan)
+    center = _nanmedian(kept)
+    spread = 1.4826*_nanmedian(abs(kept - center))
+    keep = abs(spectra - center) <= sigma*spread
+  return where(keep, spectra, 0.).sum(axis=0)/keep.sum(axis=0)
+
+def _nanmedian(values):
+  """
+  Median of each column ignoring NaNs
+  """
+  # sorting puts the NaNs last, so the median of the valid ones is found by
+  # indexing each column at the middle of its own valid count
+  ordered = values.copy()
+  ordered.sort(axis=0)
+  count = (values == values).sum(axis=0)
+  columns = arange(values.shape[1])
+  low = ordered[(count-1)//2, columns]
+  high = ordered[count//2, columns]
+  return (low + high)/2.
+
+def read_baseline_files(filenames, num_bins=None):
+  """
+  Reads hires_scan baseline files, grouping the spectra by bandwidth
+
+  Older text files have (frequency in MHz, power) rows, one spectrum after
+  another.  Newer ones are SpectrogramArchives with one scan per row.  The
+  bandwidth is the step in the file name, e.g. 2.0 in
+  "baselines_0087.0:0109.0:2.0MHz.dat", and the number of channels is the
+  bandwidth over the channel spacing unless 'num_bins' is given.
+
+  @param filenames : baseline files
+  @type  filenames : list of str
+
+  @param num_bins : number of channels in each spectrum
+  @type  num_bins : int
+
+  @return: dict of (n_spectra, num_bins) arrays keyed by bandwidth in Hz
+  """
+  groups = {}
+  for filename in filenames:
+    match = re.search(r":([0-9.]+)MHz", os.path.basename(filename))
+    if not match:
+      raise ValueError("no bandwidth in file name %s" % filename)
+    bandwidth = float(match.group(1))*1e6
+    if os.path.isdir(filename):
+      archive = SpectrogramArchive(filename, mode="r")
+      segments = archive.select()
+      if not segments:
+        continue
+      spacing = segments[0][0]["channel_width"]
+      power = concatenate([archive.decode(rows).ravel()
+                           for info, times, rows in segments])
+    else:
+      data = loadtxt(filename)
+      spacing = (data[1,0] - data[0,0])*1e6
+      power = data[:,1]
+    bins = num_bins
+    if bins == None:
+      bins = int(round(bandwidth/spacing))
+    if len(power) % bins:
+      raise ValueError("%s: %d values is not a multiple of %d"
+                       % (filename, len(power), bins))
+    groups.setdefault((bandwidth, bins), []).append(power.reshape(-1, bins))
+  spectra = {}
+  for bandwidth, bins in groups.keys():
+    if bandwidth in spectra:
+      raise ValueError("files for %s Hz have different numbers of channels"
+                       % bandwidth)
+    spectra[bandwidth] = concatenate(groups[(bandwidth, bins)])
+    module_logger.debug("read_baseline_files: %d spectra of %d bins at %s Hz",
+                        len(spectra[bandwidth]), bins, bandwidth)
+  return spectra
+
+def fit_baselines(filenames, method="median", sigma=3.,
+                  degree=BASELINE_DEGREE, num_bins=None):
+  """
+  Fits a baseline for every bandwidth in a set of baseline files
+
+  Every spectrum is first divided by its own median, so that spectra taken
+  at different frequencies and power levels can be combined.  The spectra
+  for each bandwidth are then averaged as in 'robust_average', normalized
+  to a mean of one and fitted with a Chebyshev series.
+
+  @param filenames : baseline files written by hires_scan
+  @type  filenames : list of str
+
+  @param method : "median", "clip" or "mean"
+  @type  method : str
+
+  @param sigma : clipping limit for "clip"
+  @type  sigma : float
+
+  @param degree : degree of the Chebyshev series
+  @type  degree : int
+
+  @param num_bins : number of channels; default is found from the files
+  @type  num_bins : int
+
+  @return: dict of (offsets in MHz, average, coefficients) by bandwidth, Hz
+  """
+  fits = {}
+  spectra = read_baseline_files(filenames, num_bins)
+  for bandwidth in spectra.keys():
+    block = spectra[bandwidth]
+    block = block/median(block, axis=1)[:,None]
+    average = robust_average(block, method, sigma)
+    average /= average.mean()
+    offsets = bin_offsets(bandwidth, block.shape[1])
+    coefs = chebfit(offsets, average, degree)
+    fits[bandwidth] = (offsets, average, coefs)
+    module_logger.info("fit_baselines: %s MHz from %d spectra",
+                       bandwidth/1e6, len(block))
+  return fits
+
+class GainSweep(object):
+  """
+  Power at each of a list of frequencies for each of a list of gains
+
+  Retuning is the slowest thing the tuner does, so each frequency is tuned
+  once and all the gains are measured there before moving on.  After each
+  gain change 'settle' bytes are read and thrown away while the gain
+  settles.
+
+  The results are kept in 'power', a (frequency, gain) array with fields
+  'lsb', 'usb' and 'total', defined as in RtlSdr.get_power_scan: 'total' is
+  the mean of |x|**2 per sample from the raw bytes, with or without
+  'sidebands', and 'lsb' and 'usb' stay at zero without them.  Frequencies
+  not yet measured hold NaN.  If a file is given, the array is saved there
+  after every frequency and a sweep made with the same frequencies, gains
+  and 'sidebands' carries on from where the saved one stopped.
+
+  Public attributes::
+
+   sdr       - RtlSdr instance
+   freqs     - tuned frequencies, Hz
+   gains     - tuner gains, tenths of dB
+   filename  - npz file for the results
+   settle    - bytes discarded after each gain change
+   sidebands - False to measure only the total power
+   power     - (len(freqs), len(gains)) array of SWEEP_DTYPE
+  """
+  def __init__(self, sdr, freqs, gains, filename=None, settle=16384,
+               sidebands=True):
+    """
+    Creates a GainSweep instance, resuming from 'filename' if it exists.
+
+    @param sdr : configured device
+    @type  sdr : RtlSdr instance
+
+    @param freqs : frequencies to tune to, Hz
+    @type  freqs : sequence of float
+
+    @param gains : tuner gains, tenths of dB, from 'get_tuner_gains'
+    @type  gains : sequence of int
+
+    @param filename : npz file for the results
+    @type  filename : str
+
+    @param settle : bytes to discard after each gain change
+    @type  settle : int
+
+    @param sidebands : separate the sidebands; False for total power only
+    @type  sidebands : bool
+    """
+    self.logger = logging.getLogger(module_logger.name+".GainSweep")
+    self.sdr = sdr
+    self.freqs = asarray(freqs, dtype=float64)
+    self.gains = asarray(gains, dtype=int64)
+    self.filename = filename
+    self.settle = settle
+    self.sidebands = sidebands
+    self.power = empty((len(self.freqs), len(self.gains)), dtype=SWEEP_DTYPE)
+    self.power.fill(nan)
+    if filename and os.path.exists(filename):
+      self.load()
+
+  def done(self):
+    """
+    Which frequencies have been measured at every gain
+
+    @return: numpy array of bool, one per frequency
+    """
+    return ~isnan(self.power['total']).any(axis=1)
+
+  def _measure(self, record, data):
+    """
+    Reads a block and fills in one (frequency, gain) record
+    """
+    if self.settle:
+      self.sdr.synch_read_raw(self.settle)
+    rawdata = self.sdr.synch_read_raw()
+    if rawdata.min() < 8 or rawdata.max() > 248:
+      self.logger.warning("_measure: saturating; min=%d, max=%d",
+                          int(rawdata.min())-128, int(rawdata.max())-128)
+    datalen = len(rawdata)//2
+    # the sidebands share the DC and Nyquist bins, so their powers do not
+    # give the total
+    record['total'] = self.sdr.decoder.power(rawdata)/datalen
+    if self.sidebands:
+      samples = self.sdr.decoder(rawdata, out=data[:datalen])
+      record['lsb'], record['usb'] = sideband_power(samples)
+    else:
+      record['lsb'] = record['usb'] = 0.
+
+  def run(self):
+    """
+    Measures every frequency not yet done
+
+    @return: the 'power' array
+    """
+    data = empty(self.sdr.blk_size//2, dtype=complex64)
+    done = self.done()
+    start = time.time()
+    for index in range(len(self.freqs)):
+      if done[index]:
+        continue
+      cf = self.sdr.set_freq(int(self.freqs[index]))
+      self.sdr.reset_buffer()
+      time.sleep(0.01)
+      for gain_index in range(len(self.gains)):
+        self.sdr.set_gain(int(self.gains[gain_index]))
+        self._measure(self.power[index, gain_index], data)
+      self.logger.debug("run: %7.2f MHz done", cf/1e6)
+      if self.filename:
+        self.save()
+    self.logger.info("run: %d frequencies in %.1f s", (~done).sum(),
+                     time.time() - start)
+    return self.power
+
+  def save(self, filename=None):
+    """
+    Writes the sweep so far
+
+    The file is written under another name and then renamed, so an
+    interrupted save does not spoil the previous one.
+
+    @param filename : npz file; default is the one the sweep was made with
+    @type  filename : str
+    """
+    if filename == None:
+      filename = self.filename
+    temp = filename+".tmp"
+    fd = open(temp, "wb")
+    savez(fd, version=array(STORE_VERSION), freqs=self.freqs,
+          gains=self.gains, sidebands=array(self.sidebands),
+          power=self.power)
+    fd.close()
+    os.rename(temp, filename)
+
+  def load(self, filename=None):
+    """
+    Reads the results of an earlier sweep with the same settings
+
+    The frequencies, the gains and whether the sidebands were separated must
+    all be the same, so that every row means the same thing.
+
+    @param filename : npz file; default is the one the sweep was made with
+    @type  filename : str
+    """
+    if filename == None:
+      filename = self.filename
+    stored = load(filename, allow_pickle=False)
+    if int(stored["version"]) > STORE_VERSION:
+      raise ValueError("%s has sweep format %d; this reads up to %d"
+                       % (filename, int(stored["version"]), STORE_VERSION))
+    if (stored["freqs"].shape != self.freqs.shape or
+        stored["gains"].shape != self.gains.shape or
+        not all(stored["freqs"] == self.freqs) or
+        not all(stored["gains"] == self.gains)):
+      raise ValueError("%s is for different frequencies or gains" % filename)
+    if ("sidebands" not in stored.files or
+        bool(stored["sidebands"]) != bool(self.sidebands)):
+      raise ValueError("%s was not swept with sidebands=%s"
+                       % (filename, self.sidebands))
+    self.power[...] = stored["power"]
+    self.logger.info("load: %d of %d frequencies already done",
+                     self.done().sum(), len(self.freqs))
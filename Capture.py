@@ -0,0 +1,599 @@
+"""
+module Capture for recording and reading files of raw samples
+
+Files written by 'rtl_sdr', or by the Recorder in this module, hold
+alternating unsigned 8-bit I and Q bytes with no header.  CaptureFile maps
+such a file into memory instead of reading it, so a recording of any size
+opens at once and only the parts actually used are read from disk.
+
+The Recorder names its files in the SigMF style: the samples go in
+'<name>.sigmf-data' and a JSON description in '<name>.sigmf-meta'.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from numpy import complex64, empty, memmap, uint8
+
+from RealtekSDR.Buffers import BlockRing
+from RealtekSDR.Signals import IQDecoder, make_spectrogram
+
+module_logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK = 2**20 # samples
+DEFAULT_WRITE_SIZE = 2**22 # bytes
+SIGMF_VERSION = "1.0.0"
+
+def read_sigmf_meta(filename):
+  """
+  The SigMF description of a data file, if there is one
+
+  @param filename : name of the '.sigmf-data' file
+  @type  filename : str
+
+  @return: dict, or None
+  """
+  if not filename.endswith(".sigmf-data"):
+    return None
+  metafile = filename[:-len("data")]+"meta"
+  if not os.path.exists(metafile):
+    return None
+  fd = open(metafile)
+  meta = json.load(fd)
+  fd.close()
+  return meta
+
+class CaptureFile(object):
+  """
+  Memory-mapped file of raw I/Q bytes
+
+  Samples are addressed by their index from the start of the file, or by
+  their time from the start if the sample rate is known.  Chunks are decoded
+  into one complex64 buffer which is reused, so going through the whole file
+  takes constant memory.
+
+  The sample rate and frequency are taken from a SigMF description of the
+  file if one is found and they are not given.
+
+  Public attributes::
+
+   filename    - name of the file
+   sample_rate - samples per second, if known
+   center_freq - tuned frequency, Hz, if known
+   raw         - the file as a read-only numpy memmap of uint8
+   num_samples - number of complete I/Q pairs in the file
+   decoder     - IQDecoder used to convert the bytes
+  """
+  def __init__(self, filename, sample_rate=None, center_freq=None):
+    """
+    Creates a CaptureFile instance.
+
+    @param filename : file of alternating I and Q bytes
+    @type  filename : str
+
+    @param sample_rate : samples per second
+    @type  sample_rate : float
+
+    @param center_freq : tuned frequency, Hz
+    @type  center_freq : float
+    """
+    self.logger = logging.getLogger(module_logger.name+".CaptureFile")
+    self.filename = filename
+    meta = read_sigmf_meta(filename)
+    if meta:
+      if sample_rate == None:
+        sample_rate = meta["global"].get("core:sample_rate")
+      if center_freq == None and meta["captures"]:
+        center_freq = meta["captures"][0].get("core:frequency")
+    self.sample_rate = sample_rate
+    self.center_freq = center_freq
+    if os.path.getsize(filename):
+      self.raw = memmap(filename, dtype=uint8, mode="r")
+    else:
+      # an empty file cannot be mapped
+      self.raw = empty(0, dtype=uint8)
+    self.num_samples = len(self.raw)//2
+    self.decoder = IQDecoder()
+    self._buffer = None
+    self.logger.debug("__init__: %s has %d samples", filename,
+                      self.num_samples)
+
+  def __len__(self):
+    return self.num_samples
+
+  def duration(self):
+    """
+    Length of the recording
+
+    @return: float, seconds
+    """
+    return self.num_samples/float(self.sample_rate)
+
+  def index(self, seconds):
+    """
+    Index of the sample taken a given time after the first
+
+    @param seconds : time from the start of the file
+    @type  seconds : float
+
+    @return: int
+    """
+    if self.sample_rate == None:
+      raise ValueError("the sample rate of %s is not known" % self.filename)
+    return int(round(seconds*self.sample_rate))
+
+  def read_raw(self, start, num_samples):
+    """
+    Raw bytes of some samples, without copying them
+
+    @param start : index of the first sample
+    @type  start : int
+
+    @param num_samples : number of samples; fewer at the end of the file
+    @type  num_samples : int
+
+    @return: numpy array of uint8, two per sample
+    """
+    stop = min(start + num_samples, self.num_samples)
+    return self.raw[2*start:2*stop]
+
+  def read(self, start, num_samples, out=None):
+    """
+    Decoded samples
+
+    @param start : index of the first sample
+    @type  start : int
+
+    @param num_samples : number of samples; fewer at the end of the file
+    @type  num_samples : int
+
+    @param out : optional array for the result
+    @type  out : numpy array of complex64
+
+    @return: numpy array of complex64
+    """
+    rawdata = self.read_raw(start, num_samples)
+    if out is not None:
+      out = out[:len(rawdata)//2]
+    return self.decoder(rawdata, out=out)
+
+  def read_time(self, seconds, duration, out=None):
+    """
+    Decoded samples for a span of time
+
+    @param seconds : time of the first sample from the start of the file
+    @type  seconds : float
+
+    @param duration : length of the span, s
+    @type  duration : float
+
+    @param out : optional array for the result
+    @type  out : numpy array of complex64
+
+    @return: numpy array of complex64
+    """
+    return self.read(self.index(seconds), self.index(duration), out=out)
+
+  def chunks(self, chunk_size=DEFAULT_CHUNK, start=0, stop=None):
+    """
+    Decoded samples a chunk at a time
+
+    Each chunk is decoded into the same buffer, which is only valid until
+    the next chunk is asked for.
+
+    @param chunk_size : samples per chunk; the last may be shorter
+    @type  chunk_size : int
+
+    @param start : index of the first sample
+    @type  start : int
+
+    @param stop : index after the last sample; default is the end
+    @type  stop : int
+
+    @return: generator of (index of first sample, numpy array of complex64)
+    """
+    if stop == None or stop > self.num_samples:
+      stop = self.num_samples
+    if self._buffer is None or len(self._buffer) < chunk_size:
+      self._buffer = empty(chunk_size, dtype=complex64)
+    for first in range(start, stop, chunk_size):
+      num = min(chunk_size, stop - first)
+      yield first, self.read(first, num, out=self._buffer)
+
+  def spectrogram(self, num_bins, num_spec, start=0, stop=None, **kwargs):
+    """
+    Spectrogram of the file 'num_spec' spectra at a time
+
+    The keyword arguments are passed to Signals.make_spectrogram.  Samples
+    at the end which do not fill a block are left out.
+
+    @param num_bins : number of channels in a spectrum
+    @type  num_bins : int
+
+    @param num_spec : number of spectra in each block
+    @type  num_spec : int
+
+    @param start : index of the first sample
+    @type  start : int
+
+    @param stop : index after the last sample; default is the end
+    @type  stop : int
+
+    @return: generator of (index of first sample, float32 2D array)
+    """
+    chunk_size = num_bins*num_spec
+    for first, data in self.chunks(chunk_size, start, stop):
+      if len(data) < chunk_size:
+        break
+      yield first, make_spectrogram(data, num_spec, num_bins, **kwargs)
+
+  def histogram(self, i_hist, q_hist, chunk_size=DEFAULT_CHUNK, start=0,
+                stop=None):
+    """
+    Adds the I and Q values of the file to two histograms
+
+    @param i_hist : histogram for the in-phase values
+    @type  i_hist : Signals.StreamingHistogram instance
+
+    @param q_hist : histogram for the quadrature values
+    @type  q_hist : Signals.StreamingHistogram instance
+
+    @param chunk_size : samples per chunk
+    @type  chunk_size : int
+
+    @param start : index of the first sample
+    @type  start : int
+
+    @param stop : index after the last sample; default is the end
+    @type  stop : int
+    """
+    for first, data in self.chunks(chunk_size, start, stop):
+      i_hist.update(data.real)
+      q_hist.update(data.imag)
+
+def _iso_time(seconds):
+  """
+  UTC date and time as SigMF wants it
+  """
+  return datetime.datetime.utcfromtimestamp(seconds).strftime(
+                                                      "%Y-%m-%dT%H:%M:%S.%fZ")
+
+class Recorder(object):
+  """
+  Writes raw sample blocks to disk from a thread of its own
+
+  'write' only copies a block into a BlockRing and returns, so the thread
+  taking data from the dongle is never held up by the disk.  If the disk
+  falls behind for longer than the ring can cover, blocks are dropped and
+  counted.  The writer thread gathers blocks into one large buffer and
+  writes it in a single call, so the disk sees few, large writes whose
+  sizes are multiples of the page size.
+
+  A new file is started when the current one would exceed 'max_bytes'.
+  Each file gets a SigMF description which is written when the file is
+  opened and again, with the number of blocks dropped, when it is closed.
+  After a gap a new capture segment is added to the description with the
+  time of the first sample after it.
+
+  Public attributes::
+
+   basename    - file names are '<basename>_<number>.sigmf-data' etc.
+   sample_rate - samples per second
+   center_freq - tuned frequency, Hz
+   gain        - tuner gain, tenths of dB, if known
+   blk_size    - largest block 'write' accepts, bytes
+   write_size  - bytes per disk write
+   max_bytes   - bytes per file; None for one file
+   files       - names of the data files written so far
+   written     - total bytes written
+   start_time  - time of the first sample, s since the epoch
+  """
+  def __init__(self, basename, sample_rate, center_freq, gain=None,
+               blk_size=2**18, num_blocks=64, write_size=DEFAULT_WRITE_SIZE,
+               max_bytes=None):
+    """
+    Creates a Recorder instance and starts its writer thread.
+
+    @param basename : path and start of the file names
+    @type  basename : str
+
+    @param sample_rate : samples per second
+    @type  sample_rate : float
+
+    @param center_freq : tuned frequency, Hz
+    @type  center_freq : float
+
+    @param gain : tuner gain, tenths of dB
+    @type  gain : int
+
+    @param blk_size : largest block 'write' accepts, bytes
+    @type  blk_size : int
+
+    @param num_blocks : number of blocks the ring holds
+    @type  num_blocks : int
+
+    @param write_size : bytes per disk write; rounded to a multiple of 4096
+    @type  write_size : int
+
+    @param max_bytes : bytes per file; rounded to a multiple of 'write_size'
+    @type  max_bytes : int
+    """
+    self.logger = logging.getLogger(module_logger.name+".Recorder")
+    self.basename = basename
+    self.sample_rate = sample_rate
+    self.center_freq = center_freq
+    self.gain = gain
+    self.blk_size = blk_size
+    self.write_size = max(write_size//4096, 1)*4096
+    if max_bytes:
+      max_bytes = max(max_bytes//self.write_size, 1)*self.write_size
+    self.max_bytes = max_bytes
+    self.files = []
+    self.written = 0
+    self.start_time = None
+    self.ring = BlockRing(blk_size, num_blocks)
+    self._buffer = empty(self.write_size, dtype=uint8)
+    self._fill = 0
+    self._fd = None
+    self._meta = None
+    self._file_start = 0   # index in the recording of the file's first sample
+    self._file_bytes = 0
+    self._file_dropped = 0
+    # gaps not yet written out, as (index in the recording of the sample
+    # after the gap, blocks lost, samples lost up to then)
+    self._gaps = []
+    self._lost = 0         # samples lost since the first one recorded
+    self._lost_written = 0 # samples lost before the data written so far
+    self._writer = threading.Thread(target=self._run)
+    self._writer.daemon = True
+    self._writer.start()
+
+  def dropped(self):
+    """
+    Blocks lost so far, by the recorder or upstream of it
+
+    @return: int
+    """
+    return self.ring.dropped
+
+  def write(self, block, skipped=0):
+    """
+    Queues a block for the writer thread
+
+    @param block : raw I/Q bytes
+    @type  block : numpy array of uint8
+
+    @param skipped : blocks lost upstream just before this one
+    @type  skipped : int
+
+    @return: False if the block was dropped
+    """
+    if len(block) > self.blk_size:
+      raise ValueError("block of %d bytes; at most %d"
+                       % (len(block), self.blk_size))
+    if self.start_time == None:
+      self.start_time = time.time()
+    return self.ring.put(block.ctypes.data, len(block), skipped)
+
+  def close(self):
+    """
+    Writes everything still queued and closes the files
+    """
+    self.ring.close()
+    self._writer.join()
+    self.logger.info("close: %d bytes in %d files, %d blocks dropped",
+                     self.written, len(self.files), self.ring.dropped)
+
+  def _run(self):
+    """
+    Body of the writer thread
+    """
+    while True:
+      block = self.ring.get()
+      if block is None:
+        break
+      if self.ring.gap:
+        self._gap(self.ring.gap)
+      self._append(block)
+    self._flush()
+    # blocks lost after the last one written still count against the file
+    for index, num_blocks, lost in self._gaps:
+      self._file_dropped += num_blocks
+    self._gaps = []
+    self._close_file()
+
+  def _gap(self, num_blocks):
+    """
+    Notes lost blocks, to be put in the description of the file they fall in
+    """
+    index = (self.written + self._fill)//2
+    if index:
+      self._lost += num_blocks*self.blk_size//2
+    # blocks lost before the first sample do not move its time
+    self._gaps.append((index, num_blocks, self._lost))
+
+  def _append(self, block):
+    """
+    Copies a block into the write buffer, writing it out when full
+    """
+    done = 0
+    while done < len(block):
+      num = min(len(block) - done, self.write_size - self._fill)
+      self._buffer[self._fill:self._fill+num] = block[done:done+num]
+      self._fill += num
+      done += num
+      if self._fill == self.write_size:
+        self._flush()
+
+  def _flush(self):
+    """
+    Writes the buffer to the current file, starting a new one if needed
+    """
+    if not self._fill:
+      return
+    if self._fd == None or (self.max_bytes and
+                            self._file_bytes + self._fill > self.max_bytes):
+      self._close_file()
+      self._open_file()
+    # gaps up to the last sample in the buffer belong to this file; one just
+    # after it belongs to whatever is written next
+    first = self.written//2
+    end = first + self._fill//2
+    while self._gaps and self._gaps[0][0] < end:
+      index, num_blocks, lost = self._gaps.pop(0)
+      self._file_dropped += num_blocks
+      self._lost_written = lost
+      if index > self._file_start:
+        self._meta["captures"].append(
+                             self._capture(index - self._file_start, lost))
+    self._buffer[:self._fill].tofile(self._fd)
+    self._file_bytes += self._fill
+    self.written += self._fill
+    self._fill = 0
+
+  def _capture(self, sample_start, lost):
+    """
+    SigMF capture segment starting at a sample of the current file
+
+    @param sample_start : index of the sample in the file
+    @type  sample_start : int
+
+    @param lost : samples lost before that sample
+    @type  lost : int
+    """
+    samples_ahead = self._file_start + sample_start + lost
+    return {"core:sample_start": sample_start,
+            "core:frequency": self.center_freq,
+            "core:datetime": _iso_time(self.start_time +
+                                       samples_ahead/float(self.sample_rate))}
+
+  def _open_file(self):
+    """
+    Starts the next data file and its description
+    """
+    name = "%s_%04d" % (self.basename, len(self.files))
+    self._fd = open(name+".sigmf-data", "wb", 0)
+    self._file_start = self.written//2
+    self._file_bytes = 0
+    self._file_dropped = 0
+    # a gap just before the file's first sample moves its start time
+    lost = self._lost_written
+    for index, num_blocks, gap_lost in self._gaps:
+      if index == self._file_start:
+        lost = gap_lost
+    self.files.append(name+".sigmf-data")
+    description = {"core:datatype": "cu8",
+                   "core:sample_rate": self.sample_rate,
+                   "core:version": SIGMF_VERSION,
+                   "core:recorder": "RealtekSDR"}
+    if self.gain != None:
+      description["rtlsdr:gain"] = self.gain
+    self._meta = {"global": description,
+                  "captures": [self._capture(0, lost)],
+                  "annotations": []}
+    self._write_meta()
+    self.logger.debug("_open_file: %s", name)
+
+  def _close_file(self):
+    """
+    Closes the current data file and completes its description
+    """
+    if self._fd == None:
+      return
+    self._fd.close()
+    self._fd = None
+    self._meta["global"]["rtlsdr:dropped_blocks"] = self._file_dropped
+    self._write_meta()
+
+  def _write_meta(self):
+    """
+    Writes the description of the current file
+    """
+    fd = open(self.files[-1][:-len("data")]+"meta", "w")
+    json.dump(self._meta, fd, indent=2, sort_keys=True)
+    fd.close()
+
+def record(sdr, basename, duration=None, **kwargs):
+  """
+  Records the SDR's stream until 'duration' seconds or Ctrl-C
+
+  The keyword arguments are passed to Recorder.
+
+  @param sdr : configured device
+  @type  sdr : RtlSdr instance
+
+  @param basename : path and start of the file names
+  @type  basename : str
+
+  @param duration : seconds to record; None for no limit
+  @type  duration : float
+
+  @return: the Recorder, closed
+  """
+  sample_rate = sdr.get_samplerate()
+  recorder = Recorder(basename, sample_rate, sdr.get_freq(),
+                      gain=sdr.get_gain(), blk_size=sdr.blk_size, **kwargs)
+  samples = 0
+  blocks = sdr.stream()
+  try:
+    for block in blocks:
+      recorder.write(block, skipped=sdr.ring.gap)
+      samples += (1 + sdr.ring.gap)*len(block)//2
+      if duration and samples >= duration*sample_rate:
+        break
+  except KeyboardInterrupt:
+    pass
+  finally:
+    blocks.close()
+    recorder.close()
+  return recorder
+
+#################### module test program ################################
+
+if __name__ == "__main__":
+  import shutil
+  import tempfile
+  from numpy import zeros
+
+  logging.basicConfig()
+
+  def check_gaps(write_size, max_bytes):
+    """
+    Blocks lost before the first flush must still reach the descriptions
+    """
+    directory = tempfile.mkdtemp()
+    try:
+      # 256 samples a block at 1 kHz; one block, three lost, then forty
+      recorder = Recorder(os.path.join(directory, "rec"), 1000., 1e8,
+                          blk_size=512, write_size=write_size,
+                          max_bytes=max_bytes)
+      block = zeros(512, dtype=uint8)
+      recorder.write(block)
+      start = recorder.start_time
+      recorder.write(block, skipped=3)
+      for index in range(39):
+        recorder.write(block)
+      recorder.close()
+      metas = [read_sigmf_meta(name) for name in recorder.files]
+      assert sum([meta["global"]["rtlsdr:dropped_blocks"]
+                  for meta in metas]) == 3
+      captures = metas[0]["captures"]
+      assert metas[0]["global"]["rtlsdr:dropped_blocks"] == 3
+      assert captures[0]["core:datetime"] == _iso_time(start)
+      assert captures[1]["core:sample_start"] == 256
+      assert captures[1]["core:datetime"] == _iso_time(start + 1.024)
+      # every later file starts 4 blocks of time later than its samples
+      first = 0
+      for meta, name in zip(metas, recorder.files):
+        if first:
+          assert meta["captures"][0]["core:datetime"] == \
+                                  _iso_time(start + (first + 768)/1000.)
+        first += os.path.getsize(name)//2
+    finally:
+      shutil.rmtree(directory)
+
+  check_gaps(DEFAULT_WRITE_SIZE, None)
+  check_gaps(4096, 8192)
+  print("Recorder gaps OK")
@@ -0,0 +1,238 @@
+"""
+module FFTbackend for choosing how FFTs are computed
+
+Three backends are supported::
+
+  numpy - numpy.fft; always available
+  scipy - scipy.fft (scipy 1.4 or later) using several worker threads and
+          keeping single precision input in single precision
+  fftw  - pyFFTW, with FFTW plans built once per size and type and the
+          accumulated wisdom saved to disk at exit for the next session
+
+On import the scipy backend is used if it can be, otherwise numpy.  FFTW
+planning takes time and writes a wisdom file, so that backend is only used
+when asked for with 'set_backend("fftw")'.
+
+Whatever the backend, 'fft' and 'ifft' look up a plan keyed by the backend,
+array shape, type, axis and direction, so repeated transforms of the same
+size, as in every hop of a scan or every frame of a waterfall, reuse it.
+Only the MAX_PLANS most recently used plans are kept, so odd shapes such as
+the short last batch of a spectrogram do not pile up.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+import numpy.fft
+from numpy import dtype as np_dtype
+from numpy import frombuffer, savez, load, uint8
+
+try:
+  import scipy.fft as scipy_fft
+except ImportError:
+  scipy_fft = None
+try:
+  import pyfftw
+except ImportError:
+  pyfftw = None
+
+module_logger = logging.getLogger(__name__)
+
+WISDOM_FILE = os.path.expanduser("~/.RealtekSDR_fftw_wisdom.npz")
+MAX_PLANS = 16
+
+_backend = None
+_workers = 1
+_plans = OrderedDict()   # least recently used first
+_plans_lock = threading.Lock()
+_new_wisdom = False      # FFTW has planned something since the last save
+
+def available_backends():
+  """
+  Names of the backends which can be used here
+
+  @return: list of str
+  """
+  names = ["numpy"]
+  if scipy_fft:
+    names.append("scipy")
+  if pyfftw:
+    names.append("fftw")
+  return names
+
+def set_backend(name=None, workers=None):
+  """
+  Selects the FFT backend
+
+  @param name : "numpy", "scipy" or "fftw"; None for the best of numpy/scipy
+  @type  name : str
+
+  @param workers : number of threads; default is the number of CPUs
+  @type  workers : int
+
+  @return: name of the backend now in use
+  """
+  global _backend, _workers
+  if name == None:
+    if scipy_fft:
+      name = "scipy"
+    else:
+      name = "numpy"
+  if name not in available_backends():
+    raise ValueError("FFT backend %s is not available" % name)
+  if workers == None:
+    workers = multiprocessing.cpu_count()
+  if name == "fftw" and _backend != "fftw":
+    load_wisdom()
+    atexit.register(_save_new_wisdom)
+  _backend = name
+  _workers = workers
+  module_logger.debug("set_backend: %s with %d workers", name, workers)
+  return _backend
+
+def get_backend():
+  """
+  Name of the backend in use
+
+  @return: str
+  """
+  return _backend
+
+def clear_plans():
+  """
+  Forgets all cached plans
+  """
+  with _plans_lock:
+    _plans.clear()
+
+def _plan(shape, dtype, axis, inverse):
+  """
+  Returns a function which transforms arrays of one shape and type
+
+  FFTW plans carry their own arrays, so each thread gets its own.
+  """
+  global _new_wisdom
+  key = (_backend, _workers, shape, dtype.str, axis, inverse)
+  if _backend == "fftw":
+    key += (threading.current_thread().ident,)
+  with _plans_lock:
+    transform = _plans.pop(key, None)
+    if transform != None:
+      # put back at the most recently used end
+      _plans[key] = transform
+      return transform
+  if _backend == "fftw":
+    if dtype.kind != 'c':
+      dtype = np_dtype(complex)
+    inp = pyfftw.empty_aligned(shape, dtype=dtype)
+    out = pyfftw.empty_aligned(shape, dtype=dtype)
+    if inverse:
+      direction = "FFTW_BACKWARD"
+    else:
+      direction = "FFTW_FORWARD"
+    fftw = pyfftw.FFTW(inp, out, axes=(axis,), direction=direction,
+                       flags=("FFTW_MEASURE",), threads=_workers)
+    def transform(a):
+      # a fresh output array so earlier results are not overwritten
+      return fftw(a, pyfftw.empty_aligned(shape, dtype=dtype))
+    _new_wisdom = True
+  elif _backend == "scipy":
+    if inverse:
+      function = scipy_fft.ifft
+    else:
+      function = scipy_fft.fft
+    def transform(a):
+      return function(a, axis=axis, workers=_workers)
+  else:
+    if inverse:
+      function = numpy.fft.ifft
+    else:
+      function = numpy.fft.fft
+    def transform(a):
+      return function(a, axis=axis)
+  module_logger.debug("_plan: new %s plan for %s %s", _backend, shape,
+                      dtype)
+  with _plans_lock:
+    _plans[key] = transform
+    while len(_plans) > MAX_PLANS:
+      _plans.popitem(last=False)
+  return transform
+
+def fft(a, axis=-1):
+  """
+  Forward discrete Fourier transform along one axis, as numpy.fft.fft
+
+  @param a : data
+  @type  a : numpy array
+
+  @param axis : axis to transform
+  @type  axis : int
+
+  @return: numpy array of complex
+  """
+  return _plan(a.shape, a.dtype, axis, False)(a)
+
+def ifft(a, axis=-1):
+  """
+  Inverse discrete Fourier transform along one axis, as numpy.fft.ifft
+
+  @param a : data
+  @type  a : numpy array
+
+  @param axis : axis to transform
+  @type  axis : int
+
+  @return: numpy array of complex
+  """
+  return _plan(a.shape, a.dtype, axis, True)(a)
+
+def load_wisdom(filename=WISDOM_FILE):
+  """
+  Gives FFTW the plans worked out in earlier sessions
+
+  @param filename : wisdom file written by 'save_wisdom'
+  @type  filename : str
+  """
+  if not pyfftw or not os.path.exists(filename):
+    return
+  stored = load(filename)
+  wisdom = tuple(stored["wisdom%d" % index].tobytes()
+                 for index in range(len(stored.files)))
+  pyfftw.import_wisdom(wisdom)
+  module_logger.debug("load_wisdom: from %s", filename)
+
+def save_wisdom(filename=WISDOM_FILE):
+  """
+  Saves what FFTW has learnt about planning
+
+  This is done at exit if the fftw backend made any plans; call it to save
+  sooner.  The wisdom is three byte strings (double, single and long
+  double) which are stored as uint8 arrays in an npz file.
+
+  @param filename : where to save it
+  @type  filename : str
+  """
+  if not pyfftw:
+    return
+  wisdom = pyfftw.export_wisdom()
+  arrays = {}
+  for index in range(len(wisdom)):
+    arrays["wisdom%d" % index] = frombuffer(wisdom[index], dtype=uint8)
+  try:
+    savez(filename, **arrays)
+  except IOError as details:
+    module_logger.warning("save_wisdom: cannot write %s: %s",
+                          filename, details)
+
+def _save_new_wisdom():
+  """
+  Saves the wisdom at exit if there is anything new in it
+  """
+  global _new_wisdom
+  if _new_wisdom:
+    save_wisdom()
+    _new_wisdom = False
+
+set_backend()
@@ -0,0 +1,423 @@
+"""
+module Monitors for unattended measurements with an RtlSdr
+
+These keep only reduced results, so they can run for long periods.  Most
+drive the SDR themselves; EventDetector works on spectra from any source.
+"""
+import logging
+import time
+from numpy import abs, array, concatenate, empty, float32, float64, hanning
+from numpy import int32, maximum, median, nonzero, sign, zeros
+from numpy.fft import fftfreq, fftshift
+
+from RealtekSDR.Signals import make_spectrogram
+from RealtekSDR.stations import FM_station
+
+module_logger = logging.getLogger(__name__)
+
+def plan_captures(freqs, sample_rate, channel_width=200e3, usable=0.8):
+  """
+  Finds the fewest tunings which between them cover all the frequencies
+
+  Each capture can use the central 'usable' fraction of its bandwidth and a
+  channel must fit inside that.  Working up from the lowest frequency, each
+  capture is placed as high as it can be while still covering the lowest
+  frequency not yet covered, which gives the minimum number of captures.
+
+  @param freqs : channel center frequencies, Hz
+  @type  freqs : list of float
+
+  @param sample_rate : samples per second (= bandwidth)
+  @type  sample_rate : float
+
+  @param channel_width : width of each channel, Hz
+  @type  channel_width : float
+
+  @param usable : fraction of the band clear of the filter roll-off
+  @type  usable : float
+
+  @return: list of (center frequency, list of channel frequencies)
+  """
+  reach = usable*sample_rate/2 - channel_width/2
+  if reach < 0:
+    raise ValueError("channel is wider than the usable band")
+  captures = []
+  remaining = sorted(freqs)
+  while remaining:
+    center = remaining[0] + reach
+    covered = [f for f in remaining if f <= center + reach]
+    captures.append((center, covered))
+    remaining = remaining[len(covered):]
+  return captures
+
+class StationMonitor(object):
+  """
+  Measures the power of many stations with a few tunings per cycle
+
+  The stations are grouped into as few captures as possible by
+  'plan_captures'.  For every capture a matrix of bin masks, one row per
+  station, is made in advance; each cycle then needs one tuning, one read
+  and one batched spectrogram per capture, and a single matrix product
+  gives the power of all the stations in it.
+
+  Public attributes::
+
+   sdr        - RtlSdr (or compatible) instance
+   stations   - station frequency in MHz for each call sign
+   captures   - list of (center frequency in Hz, list of call signs)
+   num_bins   - channels in the spectra
+   times      - time of each cycle
+   series     - list of powers, one per cycle, for each call sign
+   retunes    - number of tunings so far
+  """
+  def __init__(self, sdr, stations=None, sample_rate=2400000, num_bins=1024,
+               num_spec=64, channel_width=200e3, usable=0.8, settle=0.01):
+    """
+    Creates a StationMonitor instance.
+
+    @param sdr : device to use
+    @type  sdr : RtlSdr instance
+
+    @param stations : call sign for each frequency in MHz; default FM_station
+    @type  stations : dict
+
+    @param sample_rate : samples per second
+    @type  sample_rate : int
+
+    @param num_bins : channels in the spectra
+    @type  num_bins : int
+
+    @param num_spec : spectra averaged per capture
+    @type  num_spec : int
+
+    @param channel_width : bandwidth of a station, Hz
+    @type  channel_width : float
+
+    @param usable : fraction of the band clear of the filter roll-off
+    @type  usable : float
+
+    @param settle : seconds to wait after tuning
+    @type  settle : float
+    """
+    self.logger = logging.getLogger(module_logger.name+".StationMonitor")
+    if stations == None:
+      stations = FM_station
+    self.sdr = sdr
+    self.stations = dict([(stations[f], f) for f in stations.keys()])
+    self.sample_rate = sdr.set_samplerate(sample_rate)
+    self.num_bins = num_bins
+    self.num_spec = num_spec
+    self.settle = settle
+    self.window = hanning(num_bins).astype(float32)
+    self._image = empty((num_spec, num_bins), dtype=float32)
+    # bin frequencies relative to the center, in make_spectrogram order
+    offsets = fftshift(fftfreq(num_bins, 1./self.sample_rate))
+    by_freq = dict([(f*1e6, stations[f]) for f in stations.keys()])
+    self.captures = []
+    self._masks = []
+    for center, freqs in plan_captures(by_freq.keys(), self.sample_rate,
+                                       channel_width, usable):
+      masks = zeros((len(freqs), num_bins), dtype=float32)
+      for row in range(len(freqs)):
+        in_channel = abs(offsets - (freqs[row] - center)) < channel_width/2
+        masks[row, in_channel] = 1
+      self.captures.append((int(round(center)),
+                            [by_freq[f] for f in freqs]))
+      self._masks.append(masks)
+    self.logger.info("__init__: %d stations in %d captures",
+                     len(self.stations), len(self.captures))
+    self.times = []
+    self.series = dict([(call, []) for call in self.stations.keys()])
+    self.retunes = 0
+
+  def cycle(self):
+    """
+    Measures every station once
+
+    @return: dict of power for each call sign
+    """
+    powers = {}
+    for index in range(len(self.captures)):
+      center, calls = self.captures[index]
+      self.sdr.set_freq(center)
+      self.sdr.reset_buffer()
+      self.retunes += 1
+      time.sleep(self.settle)
+      data = self.sdr.get_data_block(2*self.num_spec*self.num_bins)
+      make_spectrogram(data, self.num_spec, self.num_bins,
+                       window=self.window, out=self._image)
+      spectrum = self._image.mean(axis=0)
+      station_powers = self._masks[index].dot(spectrum)
+      for row in range(len(calls)):
+        powers[calls[row]] = station_powers[row]
+    self.times.append(time.time())
+    for call in powers.keys():
+      self.series[call].append(powers[call])
+    return powers
+
+  def run(self, num_cycles, interval=0):
+    """
+    Measures every station 'num_cycles' times
+
+    @param num_cycles : number of cycles
+    @type  num_cycles : int
+
+    @param interval : minimum seconds from one cycle to the next
+    @type  interval : float
+
+    @return: times and power series (see 'time_series')
+    """
+    for count in range(num_cycles):
+      started = time.time()
+      self.cycle()
+      self.logger.debug("run: cycle %d took %.2f s", count,
+                        time.time()-started)
+      delay = interval - (time.time() - started)
+      if delay > 0:
+        time.sleep(delay)
+    return self.time_series()
+
+  def time_series(self):
+    """
+    Results so far as arrays
+
+    @return: (times array, dict of power arrays by call sign)
+    """
+    return array(self.times), dict([(call, array(self.series[call]))
+                                    for call in self.series.keys()])
+
+# one record per burst
+EVENT_DTYPE = [('time', float64), ('channel', int32), ('snr', float32),
+               ('duration', float32)]
+
+class EventDetector(object):
+  """
+  Finds bursts in a stream of power spectra against an adaptive noise floor
+
+  For each channel a running median and median absolute deviation (MAD) of
+  the power are tracked with the frugal streaming estimator: each spectrum
+  nudges the median up or down by a fraction of the MAD, so neither the
+  spectra nor a history of them is kept.  The estimates are not updated in
+  channels where an event is in progress.  They start from the true median
+  and MAD of the first 'warmup' spectra.
+
+  An event starts when the power rises 'threshold' robust standard
+  deviations (1.4826*MAD) above the median and ends when it falls below
+  'release'.  It is then reported with its start time, channel, peak SNR and
+  duration.
+
+  Public attributes::
+
+   num_bins  - channels per spectrum
+   threshold - SNR at which an event starts
+   release   - SNR below which it ends
+   rate      - fraction of the MAD by which the median moves per spectrum
+   median    - noise level of each channel
+   mad       - median absolute deviation of each channel
+   count     - number of spectra processed
+  """
+  def __init__(self, num_bins, threshold=6., release=3., rate=0.01,
+               warmup=16):
+    """
+    Creates an EventDetector instance.
+
+    @param num_bins : channels per spectrum
+    @type  num_bins : int
+
+    @param threshold : SNR at which an event starts
+    @type  threshold : float
+
+    @param release : SNR below which an event ends
+    @type  release : float
+
+    @param rate : adaptation rate of the noise estimates
+    @type  rate : float
+
+    @param warmup : spectra used to start the noise estimates
+    @type  warmup : int
+    """
+    self.num_bins = num_bins
+    self.threshold = threshold
+    self.release = release
+    self.rate = rate
+    self.warmup = warmup
+    self.median = None
+    self.mad = None
+    self.count = 0
+    self._warmup_spectra = empty((warmup, num_bins), dtype=float32)
+    self._active = zeros(num_bins, dtype=bool)
+    self._start = zeros(num_bins)
+    self._peak = zeros(num_bins, dtype=float32)
+
+  def process(self, spectra, times):
+    """
+    Examines a block of spectra
+
+    @param spectra : power spectra, one per row
+    @type  spectra : 2D numpy array (num spectra, num_bins)
+
+    @param times : time of each spectrum
+    @type  times : numpy 1D array
+
+    @return: numpy structured array of EVENT_DTYPE for the events which ended
+    """
+    events = []
+    for row in range(len(spectra)):
+      spectrum = spectra[row]
+      if self.count < self.warmup:
+        self._warmup_spectra[self.count] = spectrum
+        self.count += 1
+        if self.count == self.warmup:
+          self.median = median(self._warmup_spectra, axis=0)
+          self.mad = median(abs(self._warmup_spectra - self.median), axis=0)
+          self.mad[self.mad == 0] = self.median[self.mad == 0]*0.01 + 1e-12
+        continue
+      self.count += 1
+      snr = (spectrum - self.median)/(1.4826*self.mad)
+      starting = (snr > self.threshold) & ~self._active
+      self._start[starting] = times[row]
+      self._peak[starting] = 0
+      self._active |= starting
+      self._peak[self._active] = maximum(self._peak[self._active],
+                                         snr[self._active])
+      ending = self._active & (snr < self.release)
+      if ending.any():
+        channels = nonzero(ending)[0]
+        ended = zeros(len(channels), dtype=EVENT_DTYPE)
+        ended['time'] = self._start[channels]
+        ended['channel'] = channels
+        ended['snr'] = self._peak[channels]
+        ended['duration'] = times[row] - self._start[channels]
+        events.append(ended)
+        self._active &= ~ending
+      # frugal streaming update of the noise, where there is no event
+      quiet = ~self._active
+      step = self.rate*self.mad[quiet]
+      deviation = spectrum[quiet] - self.median[quiet]
+      self.median[quiet] += step*sign(deviation)
+      self.mad[quiet] += step*sign(abs(deviation) - self.mad[quiet])
+    if events:
+      return concatenate(events)
+    return zeros(0, dtype=EVENT_DTYPE)
+
+class Radiometer(object):
+  """
+  Total power radiometer integrating a stream into fixed time bins
+
+  Samples come from the SDR's gapless 'stream'.  Each block is reduced to
+  its summed power at once, straight from the raw bytes with the decoder's
+  power table, so no more than the block being reduced is held beyond the
+  stream's fixed ring.  The sums are kept in float64 and a block which
+  straddles two bins is split between them.
+
+  Time is counted in samples, including any blocks the stream dropped, from
+  the wall clock time of the first block.  For each bin one line is written
+  with the start time, the mean power per sample, the number of samples
+  integrated and the duty cycle (integrated over expected samples).
+
+  Public attributes::
+
+   sdr         - RtlSdr instance
+   bin_time    - length of a bin, s
+   filename    - file the records are appended to, if any
+   sample_rate - samples per second
+   integrated  - total samples integrated
+   lost        - total samples in dropped blocks
+  """
+  def __init__(self, sdr, bin_time=1.0, filename=None, num_blocks=8):
+    """
+    Creates a Radiometer instance.
+
+    @param sdr : configured device
+    @type  sdr : RtlSdr instance
+
+    @param bin_time : length of a bin, s
+    @type  bin_time : float
+
+    @param filename : file the records are appended to
+    @type  filename : str
+
+    @param num_blocks : size of the stream's ring
+    @type  num_blocks : int
+    """
+    self.logger = logging.getLogger(module_logger.name+".Radiometer")
+    self.sdr = sdr
+    self.bin_time = bin_time
+    self.filename = filename
+    self.num_blocks = num_blocks
+    self.sample_rate = sdr.get_samplerate()
+    self.integrated = 0
+    self.lost = 0
+
+  def _write(self, start, power_sum, num_samples):
+    """
+    Writes the record for one bin
+    """
+    expected = self.bin_time*self.sample_rate
+    if num_samples:
+      mean_power = power_sum/num_samples
+    else:
+      mean_power = 0.
+    line = "%.3f\t%.6e\t%d\t%.4f\n" % (start, mean_power, num_samples,
+                                       num_samples/expected)
+    self.logger.debug("_write: %s", line.strip())
+    if self.filename:
+      fd = open(self.filename, "a")
+      fd.write(line)
+      fd.close()
+
+  def run(self, duration=None):
+    """
+    Integrates until 'duration' seconds have passed or Ctrl-C is pressed
+
+    @param duration : seconds to run; None for no limit
+    @type  duration : float
+
+    @return: overall duty cycle (samples integrated / (wall time * rate))
+    """
+    per_bin = int(round(self.bin_time*self.sample_rate))
+    power_sum = 0.
+    num_samples = 0
+    clock = 0          # samples since the start, including lost ones
+    bin_end = per_bin
+    t0 = None
+    blocks = self.sdr.stream(num_blocks=self.num_blocks)
+    try:
+      for rawdata in blocks:
+        if t0 == None:
+          t0 = time.time()
+        block_len = len(rawdata)//2
+        skipped = self.sdr.ring.gap*block_len
+        self.lost += skipped
+        clock += skipped
+        first = 0
+        while first < block_len:
+          while clock >= bin_end:
+            # close bins, including any which were lost entirely
+            self._write(t0 + (bin_end - per_bin)/self.sample_rate,
+                        power_sum, num_samples)
+            power_sum = 0.
+            num_samples = 0
+            bin_end += per_bin
+          last = min(block_len, first + bin_end - clock)
+          power_sum += self.sdr.decoder.power(rawdata[2*first:2*last])
+          num_samples += last - first
+          self.integrated += last - first
+          clock += last - first
+          first = last
+        if duration and clock >= duration*self.sample_rate:
+          break
+    except KeyboardInterrupt:
+      pass
+    finally:
+      blocks.close()
+    if t0 == None:
+      return 0.
+    if num_samples:
+      self._write(t0 + (bin_end - per_bin)/self.sample_rate,
+                  power_sum, num_samples)
+    elapsed = time.time() - t0
+    duty = self.integrated/(elapsed*self.sample_rate)
+    self.logger.info("run: %d samples integrated, %d lost, duty cycle %.4f",
+                     self.integrated, self.lost, duty)
+    return duty
@@ -0,0 +1,263 @@
+"""
+module Pyramid for viewing long recordings at any zoom
+
+The dynamic spectrum of a capture is computed once and kept at a series of
+resolutions.  Level 0 has every spectrum (after optional integration).  Each
+level above has half as many rows, and half as many channels until they
+are down to 'min_bins', so the levels together take less than twice the
+space of level 0.  Every level holds both the mean and the maximum (max-hold)
+of the spectra it combines, so short bursts stay visible when zoomed out.
+
+Each level is an .npy file in the pyramid's directory, written and read
+through a memory map.  A query picks the coarsest level which still gives
+the pixels asked for and returns a view of just the rows and channels in
+the window, so only those pages are read from disk.
+"""
+import json
+import logging
+import os
+from numpy import ceil, concatenate, floor, load, log2, maximum
+from numpy.lib.format import open_memmap
+
+module_logger = logging.getLogger(__name__)
+
+PYRAMID_VERSION = 1
+
+def _reduce(mean, peak, halve_bins):
+  """
+  Combines pairs of rows, and pairs of channels if 'halve_bins'
+  """
+  mean = (mean[0::2] + mean[1::2])/2
+  peak = maximum(peak[0::2], peak[1::2])
+  if halve_bins:
+    rows, cols = mean.shape
+    mean = mean.reshape(rows, cols//2, 2).mean(axis=-1)
+    peak = peak.reshape(rows, cols//2, 2).max(axis=-1)
+  return mean, peak
+
+def build_pyramid(capture, path, num_bins, integrate=1, min_bins=256,
+                  chunk_spectra=4096, **kwargs):
+  """
+  Computes the levels of a capture file's dynamic spectrum
+
+  The file is read a chunk at a time and each chunk is passed up through
+  the levels at once, with at most one row per level held back for pairing,
+  so the memory used does not depend on the length of the recording.  The
+  keyword arguments are passed to Signals.make_spectrogram (e.g. window).
+
+  @param capture : the recording
+  @type  capture : Capture.CaptureFile instance
+
+  @param path : directory for the pyramid
+  @type  path : str
+
+  @param num_bins : number of channels at level 0
+  @type  num_bins : int
+
+  @param integrate : spectra averaged into each level 0 row
+  @type  integrate : int
+
+  @param min_bins : levels stop halving the channels at this number
+  @type  min_bins : int
+
+  @param chunk_spectra : level 0 rows computed at a time
+  @type  chunk_spectra : int
+
+  @return: SpectrogramPyramid instance
+  """
+  if not os.path.isdir(path):
+    os.makedirs(path)
+  num_rows = capture.num_samples//(num_bins*integrate)
+  shapes = [(num_rows, num_bins)]
+  while shapes[-1][0] > 1:
+    rows, cols = shapes[-1]
+    if cols > min_bins and cols % 2 == 0:
+      cols //= 2
+    shapes.append((rows//2, cols))
+  levels = []
+  for index in range(len(shapes)):
+    levels.append(
+      (open_memmap(os.path.join(path, "level%02d_mean.npy" % index), "w+",
+                   dtype="float32", shape=shapes[index]),
+       open_memmap(os.path.join(path, "level%02d_max.npy" % index), "w+",
+                   dtype="float32", shape=shapes[index])))
+  filled = [0]*len(shapes)
+  carried = [None]*len(shapes)
+
+  def push(mean, peak):
+    # adds level 0 rows and passes pairs of rows up through the levels
+    for index in range(len(shapes)):
+      if index:
+        below = index - 1
+        if carried[below] is not None:
+          mean = concatenate((carried[below][0], mean))
+          peak = concatenate((carried[below][1], peak))
+          carried[below] = None
+        if len(mean) % 2:
+          carried[below] = (mean[-1:], peak[-1:])
+          mean, peak = mean[:-1], peak[:-1]
+        if not len(mean):
+          break
+        halve = shapes[index][1] < shapes[below][1]
+        mean, peak = _reduce(mean, peak, halve)
+      num = min(len(mean), shapes[index][0] - filled[index])
+      levels[index][0][filled[index]:filled[index]+num] = mean[:num]
+      levels[index][1][filled[index]:filled[index]+num] = peak[:num]
+      filled[index] += num
+
+  for first, spectra in capture.spectrogram(num_bins, chunk_spectra*integrate,
+                                            **kwargs):
+    spectra = spectra.reshape(-1, integrate, num_bins)
+    push(spectra.mean(axis=1), spectra.max(axis=1))
+  # 'spectrogram' leaves out the samples which do not fill a whole chunk
+  for first, spectra in capture.spectrogram(num_bins, integrate,
+                                            start=filled[0]*integrate*num_bins,
+                                            **kwargs):
+    spectra = spectra.reshape(1, integrate, num_bins)
+    push(spectra.mean(axis=1), spectra.max(axis=1))
+  for mean, peak in levels:
+    mean.flush()
+    peak.flush()
+  if capture.center_freq == None:
+    center_freq = 0.
+  else:
+    center_freq = capture.center_freq
+  meta = {"version": PYRAMID_VERSION, "num_bins": num_bins,
+          "row_time": num_bins*integrate/float(capture.sample_rate),
+          "start_freq": center_freq - capture.sample_rate/2.,
+          "channel_width": capture.sample_rate/float(num_bins),
+          "shapes": shapes, "source": capture.filename}
+  fd = open(os.path.join(path, "pyramid.json"), "w")
+  json.dump(meta, fd, indent=2)
+  fd.close()
+  module_logger.info("build_pyramid: %d levels from %d rows", len(shapes),
+                     num_rows)
+  return SpectrogramPyramid(path)
+
+class SpectrogramPyramid(object):
+  """
+  Reader for a pyramid made by 'build_pyramid'
+
+  Times are seconds from the start of the recording and frequencies are in
+  Hz, relative to zero if the tuned frequency was not known.
+
+  Public attributes::
+
+   path          - directory holding the pyramid
+   num_bins      - number of channels at level 0
+   row_time      - time spanned by a level 0 row, s
+   start_freq    - frequency of the first channel, Hz
+   channel_width - width of a level 0 channel, Hz
+   shapes        - (rows, channels) of each level
+  """
+  def __init__(self, path):
+    """
+    Opens a pyramid.
+
+    @param path : directory holding the pyramid
+    @type  path : str
+    """
+    self.logger = logging.getLogger(module_logger.name+".SpectrogramPyramid")
+    self.path = path
+    fd = open(os.path.join(path, "pyramid.json"))
+    meta = json.load(fd)
+    fd.close()
+    if meta["version"] > PYRAMID_VERSION:
+      raise ValueError("%s has pyramid format %d; this reads up to %d"
+                       % (path, meta["version"], PYRAMID_VERSION))
+    self.num_bins = meta["num_bins"]
+    self.row_time = meta["row_time"]
+    self.start_freq = meta["start_freq"]
+    self.channel_width = meta["channel_width"]
+    self.shapes = [tuple(shape) for shape in meta["shapes"]]
+    self._levels = {}
+
+  def level(self, index, kind="mean"):
+    """
+    One level as a read-only memory map
+
+    @param index : level number, 0 for full resolution
+    @type  index : int
+
+    @param kind : "mean" or "max"
+    @type  kind : str
+
+    @return: numpy float32 2D array, (time, frequency)
+    """
+    key = (index, kind)
+    try:
+      return self._levels[key]
+    except KeyError:
+      pass
+    data = load(os.path.join(self.path, "level%02d_%s.npy" % (index, kind)),
+                mmap_mode="r")
+    self._levels[key] = data
+    return data
+
+  def duration(self):
+    """
+    Time covered by level 0, s
+    """
+    return self.shapes[0][0]*self.row_time
+
+  def query(self, start=None, stop=None, low=None, high=None, width=1024,
+            height=768, kind="mean"):
+    """
+    The part of the dynamic spectrum in a window, at a useful resolution
+
+    The level chosen is the coarsest which still has at least 'height' rows
+    and 'width' channels in the window, or level 0 if none has.
+
+    @param start : start of the window, s; default the beginning
+    @type  start : float
+
+    @param stop : end of the window, s; default the end
+    @type  stop : float
+
+    @param low : lowest frequency, Hz; default the bottom of the band
+    @type  low : float
+
+    @param high : highest frequency, Hz; default the top of the band
+    @type  high : float
+
+    @param width : number of pixels across the frequency axis
+    @type  width : int
+
+    @param height : number of pixels along the time axis
+    @type  height : int
+
+    @param kind : "mean" or "max"
+    @type  kind : str
+
+    @return: (view of the level, (low, high, start, stop) extent, level)
+    """
+    if start == None:
+      start = 0.
+    if stop == None:
+      stop = self.duration()
+    if low == None:
+      low = self.start_freq
+    if high == None:
+      high = self.start_freq + self.num_bins*self.channel_width
+    # the coarsest level meeting each requirement, then the finer of the two
+    time_level = int(floor(log2(max((stop - start)/self.row_time/height, 1))))
+    chosen = 0
+    for index in range(len(self.shapes)):
+      rows, cols = self.shapes[index]
+      channel_width = self.channel_width*self.num_bins/cols
+      if index > time_level or (high - low)/channel_width < width:
+        break
+      chosen = index
+    rows, cols = self.shapes[chosen]
+    row_time = self.row_time*2**chosen
+    channel_width = self.channel_width*self.num_bins/cols
+    first_row = max(int(floor(start/row_time)), 0)
+    last_row = min(int(ceil(stop/row_time)), rows)
+    first_col = max(int(floor((low - self.start_freq)/channel_width)), 0)
+    last_col = min(int(ceil((high - self.start_freq)/channel_width)), cols)
+    image = self.level(chosen, kind)[first_row:last_row, first_col:last_col]
+    extent = (self.start_freq + first_col*channel_width,
+              self.start_freq + last_col*channel_width,
+              first_row*row_time, last_row*row_time)
+    self.logger.debug("query: level %d, %s", chosen, image.shape)
+    return image, extent, chosen
@@ -0,0 +1,390 @@
+"""
+module Replay for running SDR programs without a dongle
+
+A ReplaySdr has the methods of an RtlSdr, so the same program can read
+from a recording or a made-up signal instead of the hardware.  The samples
+can be paced to the sample rate, so a program sees blocks arrive as it would
+from a dongle, or handed out as fast as they are asked for, to find how fast
+a program can go.  A recording can be played once or over and over.
+
+In 'stream' a paced replay drops blocks when the consumer falls behind,
+exactly as the hardware does, while an unpaced one waits for the consumer
+and never drops any.
+"""
+import logging
+import threading
+import time
+from numpy import arange, around, clip, complex64, empty, exp, pi, uint8
+from numpy.random import RandomState
+
+from RealtekSDR import DEFAULT_BUF_LENGTH, RtlSdr, RtlSdrException
+from RealtekSDR.Buffers import BufferPool
+from RealtekSDR.Capture import CaptureFile
+from RealtekSDR.Signals import IQDecoder
+
+module_logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 2400000
+# the gains, in tenths of dB, reported by an R820T tuner
+R820T_GAINS = [0, 9, 14, 27, 37, 77, 87, 125, 144, 157, 166, 197, 207, 229,
+               254, 280, 297, 328, 338, 364, 372, 386, 402, 421, 434, 439,
+               445, 480, 496]
+
+class ToneSource(object):
+  """
+  Endless raw samples of tones in noise
+
+  One period of the signal is made in advance and read over and over, so
+  the samples cost nothing to produce and are the same on every run.  The
+  tone frequencies are rounded to a whole number of cycles in the period.
+
+  Public attributes::
+
+   sample_rate - samples per second
+   center_freq - frequency reported for the signal, Hz
+   tones       - list of (offset from center, Hz; amplitude, 0 to 1)
+   noise       - RMS of the noise in each of I and Q, 0 to 1
+   period      - number of samples before the signal repeats
+   num_samples - None, since there is no end
+  """
+  def __init__(self, sample_rate=DEFAULT_RATE, center_freq=0,
+               tones=((100000., 0.3),), noise=0.05, period=2**18, seed=0):
+    """
+    Creates a ToneSource instance.
+
+    @param sample_rate : samples per second
+    @type  sample_rate : float
+
+    @param center_freq : frequency reported for the signal, Hz
+    @type  center_freq : float
+
+    @param tones : list of (offset from center, Hz; amplitude, 0 to 1)
+    @type  tones : list of tuple of float
+
+    @param noise : RMS of the noise in each of I and Q, 0 to 1
+    @type  noise : float
+
+    @param period : number of samples before the signal repeats
+    @type  period : int
+
+    @param seed : seed for the noise
+    @type  seed : int
+    """
+    self.center_freq = center_freq
+    self.tones = tones
+    self.noise = noise
+    self.period = period
+    self.seed = seed
+    self.num_samples = None
+    self.set_sample_rate(sample_rate)
+
+  def set_sample_rate(self, sample_rate):
+    """
+    Makes the signal again for a new sample rate
+
+    @param sample_rate : samples per second
+    @type  sample_rate : float
+    """
+    self.sample_rate = sample_rate
+    index = arange(self.period)
+    signal = empty(self.period, dtype=complex64)
+    noise = RandomState(self.seed).normal(scale=self.noise,
+                                          size=(2, self.period))
+    signal.real = noise[0]
+    signal.imag = noise[1]
+    for offset, amplitude in self.tones:
+      cycles = round(offset*self.period/float(sample_rate))
+      signal += amplitude*exp(2j*pi*cycles*index/self.period)
+    raw = empty(2*self.period)
+    raw[0::2] = signal.real
+    raw[1::2] = signal.imag
+    # offset binary, as the dongle sends it
+    self._raw = clip(around(raw*128 + 128), 0, 255).astype(uint8)
+
+  def read_raw(self, start, num_samples):
+    """
+    Raw bytes of some samples, without copying them
+
+    @param start : index of the first sample
+    @type  start : int
+
+    @param num_samples : number of samples; fewer at the end of a period
+    @type  num_samples : int
+
+    @return: numpy array of uint8, two per sample
+    """
+    first = start % self.period
+    stop = min(first + num_samples, self.period)
+    return self._raw[2*first:2*stop]
+
+class ReplaySdr(RtlSdr):
+  """
+  Stand-in for an RtlSdr which plays back samples
+
+  Tuning and gain settings are accepted and reported back but do not change
+  the samples; the sample rate only changes the pacing of a recording.
+
+  Public attributes, besides those of RtlSdr::
+
+   source     - CaptureFile or ToneSource which supplies the samples
+   pace       - hand out samples no faster than the sample rate
+   loop       - start the recording again when it ends
+   position   - index in the source of the next sample
+   loops      - number of times the recording has been restarted
+   start_time - when the current read started, s since the epoch
+   sent       - samples handed out since 'start_time'
+  """
+  def __init__(self, source=None, sample_rate=None, center_freq=None,
+               pace=True, loop=False, dflt_blk_size=DEFAULT_BUF_LENGTH):
+    """
+    Creates a ReplaySdr instance.
+
+    @param source : file name, CaptureFile or ToneSource; None for tones
+    @type  source : str or object
+
+    @param sample_rate : samples per second, if the source does not say
+    @type  sample_rate : float
+
+    @param center_freq : tuned frequency, Hz, if the source does not say
+    @type  center_freq : float
+
+    @param pace : hand out samples no faster than the sample rate
+    @type  pace : bool
+
+    @param loop : start the recording again when it ends
+    @type  loop : bool
+
+    @param dflt_blk_size : default size of block read, bytes
+    @type  dflt_blk_size : int
+    """
+    self.logger = logging.getLogger(module_logger.name+".ReplaySdr")
+    if source == None:
+      source = ToneSource(sample_rate or DEFAULT_RATE, center_freq or 0)
+    elif isinstance(source, str):
+      source = CaptureFile(source, sample_rate, center_freq)
+    if source.sample_rate == None:
+      raise RtlSdrException(None, "the sample rate of the source is needed")
+    self.source = source
+    self.devp = None
+    self.blk_size = dflt_blk_size
+    self.pool = BufferPool(dflt_blk_size)
+    self.decoder = IQDecoder()
+    self.pace = pace
+    self.loop = loop
+    self.samplerate = float(source.sample_rate)
+    if source.center_freq == None:
+      self.cf = 0
+    else:
+      self.cf = int(source.center_freq)
+    self.gain = 0
+    self.manual_gain = False
+    self.position = 0
+    self.loops = 0
+    self.start_time = None
+    self.sent = 0
+    self._cancel = threading.Event()
+
+  def get_freq(self):
+    """
+    Gets the center frequency last set
+
+    @return: int, frequency in Hz
+    """
+    return self.cf
+
+  def set_freq(self, cf):
+    """
+    Records the center frequency; the samples are not changed
+
+    @param cf : center frequency in Hz
+    @type  cf : int
+
+    @return: int, frequency in Hz
+    """
+    self.cf = int(cf)
+    return self.cf
+
+  def get_samplerate(self):
+    """
+    Gets the sampling rate
+
+    @return: float, sampling rate in Hz
+    """
+    return self.samplerate
+
+  def set_samplerate(self, sr):
+    """
+    Sets the sampling rate
+
+    A ToneSource is made again at the new rate.  A recording keeps its own
+    rate, since its samples cannot be changed, and that is returned.
+
+    @param sr : sampling rate in Hz
+    @type  sr : int
+
+    @return: float, sampling rate in Hz
+    """
+    if sr != self.samplerate:
+      if isinstance(self.source, ToneSource):
+        self.source.set_sample_rate(sr)
+        self.samplerate = float(sr)
+      else:
+        self.logger.warning("set_samplerate: %s was recorded at %d",
+                            self.source.filename, self.samplerate)
+    return self.samplerate
+
+  def get_gain(self):
+    """
+    Gets the gain last set
+
+    @return: int, gain
+    """
+    return self.gain
+
+  def set_gain(self, gain):
+    """
+    Records the gain; the samples are not changed
+    """
+    self.gain = gain
+
+  def set_gain_manual(self, manual):
+    """
+    Records the gain mode
+    """
+    self.manual_gain = manual
+
+  def get_tuner_gains(self):
+    """
+    Gains of the tuner being imitated
+
+    @return: list of int
+    """
+    return list(R820T_GAINS)
+
+  def reset_buffer(self):
+    """
+    Restarts the pacing clock; the position in the source is kept
+
+    @return: True
+    """
+    self.start_time = None
+    self.sent = 0
+    return True
+
+  def seek(self, seconds):
+    """
+    Moves to a time in the source
+
+    @param seconds : time from the start of the source
+    @type  seconds : float
+    """
+    self.position = int(round(seconds*self.samplerate))
+    self.reset_buffer()
+
+  def due_time(self, num_samples):
+    """
+    When a dongle would have delivered samples since 'start_time'
+
+    @param num_samples : number of samples from the start of the read
+    @type  num_samples : int
+
+    @return: float, s since the epoch
+    """
+    return self.start_time + num_samples/self.samplerate
+
+  def _fill(self, out):
+    """
+    Copies samples from the source into a byte array
+
+    @return: number of bytes copied; fewer than asked at the end
+    """
+    done = 0
+    while done < len(out):
+      rawdata = self.source.read_raw(self.position, (len(out) - done)//2)
+      if not len(rawdata):
+        if self.loop and self.position:
+          self.position = 0
+          self.loops += 1
+          continue
+        break
+      out[done:done+len(rawdata)] = rawdata
+      done += len(rawdata)
+      self.position += len(rawdata)//2
+    return done
+
+  def _wait(self, num_samples):
+    """
+    Counts samples handed out and, if pacing, waits until they are due
+    """
+    if self.start_time == None:
+      self.start_time = time.time()
+    self.sent += num_samples
+    if self.pace:
+      delay = self.due_time(self.sent) - time.time()
+      if delay > 0:
+        time.sleep(delay)
+
+  def synch_read_raw(self, num=None):
+    """
+    Reads the next samples from the source
+
+    The bytes are copied into the next buffer of the instance's pool, as
+    for an RtlSdr.
+
+    @param num : number of bytes (two per complex sample)
+    @type  num : int
+
+    @return: numpy array of uint8 in offset binary (128 is zero)
+    """
+    if num == None:
+      num = self.blk_size
+    buf = self.pool.next(num)
+    datalen = self._fill(buf[:num - num % 2])
+    if not datalen:
+      raise RtlSdrException(None, "end of replay")
+    self._wait(datalen//2)
+    return buf[:datalen]
+
+  def _start_reader(self, blk_size):
+    """
+    Starts the thread which fills 'self.ring' for 'stream'
+    """
+    self._cancel.clear()
+    self.reset_buffer()
+    reader = threading.Thread(target=self._replay, args=(blk_size,))
+    reader.daemon = True
+    reader.start()
+    return reader
+
+  def _stop_reader(self, reader):
+    """
+    Stops the thread started by '_start_reader'
+    """
+    self._cancel.set()
+    reader.join()
+
+  def _replay(self, blk_size):
+    """
+    Body of the stream reader thread; returns when cancelled or at the end
+    """
+    block = empty(blk_size, dtype=uint8)
+    while not self._cancel.is_set():
+      if not self.pace:
+        # wait for the consumer instead of dropping blocks
+        if not self.ring.wait_space(0.1):
+          continue
+      datalen = self._fill(block)
+      if not datalen:
+        break
+      self._wait(datalen//2)
+      self.ring.put(block.ctypes.data, datalen)
+    self.ring.close()
+
+  def close(self):
+    """
+    Stops any replay; the source stays open
+
+    @return: True
+    """
+    self._cancel.set()
+    return True
@@ -1,8 +1,18 @@
 """
 module Data_Reduction for operations on signals
 """
-from numpy import empty, log10, conj
-from numpy.fft import fft, fftshift
+import sys
+from numpy import angle, arange, ascontiguousarray, asarray, bincount, clip
+from numpy import complex64, concatenate, convolve, dot, einsum, empty, exp
+from numpy import float32, float64, floor, hamming, hanning, int64, intp
+from numpy import linspace, log10, conj, ones, pi, sign, sinc, uint16, zeros
+from numpy.fft import fftfreq, fftshift
+from numpy.lib.stride_tricks import as_strided
+from RealtekSDR.FFTbackend import fft, ifft
+try:
+  from scipy.signal import lfilter
+except ImportError:
+  lfilter = None
 
 def unpack_to_complex(rawdata):
   """
@@ -19,24 +29,213 @@ def unpack_to_complex(rawdata):
   data = real + 1j*imag
   return data
 
+class IQDecoder(object):
+  """
+  Converts raw unsigned 8-bit I/Q byte pairs to complex64 with a lookup table
+
+  An I/Q pair is two bytes, so viewed as a uint16 it can only take 65536
+  values.  The complex sample for every one of them is computed once, with
+  the DC offset removed and the scale applied, and decoding a block is then
+  a single 'take' from the table with no intermediate arrays.
+
+  Public attributes::
+
+   dc_offset - I and Q values which represent zero
+   scale     - factor applied after removing the offset
+   lut       - 65536 complex64 samples indexed by the uint16 pair value
+   power_lut - 65536 float32 sample powers indexed the same way
+  """
+  def __init__(self, dc_offset=128., scale=1.):
+    """
+    Creates an IQDecoder instance.
+
+    @param dc_offset : zero level; one number for both, or an (I,Q) pair
+    @type  dc_offset : float or tuple of float
+
+    @param scale : multiplier applied to the offset-free values
+    @type  scale : float
+    """
+    try:
+      i_offset, q_offset = dc_offset
+    except TypeError:
+      i_offset = q_offset = dc_offset
+    self.dc_offset = (i_offset, q_offset)
+    self.scale = scale
+    pairs = arange(65536)
+    low = pairs & 0xff
+    high = pairs >> 8
+    # the first byte of each pair is I; which half of the uint16 that lands
+    # in depends on the byte order of this machine
+    if sys.byteorder == "little":
+      real, imag = low, high
+    else:
+      real, imag = high, low
+    self.lut = empty(65536, dtype=complex64)
+    self.lut.real = (real - i_offset)*scale
+    self.lut.imag = (imag - q_offset)*scale
+    self.power_lut = (self.lut.real**2 + self.lut.imag**2).astype(float32)
+
+  def __call__(self, rawdata, out=None):
+    """
+    Decodes a block of raw bytes
+
+    @param rawdata : alternating I and Q bytes as received from the dongle
+    @type  rawdata : numpy array of uint8
+
+    @param out : optional array for the result
+    @type  out : numpy array of complex64
+
+    @return: numpy array of complex64, half as long as 'rawdata'
+    """
+    num_pairs = len(rawdata)//2
+    pairs = rawdata[:2*num_pairs].view(uint16)
+    return self.lut.take(pairs, out=out)
+
+  def power(self, rawdata):
+    """
+    Total power of a block of raw bytes, without decoding it
+
+    The power of each pair is looked up and summed in float64.  Once a
+    block has more pairs than the table has entries it is quicker to count
+    how often each pair value occurs and take the dot product of the counts
+    with the table.
+
+    @param rawdata : alternating I and Q bytes as received from the dongle
+    @type  rawdata : numpy array of uint8
+
+    @return: float, sum of the squared magnitudes of the samples
+    """
+    num_pairs = len(rawdata)//2
+    pairs = rawdata[:2*num_pairs].view(uint16)
+    if num_pairs > len(self.power_lut):
+      return float(dot(bincount(pairs, minlength=len(self.power_lut)),
+                       self.power_lut))
+    return float(self.power_lut.take(pairs).sum(dtype=float64))
+
+def _hilbert_multiplier(num_samples):
+  """
+  Frequency domain form of scipy.fftpack.hilbert: i*sign(f), zero at Nyquist
+  """
+  multiplier = 1j*sign(fftfreq(num_samples))
+  if num_samples % 2 == 0:
+    multiplier[num_samples//2] = 0
+  return multiplier
+
 def sideband_separate(data):
   """
   Converts a complex array time series and returns two reals with USB and LSB
 
-  This applies a Hilbert transform to the complex data.
+  This applies a Hilbert transform to the complex data.  Because the
+  transform is linear with a real kernel, H(I) and H(Q) are the real and
+  imaginary parts of one transform of I+jQ, so a single forward and inverse
+  FFT serve for both sidebands.
+
+  @param data : complex time series data
+  @type  data : numpy array of complex
+
+  @return: (LSB, USB) as numpy arrays of float
   """
-  usb = (data.real + scipy.fftpack.hilbert(data).imag)
-  lsb = (scipy.fftpack.hilbert(data).real + data.imag)
+  xform = fft(data)
+  xform *= _hilbert_multiplier(len(data))
+  transformed = ifft(xform)
+  usb = data.real + transformed.imag
+  lsb = transformed.real + data.imag
   return lsb,usb
 
+def sideband_power(data):
+  """
+  Mean LSB and USB power of a complex time series
+
+  This gives the same values as 'sideband_separate' followed by the mean
+  square of each sideband, but from the forward FFT alone.  By Parseval's
+  theorem the USB power is that of the positive frequency bins and the LSB
+  power that of the negative ones; the DC and Nyquist bins contribute their
+  real parts to the USB and their imaginary parts to the LSB.
+
+  @param data : complex time series data
+  @type  data : numpy array of complex
+
+  @return: (LSB power, USB power) as float
+  """
+  num_samples = len(data)
+  xform = fft(data)
+  power = xform.real**2
+  power += xform.imag**2
+  usb = 2*power[1:(num_samples+1)//2].sum() + xform[0].real**2
+  lsb = 2*power[num_samples//2+1:].sum() + xform[0].imag**2
+  if num_samples % 2 == 0:
+    usb += xform[num_samples//2].real**2
+    lsb += xform[num_samples//2].imag**2
+  return lsb/num_samples**2, usb/num_samples**2
+
+class StreamingHistogram(object):
+  """
+  Histogram with fixed bins into which values are counted as they arrive
+
+  Unlike keeping the values for a final 'hist' call, the memory used does
+  not depend on how many values have been seen.  Values outside the limits
+  are counted in 'underflow' and 'overflow'.
+
+  To plot with matplotlib::
+
+    hist(h.centers, bins=h.edges, weights=h.counts)
+
+  Public attributes::
+
+   edges     - num_bins+1 bin boundaries
+   centers   - num_bins bin centers
+   counts    - number of values in each bin
+   underflow - number of values below the lowest edge
+   overflow  - number of values at or above the highest edge
+  """
+  def __init__(self, num_bins=100, limits=(-256., 256.)):
+    """
+    Creates a StreamingHistogram instance.
+
+    @param num_bins : number of bins
+    @type  num_bins : int
+
+    @param limits : lowest and highest bin edges
+    @type  limits : tuple of float
+    """
+    self.num_bins = num_bins
+    self.lower, self.upper = limits
+    self.edges = linspace(self.lower, self.upper, num_bins+1)
+    self.centers = (self.edges[:-1] + self.edges[1:])/2
+    self.counts = zeros(num_bins, dtype=int64)
+    self.underflow = 0
+    self.overflow = 0
+    self._scale = num_bins/float(self.upper - self.lower)
+
+  def update(self, values):
+    """
+    Counts a block of values
+
+    @param values : real samples
+    @type  values : numpy array
+    """
+    # bin 0 collects underflows and bin num_bins+1 overflows
+    index = floor((values - self.lower)*self._scale).astype(intp)
+    index += 1
+    clip(index, 0, self.num_bins+1, out=index)
+    tally = bincount(index, minlength=self.num_bins+2)
+    self.underflow += tally[0]
+    self.overflow += tally[-1]
+    self.counts += tally[1:-1]
+
 def make_spectrogram(data, num_spec, num_bins, log=False,
-                     normalizer=None):
+                     normalizer=None, window=None, out=None,
+                     power_normalizer=None):
   """
   Converts a sequence of complex samples into a spectrogram
 
   matplotlib specgram takes real data.  This takes complex data.
   It returns an image array.
 
+  The samples are viewed as a (num_spec, num_bins) array and transformed
+  with one FFT along the rows.  The power is written straight into the
+  float32 output, already shifted so that frequency increases along a row.
+
   @param data : complex time series data
   @type  data : numpy array of complex
 
@@ -52,21 +251,542 @@ def make_spectrogram(data, num_spec, num_bins, log=False,
   @param normalizer : gain normalization reference for spectra
   @type  normalizer : numpy 1D array num_bins long
 
+  @param window : optional window applied to each slice
+  @type  window : numpy 1D array num_bins long
+
+  @param out : optional array for the result
+  @type  out : numpy float32 array (num_spec, num_bins)
+
+  @param power_normalizer : multiplier for the power, as from BaselineStore
+  @type  power_normalizer : numpy float32 1D array num_bins long
+
   @return: 2D numpay array
   """
   subsetlen = num_spec*num_bins
-  image = empty((num_spec, num_bins))
-  for index in range(0, subsetlen, num_bins):
-    dataslice = data[index:index+num_bins]
-    xform = fft(dataslice)
-    spectrum = fftshift(xform)
-    if normalizer == None:
-      pass
+  block = data[:subsetlen].reshape(num_spec, num_bins)
+  if window is not None:
+    block = block*window
+  xform = fft(block, axis=-1)
+  if out is None:
+    out = empty((num_spec, num_bins), dtype=float32)
+  # view the transform as (re,im) pairs and sum their squares, putting the
+  # negative frequencies (from 'split' onwards) first as fftshift would
+  pairs = xform.view(xform.real.dtype).reshape(num_spec, num_bins, 2)
+  split = num_bins - num_bins//2
+  einsum('ijk,ijk->ij', pairs[:,split:], pairs[:,split:],
+         out=out[:,:num_bins//2], casting='same_kind')
+  einsum('ijk,ijk->ij', pairs[:,:split], pairs[:,:split],
+         out=out[:,num_bins//2:], casting='same_kind')
+  if normalizer is not None:
+    # the normalizer scales the voltage spectrum, hence the square
+    out *= abs(normalizer)**2
+  if power_normalizer is not None:
+    out *= power_normalizer
+  if log:
+    log10(out, out=out)
+  return out
+
+class WelchAccumulator(object):
+  """
+  Running average of windowed, overlapping power spectra
+
+  IQ samples may be added in chunks of any length.  Samples left over at the
+  end of a chunk, which do not fill a whole segment, are kept and joined to
+  the next chunk so no data are lost at chunk boundaries.  Only the running
+  sums are stored, so an integration can go on indefinitely in constant
+  memory.  Segments are transformed 'batch' at a time so the FFT size does
+  not change from call to call.
+
+  The spectra are scaled by the mean square of the window so that a
+  rectangular window gives the same values as 'make_spectrogram'.
+
+  Public attributes::
+
+   num_bins - number of channels in a spectrum
+   step     - number of samples between the starts of successive segments
+   window   - window applied to each segment
+   sum      - sum of the power spectra (unshifted)
+   sumsq    - sum of the squared power spectra, or None
+   count    - number of spectra summed
+  """
+  def __init__(self, num_bins, overlap=0.5, window=None, variance=False,
+               batch=256):
+    """
+    Creates a WelchAccumulator instance.
+
+    @param num_bins : number of channels in a spectrum
+    @type  num_bins : int
+
+    @param overlap : fraction of a segment shared with the next one
+    @type  overlap : float
+
+    @param window : window function; default Hann
+    @type  window : numpy 1D array num_bins long
+
+    @param variance : also keep the sum of squares
+    @type  variance : bool
+
+    @param batch : number of segments transformed at once
+    @type  batch : int
+    """
+    self.num_bins = num_bins
+    self.step = num_bins - int(round(overlap*num_bins))
+    if self.step < 1:
+      raise ValueError("overlap must be less than 1")
+    if window is None:
+      window = hanning(num_bins)
+    self.window = asarray(window, dtype=float32)
+    self._scale = 1./(self.window.astype(float64)**2).mean()
+    self.batch = batch
+    self._keep_sumsq = variance
+    self.reset()
+
+  def reset(self):
+    """
+    Discards the sums and any left-over samples
+    """
+    self.sum = zeros(self.num_bins)
+    if self._keep_sumsq:
+      self.sumsq = zeros(self.num_bins)
     else:
-      spectrum *= normalizer
-    ptr = index/num_bins
-    if log:
-      image[ptr] = log10(abs(spectrum*conj(spectrum)))
+      self.sumsq = None
+    self.count = 0
+    self._tail = empty(0, dtype=complex64)
+
+  def add(self, data):
+    """
+    Adds a chunk of complex samples
+
+    @param data : complex time series data
+    @type  data : numpy array of complex
+
+    @return: number of spectra added
+    """
+    if len(self._tail):
+      data = concatenate((self._tail, data))
+    data = ascontiguousarray(data)
+    if len(data) < self.num_bins:
+      self._tail = data.copy()
+      return 0
+    num_segs = (len(data) - self.num_bins)//self.step + 1
+    itemsize = data.itemsize
+    segments = as_strided(data, shape=(num_segs, self.num_bins),
+                          strides=(self.step*itemsize, itemsize))
+    for first in range(0, num_segs, self.batch):
+      xform = fft(segments[first:first+self.batch]*self.window, axis=-1)
+      power = xform.real**2
+      power += xform.imag**2
+      self.sum += power.sum(axis=0)*self._scale
+      if self._keep_sumsq:
+        self.sumsq += (power**2).sum(axis=0)*self._scale**2
+    self.count += num_segs
+    self._tail = data[num_segs*self.step:].copy()
+    return num_segs
+
+  def mean(self):
+    """
+    Average power spectrum, lowest frequency first
+
+    @return: numpy 1D array num_bins long
+    """
+    return fftshift(self.sum/max(self.count, 1))
+
+  def variance(self):
+    """
+    Variance of the power in each channel, lowest frequency first
+
+    @return: numpy 1D array num_bins long
+    """
+    if self.sumsq is None:
+      raise RuntimeError("accumulator was created without variance")
+    count = max(self.count, 1)
+    mean = self.sum/count
+    return fftshift(self.sumsq/count - mean**2)
+
+def lowpass_filter(num_taps, cutoff, window=None):
+  """
+  Windowed-sinc low pass FIR filter with unit gain at zero frequency
+
+  @param num_taps : filter length
+  @type  num_taps : int
+
+  @param cutoff : -6 dB frequency as a fraction of the sample rate (< 0.5)
+  @type  cutoff : float
+
+  @param window : window function; default Hamming
+  @type  window : numpy 1D array num_taps long
+
+  @return: numpy 1D array of float
+  """
+  if window is None:
+    window = hamming(num_taps)
+  n = arange(num_taps) - (num_taps - 1)/2.
+  taps = 2*cutoff*sinc(2*cutoff*n)*window
+  return taps/taps.sum()
+
+class PolyphaseChannelizer(object):
+  """
+  Critically sampled polyphase filter bank
+
+  Splits a complex stream into 'num_chans' channels, each with 1/num_chans
+  of the bandwidth and sample rate.  For every 'num_chans' input samples
+  the latest num_chans*taps_per_chan samples are weighted by the prototype
+  filter, folded into 'num_chans' sums and transformed with one FFT.  This
+  costs little more than the FFT alone but the prototype's long response
+  gives channels with flat tops and steep skirts, so a strong carrier does
+  not leak far into its neighbours as it does with a plain FFT.
+
+  The last taps_per_chan-1 frames, and any samples short of a whole frame,
+  are carried over to the next call so a stream can be fed block by block.
+
+  Public attributes::
+
+   num_chans     - number of channels
+   taps_per_chan - length of each polyphase branch
+   prototype     - low pass filter of num_chans*taps_per_chan taps
+  """
+  def __init__(self, num_chans, taps_per_chan=8, prototype=None):
+    """
+    Creates a PolyphaseChannelizer instance.
+
+    @param num_chans : number of channels
+    @type  num_chans : int
+
+    @param taps_per_chan : number of filter taps per channel
+    @type  taps_per_chan : int
+
+    @param prototype : filter num_chans*taps_per_chan long; default is a
+                       Hamming windowed sinc one channel wide
+    @type  prototype : numpy 1D array
+    """
+    self.num_chans = num_chans
+    self.taps_per_chan = taps_per_chan
+    if prototype is None:
+      prototype = lowpass_filter(num_chans*taps_per_chan, 0.5/num_chans)
+    if len(prototype) != num_chans*taps_per_chan:
+      raise ValueError("prototype must have num_chans*taps_per_chan taps")
+    self.prototype = asarray(prototype)
+    self._weights = (self.prototype*num_chans).reshape(taps_per_chan,
+                                                       num_chans)
+    self.reset()
+
+  def reset(self):
+    """
+    Clears the filter history
+    """
+    self._history = zeros(self.num_chans*(self.taps_per_chan-1),
+                          dtype=complex64)
+    self._leftover = empty(0, dtype=complex64)
+
+  def __call__(self, data):
+    """
+    Channelizes a block of complex samples
+
+    @param data : complex time series data
+    @type  data : numpy array of complex
+
+    @return: (num_frames, num_chans) complex array, lowest channel first
+    """
+    N = self.num_chans
+    samples = concatenate((self._history, self._leftover, data))
+    num_frames = len(samples)//N - (self.taps_per_chan - 1)
+    if num_frames < 1:
+      self._leftover = samples[len(self._history):].copy()
+      return empty((0, N), dtype=complex64)
+    used = (num_frames + self.taps_per_chan - 1)*N
+    itemsize = samples.itemsize
+    frames = as_strided(samples, shape=(num_frames, self.taps_per_chan, N),
+                        strides=(N*itemsize, N*itemsize, itemsize))
+    folded = einsum('fmn,mn->fn', frames, self._weights)
+    channels = fftshift(fft(folded, axis=-1), axes=-1)
+    self._history = samples[used-len(self._history):used].copy()
+    self._leftover = samples[used:].copy()
+    return channels
+
+class NCO(object):
+  """
+  Numerically controlled oscillator for shifting a signal in frequency
+
+  'mix' multiplies a block by exp(-j*phase), so a signal at 'freq' comes
+  out at zero frequency.  The phase carries on from one block to the next.
+  The oscillator for a block length is computed once and then only rotated
+  by the starting phase of each block.
+
+  Public attributes::
+
+   freq        - frequency shifted down to zero, Hz
+   sample_rate - samples per second
+   phase       - phase at the start of the next block, radians
+  """
+  def __init__(self, freq, sample_rate):
+    """
+    Creates an NCO instance.
+
+    @param freq : frequency shifted down to zero, Hz
+    @type  freq : float
+
+    @param sample_rate : samples per second
+    @type  sample_rate : float
+    """
+    self.freq = freq
+    self.sample_rate = sample_rate
+    self.phase = 0.
+    self._step = 2*pi*freq/sample_rate
+    self._oscillator = empty(0, dtype=complex64)
+
+  def mix(self, data):
+    """
+    Shifts a block of complex samples down by 'freq'
+
+    @param data : complex time series data
+    @type  data : numpy array of complex
+
+    @return: numpy array of complex64
+    """
+    num_samples = len(data)
+    if len(self._oscillator) != num_samples:
+      self._oscillator = exp(-1j*self._step*arange(num_samples)).astype(
+                                                                    complex64)
+    mixed = data*self._oscillator
+    mixed *= complex64(exp(-1j*self.phase))
+    self.phase = (self.phase + self._step*num_samples) % (2*pi)
+    return mixed
+
+def cic_filter(factor, stages=4):
+  """
+  Impulse response of a CIC decimating filter, normalized to unit gain
+
+  A cascade of 'stages' moving sums 'factor' long.  It is applied as an
+  ordinary FIR filter, which gives the same output as the integrator and
+  comb form without integrators that drift when run for hours in floating
+  point.
+
+  @param factor : decimation factor
+  @type  factor : int
+
+  @param stages : number of integrator/comb pairs
+  @type  stages : int
+
+  @return: numpy 1D array of float
+  """
+  taps = ones(1)
+  for stage in range(stages):
+    taps = convolve(taps, ones(factor))
+  return taps/taps.sum()
+
+class FIRDecimator(object):
+  """
+  FIR filter which computes only every 'factor'-th output
+
+  The last len(taps)-1 samples and the position of the next output are
+  carried over so a stream can be fed block by block.
+
+  Public attributes::
+
+   taps   - filter coefficients
+   factor - decimation factor
+  """
+  def __init__(self, taps, factor):
+    """
+    Creates an FIRDecimator instance.
+
+    @param taps : filter coefficients
+    @type  taps : numpy 1D array of float
+
+    @param factor : decimation factor
+    @type  factor : int
+    """
+    self.taps = asarray(taps)
+    self.factor = factor
+    self._reversed = self.taps[::-1].astype(complex64)
+    self.reset()
+
+  def reset(self):
+    """
+    Clears the filter history
+    """
+    self._history = zeros(len(self.taps)-1, dtype=complex64)
+    self._start = 0 # first sample of the next output's window
+
+  def __call__(self, data):
+    """
+    Filters and decimates a block
+
+    @param data : complex time series data
+    @type  data : numpy array of complex
+
+    @return: numpy array of complex64
+    """
+    num_taps = len(self.taps)
+    samples = concatenate((self._history, asarray(data, dtype=complex64)))
+    available = len(samples) - self._start - num_taps
+    if available < 0:
+      num_out = 0
     else:
-      image[ptr] = abs(spectrum*conj(spectrum))
-  return image
+      num_out = available//self.factor + 1
+    itemsize = samples.itemsize
+    windows = as_strided(samples[self._start:], shape=(num_out, num_taps),
+                         strides=(self.factor*itemsize, itemsize))
+    output = windows.dot(self._reversed)
+    keep = num_taps - 1
+    self._start += num_out*self.factor - (len(samples) - keep)
+    self._history = samples[len(samples)-keep:].copy()
+    return output
+
+class DownConverter(object):
+  """
+  Digital down-converter for extracting a narrow channel from a wide stream
+
+  The NCO moves the channel to zero frequency, a CIC stage decimates by
+  'cic_factor' and a low pass FIR stage decimates by 'fir_factor' and sets
+  the final bandwidth.  All stages keep their state between blocks so
+  several converters can each take their own channel from the same stream.
+
+  Public attributes::
+
+   nco         - the mixer
+   cic         - first decimation stage, None if cic_factor is 1
+   fir         - second decimation stage
+   output_rate - samples per second out
+  """
+  def __init__(self, sample_rate, offset, cic_factor, fir_factor,
+               bandwidth=None, cic_stages=4, fir_taps=None):
+    """
+    Creates a DownConverter instance.
+
+    @param sample_rate : input samples per second
+    @type  sample_rate : float
+
+    @param offset : channel frequency relative to the input center, Hz
+    @type  offset : float
+
+    @param cic_factor : decimation by the CIC stage
+    @type  cic_factor : int
+
+    @param fir_factor : decimation by the FIR stage
+    @type  fir_factor : int
+
+    @param bandwidth : channel width, Hz; default 80% of the output rate
+    @type  bandwidth : float
+
+    @param cic_stages : number of CIC stages
+    @type  cic_stages : int
+
+    @param fir_taps : length of the FIR filter; default 16 per output sample
+    @type  fir_taps : int
+    """
+    self.nco = NCO(offset, sample_rate)
+    if cic_factor > 1:
+      self.cic = FIRDecimator(cic_filter(cic_factor, cic_stages), cic_factor)
+    else:
+      self.cic = None
+    mid_rate = float(sample_rate)/cic_factor
+    self.output_rate = mid_rate/fir_factor
+    if bandwidth == None:
+      bandwidth = 0.8*self.output_rate
+    if fir_taps == None:
+      fir_taps = 16*fir_factor + 1
+    self.fir = FIRDecimator(lowpass_filter(fir_taps, bandwidth/2/mid_rate),
+                            fir_factor)
+
+  def __call__(self, data):
+    """
+    Converts a block of samples
+
+    @param data : complex time series data
+    @type  data : numpy array of complex
+
+    @return: numpy array of complex64 at the output rate
+    """
+    mixed = self.nco.mix(data)
+    if self.cic:
+      mixed = self.cic(mixed)
+    return self.fir(mixed)
+
+class WBFMDemodulator(object):
+  """
+  Wideband (broadcast) FM demodulator, mono
+
+  Blocks of complex samples pass through::
+
+    DownConverter  - to the channel, decimating to about 200 kS/s or more
+    discriminator  - phase difference between successive samples
+    de-emphasis    - single pole low pass with the broadcast time constant
+    FIRDecimator   - low pass at 15 kHz and decimation to the audio rate
+
+  Every stage carries its state over, so consecutive blocks give gapless
+  audio.  The audio is float32, with 1.0 for the full 75 kHz deviation.
+
+  The decimation factors are chosen so that the audio rate is exactly
+  'audio_rate' when the sample rate is a multiple of it; otherwise the
+  nearest achievable rate is used and given in 'self.audio_rate'.
+
+  Public attributes::
+
+   sample_rate - input samples per second
+   quad_rate   - samples per second into the discriminator
+   audio_rate  - audio samples per second out
+  """
+  def __init__(self, sample_rate, offset=0, audio_rate=48000,
+               deemphasis=75e-6, deviation=75e3):
+    """
+    Creates a WBFMDemodulator instance.
+
+    @param sample_rate : input samples per second
+    @type  sample_rate : float
+
+    @param offset : station frequency relative to the input center, Hz
+    @type  offset : float
+
+    @param audio_rate : requested audio samples per second
+    @type  audio_rate : float
+
+    @param deemphasis : time constant, s; 75 us in America, 50 us elsewhere
+    @type  deemphasis : float
+
+    @param deviation : peak frequency deviation, Hz
+    @type  deviation : float
+    """
+    if lfilter == None:
+      raise RuntimeError("WBFMDemodulator needs scipy.signal")
+    self.sample_rate = sample_rate
+    total = max(int(round(sample_rate/audio_rate)), 1)
+    # the discriminator needs the whole 200 kHz channel
+    quad_factor = 1
+    for factor in range(1, total+1):
+      if total % factor == 0 and sample_rate/factor >= 200e3:
+        quad_factor = factor
+    audio_factor = total//quad_factor
+    self.quad_rate = float(sample_rate)/quad_factor
+    self.audio_rate = self.quad_rate/audio_factor
+    self.channel = DownConverter(sample_rate, offset, 1, quad_factor,
+                                 bandwidth=min(200e3, 0.9*self.quad_rate))
+    self._gain = self.quad_rate/(2*pi*deviation)
+    self._last = complex64(0)
+    alpha = 1 - exp(-1/(deemphasis*self.quad_rate))
+    self._deemph_b = [alpha]
+    self._deemph_a = [1, alpha-1]
+    self._deemph_state = zeros(1)
+    self.audio = FIRDecimator(lowpass_filter(16*audio_factor+1,
+                                             15e3/self.quad_rate),
+                              audio_factor)
+
+  def __call__(self, data):
+    """
+    Demodulates a block
+
+    @param data : complex time series data
+    @type  data : numpy array of complex
+
+    @return: numpy array of float32 audio
+    """
+    baseband = self.channel(data)
+    if len(baseband) == 0:
+      return empty(0, dtype=float32)
+    previous = concatenate(([self._last], baseband[:-1]))
+    self._last = baseband[-1]
+    discriminated = angle(baseband*conj(previous))*self._gain
+    deemphasized, self._deemph_state = lfilter(self._deemph_b, self._deemph_a,
+                                               discriminated,
+                                               zi=self._deemph_state)
+    return self.audio(deemphasized).real.astype(float32)
@@ -5,19 +5,41 @@ Start the server on a remote Realtek SDR equipped host with, for example,
   rtl_tcp -a 192.168.0.13 -f 89900000 -s 200000
   
 For the server commands see https://gist.github.com/simeonmiteff/3792676
+
+The server first sends a 12 byte header, "RTL0" followed by the tuner type
+and the number of gain steps as big-endian 32-bit integers, and then an
+endless stream of unsigned I/Q byte pairs.  Every read here asks for an
+exact, even number of bytes and waits until it has them all, so no sample
+is lost to a short read and I and Q never change places.  The bytes go
+straight into preallocated buffers with 'recv_into' and are decoded from
+there without copying.
+
+For rates like 2.4 MS/s (4.8 MB/s) use 'stream', whose thread keeps the
+socket drained while the consumer works, as RtlSdr.stream does for a dongle.
 """
 import socket
 import errno
 import logging
 import struct
-from struct import unpack
-from numpy import arange, array, conj
-from numpy.fft import fft, fftshift
-from RealtekSDR.Signals import unpack_to_complex
+import threading
+from numpy import arange, bitwise_xor, conj, empty, int8, uint8
+from numpy.fft import fftshift
+from RealtekSDR.Buffers import BlockRing, BufferPool, DEFAULT_NUM_BLOCKS
+from RealtekSDR.FFTbackend import fft
+from RealtekSDR.Signals import IQDecoder
 
 TCP_IP = '192.168.0.13'
 TCP_PORT = 1234
+# bytes per spectrum for 'grab_SDR_spectrum'; clients plot BUFFER_SIZE/2
+# channels
 BUFFER_SIZE = 1024
+DEFAULT_BLOCK = 2**16       # bytes per network read
+RECEIVE_BUFFER = 2**22      # socket buffer, almost a second at 2.4 MS/s
+STREAM_POLL = 0.25          # s between checks for a cancelled stream
+HEADER_MAGIC = b"RTL0"
+HEADER_SIZE = 12
+TUNER_TYPES = {0: "unknown", 1: "E4000", 2: "FC0012", 3: "FC0013",
+               4: "FC2580", 5: "R820T", 6: "R828D"}
 
 SET_FREQUENCY = 0x01
 SET_SAMPLERATE = 0x02
@@ -31,27 +53,125 @@ module_logger = logging.getLogger(__name__)
 class RtlTCP(object):
   """
   Adapted from class by Simeon Miteff <simeon.miteff@gmail.com> 2012
+
+  Public attributes::
+
+   remote_host - server address
+   remote_port - server port
+   blk_size    - default number of bytes in a read
+   fft_size    - number of channels made by 'grab_SDR_spectrum'
+   pool        - preallocated buffers into which the socket is read
+   ring        - block ring of the current or last 'stream'
+   decoder     - converts raw bytes to complex samples
+   tuner       - name of the server's tuner
+   num_gains   - number of gain steps the tuner has
+   received    - number of sample bytes read
   """
-  def __init__(self,samplerate=2048000,freq=89000000):
+  def __init__(self, samplerate=2048000, freq=89000000, host=TCP_IP,
+               port=TCP_PORT, blk_size=DEFAULT_BLOCK, fft_size=BUFFER_SIZE//2):
     """
+    Connects to an rtl_tcp server and tunes it.
+
+    @param samplerate : samples per second
+    @type  samplerate : int
+
+    @param freq : center frequency, Hz
+    @type  freq : int
+
+    @param host : server address
+    @type  host : str
+
+    @param port : server port
+    @type  port : int
+
+    @param blk_size : default number of bytes in a read
+    @type  blk_size : int
+
+    @param fft_size : number of channels made by 'grab_SDR_spectrum'
+    @type  fft_size : int
     """
     self.logger = logging.getLogger(module_logger.name+".RtlTCP")
-    self.remote_host = TCP_IP
-    self.remote_port = TCP_PORT
+    self.remote_host = host
+    self.remote_port = port
+    self.blk_size = blk_size - blk_size % 2
+    self.fft_size = fft_size
+    self.pool = BufferPool(self.blk_size)
+    self.decoder = IQDecoder()
+    self.received = 0
+    self._cancel = threading.Event()
+    self._skip_byte = False   # an I/Q pair was left half read
     self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
     connected = False
     while not connected:
       try:
         self.conn.connect((self.remote_host, self.remote_port))
-        self.__send_command(SET_FREQUENCY, freq)
-        self.__send_command(SET_SAMPLERATE, samplerate)
-        buf = self.conn.recv(BUFFER_SIZE)
         connected = True
-      except socket.error as (code, msg):
-        if code != errno.EINTR:
-          raise Exception(msg)
-    self.logger.info("__init__: connected to %s", buf[:4])
-        
+      except socket.error as details:
+        if details.errno != errno.EINTR:
+          raise
+    self._read_header()
+    self.__send_command(SET_FREQUENCY, freq)
+    self.__send_command(SET_SAMPLERATE, samplerate)
+    self.logger.info("__init__: connected to %s:%d, %s tuner", host, port,
+                     self.tuner)
+
+  def _receive(self, buf, cancel=None):
+    """
+    Fills a buffer from the socket, however many reads it takes
+
+    If the socket has a timeout, 'cancel' is checked each time it expires
+    and the read is abandoned once it is set.  The bytes already read are
+    then thrown away; if that splits an I/Q pair, the other half is skipped
+    by the next read so that it starts with an I byte.
+
+    @param buf : writable buffer
+    @type  buf : numpy array of uint8 or bytearray
+
+    @param cancel : set to abandon the read
+    @type  cancel : threading.Event
+
+    @return: True if the buffer was filled, False if cancelled
+    """
+    view = memoryview(buf)
+    got = 0
+    while got < len(view):
+      try:
+        if self._skip_byte:
+          num = self.conn.recv_into(bytearray(1))
+          self._skip_byte = not num
+          if num:
+            continue
+        else:
+          num = self.conn.recv_into(view[got:])
+      except socket.timeout:
+        if cancel != None and cancel.is_set():
+          self._skip_byte = got % 2 == 1
+          return False
+        continue
+      except socket.error as details:
+        if details.errno == errno.EINTR:
+          continue
+        raise
+      if not num:
+        self.logger.warning("_receive: server died")
+        raise IOError("rtl_tcp server %s closed the connection"
+                      % self.remote_host)
+      got += num
+    return True
+
+  def _read_header(self):
+    """
+    Reads the dongle description which the server sends first
+    """
+    header = bytearray(HEADER_SIZE)
+    self._receive(header)
+    magic, tuner_type, self.num_gains = struct.unpack(">4sII", bytes(header))
+    if magic != HEADER_MAGIC:
+      raise IOError("%s:%d is not an rtl_tcp server"
+                    % (self.remote_host, self.remote_port))
+    self.tuner = TUNER_TYPES.get(tuner_type, "type %d" % tuner_type)
+
   def tune(self, freq):
         """
         """
@@ -61,7 +181,107 @@ class RtlTCP(object):
         """
         """
         cmd = struct.pack(">BI", command, parameter)
-        self.conn.send(cmd)
+        self.conn.sendall(cmd)
+
+  def read_raw(self, num=None):
+    """
+    Reads samples from the server
+
+    The bytes are read into the next buffer of the instance's pool, so the
+    returned array is only valid until the pool comes round to that buffer
+    again.  An odd 'num' is rounded down so that reads stay in step with the
+    I/Q pairs.
+
+    @param num : number of bytes (two per complex sample)
+    @type  num : int
+
+    @return: numpy array of uint8 in offset binary (128 is zero)
+    """
+    if num == None:
+      num = self.blk_size
+    buf = self.pool.next(num - num % 2)
+    self._receive(buf)
+    self.received += len(buf)
+    return buf
+
+  def get_data_block(self, num_samples=None, out=None):
+    """
+    Reads a block and returns it as complex samples
+
+    @param num_samples : number of bytes to read (two per complex sample)
+    @type  num_samples : int
+
+    @param out : optional array for the result
+    @type  out : numpy array of complex64
+
+    @return: numpy array of complex64
+    """
+    return self.decoder(self.read_raw(num_samples), out=out)
+
+  def stream(self, blk_size=None, num_blocks=DEFAULT_NUM_BLOCKS, dtype=None):
+    """
+    Generator of gapless sample blocks
+
+    A reader thread copies the socket into a BlockRing as fast as the server
+    sends, so the socket never backs up while the consumer is busy.  Blocks
+    the consumer is too slow for are dropped and counted in
+    'self.ring.dropped'.  Each block is a view of a ring slot and is only
+    valid until the next one is requested.
+
+    @param blk_size : bytes per block; rounded down to an even number
+    @type  blk_size : int
+
+    @param num_blocks : number of blocks the ring holds
+    @type  num_blocks : int
+
+    @param dtype : None for raw uint8 or int8 for signed samples
+    @type  dtype : numpy type
+
+    @return: numpy array of uint8 or int8 per iteration
+    """
+    if blk_size == None:
+      blk_size = self.blk_size
+    blk_size -= blk_size % 2
+    self.ring = BlockRing(blk_size, num_blocks)
+    ring = self.ring
+    self._cancel.clear()
+    # the reader must not wait for ever on a server which has stalled
+    self.conn.settimeout(STREAM_POLL)
+    reader = threading.Thread(target=self._read_stream, args=(blk_size,))
+    reader.daemon = True
+    reader.start()
+    try:
+      while True:
+        block = ring.get()
+        if block is None:
+          break
+        if dtype == int8:
+          bitwise_xor(block, 0x80, out=block)
+          block = block.view(int8)
+        yield block
+    finally:
+      # the reader stops between blocks or within STREAM_POLL, and later
+      # reads stay in step with the I/Q pairs either way
+      self._cancel.set()
+      reader.join()
+      self.conn.settimeout(None)
+      self.logger.info("stream: %d blocks received, %d dropped",
+                       ring.received, ring.dropped)
+
+  def _read_stream(self, blk_size):
+    """
+    Body of the stream reader thread
+    """
+    buf = empty(blk_size, dtype=uint8)
+    try:
+      while not self._cancel.is_set():
+        if not self._receive(buf, self._cancel):
+          break
+        self.received += blk_size
+        self.ring.put(buf.ctypes.data, blk_size)
+    except (IOError, socket.error) as details:
+      self.logger.error("_read_stream: %s", details)
+    self.ring.close()
 
   def grab_SDR_spectrum(self):
     """
@@ -92,29 +312,15 @@ class RtlTCP(object):
     It requires 5 us to take one complex sample.  BUFFER_SIZE = 1024 means
     512 complex samples which takes 2.56 ms so we can process faster than
     the spectrum refresh rate.
+
+    The spectrum has 'fft_size' channels, BUFFER_SIZE/2 unless set when the
+    client was made; the size of the network reads does not depend on it.
     """
-    not_read = True
-    while not_read:
-        try:
-          buf = self.conn.recv(BUFFER_SIZE)
-        except socket.error as (code, msg):
-          if code != errno.EINTR:
-            raise Exception(msg)
-        if len(buf) == BUFFER_SIZE:
-          rawdata = unpack(str(len(buf))+'b', buf)
-          data = unpack_to_complex(array(rawdata))
-          self.logger.debug("grab_SDR_spectrum: got %d", len(data))   
-          xform = fft(data)
-          shifted = fftshift(xform)
-          spectrum = abs(shifted*conj(shifted))
-          not_read = False
-        elif len(buf) == 0:
-          self.logger.warning("grab_SDR_spectrum: server died")
-          self.conn.close()
-          exit()
-        else:
-          self.logger.warning("grab_SDR_spectrum: short read")
-    return spectrum
+    data = self.get_data_block(2*self.fft_size)
+    self.logger.debug("grab_SDR_spectrum: got %d", len(data))
+    xform = fft(data)
+    shifted = fftshift(xform)
+    return abs(shifted*conj(shifted))
 
   def close(self):
     """
@@ -43,28 +43,34 @@ Between 10 and 25 MHz, no signal is seen.  I see the same between 1000 and
 1400 MHz.  I'm not sure that I trust the results between 1400 and 1725 MHz.
 """
 import ctypes as ct
-import struct
-from numpy import arange, array
+from numpy import arange, array, bitwise_xor, complex64, dot, empty, float32
+from numpy import float64, int8, zeros
 from time import sleep
 import logging
+import threading
 
-from RealtekSDR.Signals import sideband_separate, unpack_to_complex
+from RealtekSDR.Buffers import BlockRing, BufferPool, DEFAULT_NUM_BLOCKS
+from RealtekSDR.Signals import IQDecoder, StreamingHistogram
+from RealtekSDR.Signals import sideband_power, sideband_separate
+from RealtekSDR.Signals import unpack_to_complex
 
 module_logger = logging.getLogger(__name__)
 
 DEFAULT_BUF_LENGTH = 16 * 16384 # used by librtlsdr and apps in /opt/rtl-sdr.
-rtlsdrlib = ct.CDLL("/usr/local/lib/librtlsdr.so")
+# one record per tuning of a power scan
+SCAN_DTYPE = [('freq', float64), ('lsb', float64), ('usb', float64),
+              ('total', float64)]
+# sideband voltages span about twice the +/-128 of the raw samples
+HIST_LIMITS = (-256., 256.)
+try:
+  rtlsdrlib = ct.CDLL("/usr/local/lib/librtlsdr.so")
+except OSError:
+  # recordings can be replayed and analysed without the library
+  module_logger.debug("librtlsdr.so could not be loaded")
+  rtlsdrlib = None
 
 ############################## object typing ##################################
 
-get_dev_str = rtlsdrlib.rtlsdr_get_device_usb_strings
-get_dev_str.argtypes = [ct.c_int, ct.c_char_p, ct.c_char_p, ct.c_char_p]
-get_dev_str.restype = ct.c_int
-
-get_dev_nam = rtlsdrlib.rtlsdr_get_device_name
-get_dev_nam.restype = ct.c_char_p
-get_dev_nam.argtypes = [ct.c_int]
-
 class RtlSdrDevStr(ct.Structure):
   """
   The parent library has defined a type called 'rtlsdr_dev' in
@@ -74,54 +80,76 @@ class RtlSdrDevStr(ct.Structure):
   """
   _fields_ = []
 
-dev_open = rtlsdrlib.rtlsdr_open
-dev_open.argtypes = [ct.POINTER(ct.POINTER(RtlSdrDevStr)), ct.c_int]
-dev_open.restype = ct.c_int
+# the callback gets a pointer to the samples, their length and our context
+read_async_cb_t = ct.CFUNCTYPE(None, ct.POINTER(ct.c_ubyte), ct.c_uint32,
+                               ct.c_void_p)
+
+if rtlsdrlib != None:
+  get_dev_str = rtlsdrlib.rtlsdr_get_device_usb_strings
+  get_dev_str.argtypes = [ct.c_int, ct.c_char_p, ct.c_char_p, ct.c_char_p]
+  get_dev_str.restype = ct.c_int
+
+  get_dev_nam = rtlsdrlib.rtlsdr_get_device_name
+  get_dev_nam.restype = ct.c_char_p
+  get_dev_nam.argtypes = [ct.c_int]
+
+  dev_open = rtlsdrlib.rtlsdr_open
+  dev_open.argtypes = [ct.POINTER(ct.POINTER(RtlSdrDevStr)), ct.c_int]
+  dev_open.restype = ct.c_int
+
+  get_f = rtlsdrlib.rtlsdr_get_center_freq
+  get_f.restype = ct.c_int
+  get_f.argtypes = [ct.POINTER(RtlSdrDevStr)]
+
+  set_f = rtlsdrlib.rtlsdr_set_center_freq
+  set_f.restype = ct.c_int
+  set_f.argtypes = [ct.POINTER(RtlSdrDevStr),ct.c_int]
 
-get_f = rtlsdrlib.rtlsdr_get_center_freq
-get_f.restype = ct.c_int
-get_f.argtypes = [ct.POINTER(RtlSdrDevStr)]
+  get_samp_rate = rtlsdrlib.rtlsdr_get_sample_rate
+  get_samp_rate.restype = ct.c_int
+  get_samp_rate.argtypes = [ct.POINTER(RtlSdrDevStr)]
 
-set_f = rtlsdrlib.rtlsdr_set_center_freq
-set_f.restype = ct.c_int
-set_f.argtypes = [ct.POINTER(RtlSdrDevStr),ct.c_int]
+  set_samp_rate = rtlsdrlib.rtlsdr_set_sample_rate
+  set_samp_rate.restype = ct.c_int
+  set_samp_rate.argtypes = [ct.POINTER(RtlSdrDevStr), ct.c_int]
 
-get_samp_rate = rtlsdrlib.rtlsdr_get_sample_rate
-get_samp_rate.restype = ct.c_int
-get_samp_rate.argtypes = [ct.POINTER(RtlSdrDevStr)]
+  get_g = rtlsdrlib.rtlsdr_get_tuner_gain
+  get_g.restype = ct.c_int
+  get_g.argtypes = [ct.POINTER(RtlSdrDevStr)]
 
-set_samp_rate = rtlsdrlib.rtlsdr_set_sample_rate
-set_samp_rate.restype = ct.c_int
-set_samp_rate.argtypes = [ct.POINTER(RtlSdrDevStr), ct.c_int]
+  set_g = rtlsdrlib.rtlsdr_set_tuner_gain
+  set_g.restype = ct.c_int
+  set_g.argtypes = [ct.POINTER(RtlSdrDevStr), ct.c_int]
 
-get_g = rtlsdrlib.rtlsdr_get_tuner_gain
-get_g.restype = ct.c_int
-get_g.argtypes = [ct.POINTER(RtlSdrDevStr)]
+  set_gm = rtlsdrlib.rtlsdr_set_tuner_gain_mode
+  set_gm.restype = ct.c_int
+  set_gm.argtypes = [ct.POINTER(RtlSdrDevStr), ct.c_int]
 
-set_g = rtlsdrlib.rtlsdr_set_tuner_gain
-set_g.restype = ct.c_int
-set_g.argtypes = [ct.POINTER(RtlSdrDevStr), ct.c_int]
+  gtg = rtlsdrlib.rtlsdr_get_tuner_gains
+  gtg.argtypes = [ct.POINTER(RtlSdrDevStr),ct.POINTER(None)]
+  gtg.restype = ct.c_int
 
-set_gm = rtlsdrlib.rtlsdr_set_tuner_gain_mode
-set_gm.restype = ct.c_int
-set_gm.argtypes = [ct.POINTER(RtlSdrDevStr), ct.c_int]
+  reset_buf = rtlsdrlib.rtlsdr_reset_buffer
+  reset_buf.restype = ct.c_int
+  reset_buf.argtypes = [ct.POINTER(RtlSdrDevStr)]
 
-gtg = rtlsdrlib.rtlsdr_get_tuner_gains
-gtg.argtypes = [ct.POINTER(RtlSdrDevStr),ct.POINTER(None)]
-gtg.restype = ct.c_int
+  read_sync = rtlsdrlib.rtlsdr_read_sync
+  read_sync.restype = ct.c_int
+  read_sync.argtypes = [ct.POINTER(RtlSdrDevStr), ct.c_void_p,
+                            ct.c_int, ct.POINTER(ct.c_int)]
 
-reset_buf = rtlsdrlib.rtlsdr_reset_buffer
-reset_buf.restype = ct.c_int
-reset_buf.argtypes = [ct.POINTER(RtlSdrDevStr)]
+  read_async = rtlsdrlib.rtlsdr_read_async
+  read_async.restype = ct.c_int
+  read_async.argtypes = [ct.POINTER(RtlSdrDevStr), read_async_cb_t,
+                         ct.c_void_p, ct.c_uint32, ct.c_uint32]
 
-read_sync = rtlsdrlib.rtlsdr_read_sync
-read_sync.restype = ct.c_int
-read_sync.argtypes = [ct.POINTER(RtlSdrDevStr), ct.c_void_p,
-                          ct.c_int, ct.POINTER(ct.c_int)]
+  cancel_async = rtlsdrlib.rtlsdr_cancel_async
+  cancel_async.restype = ct.c_int
+  cancel_async.argtypes = [ct.POINTER(RtlSdrDevStr)]
 
-rtlsdr_close = rtlsdrlib.rtlsdr_close
-rtlsdr_close.argtypes = [ct.POINTER(RtlSdrDevStr)]
-rtlsdr_close.restype = ct.c_int
+  rtlsdr_close = rtlsdrlib.rtlsdr_close
+  rtlsdr_close.argtypes = [ct.POINTER(RtlSdrDevStr)]
+  rtlsdr_close.restype = ct.c_int
 
 ######################### libusb errors ###################################
 
@@ -187,6 +215,9 @@ class RtlSdr(object):
 
    devp        - ptr to the 'rtlsdr_dev' structure provided by the C library
    blk_size    - default size of block read
+   pool        - preallocated buffers into which the library reads
+   ring        - block ring of the current or last 'stream'
+   decoder     - converts raw bytes to complex samples
    gain        - gain; gain=0 means AGC
    manual_gain - gain set automatically if False (default)
    cf          - center frequency
@@ -202,8 +233,14 @@ class RtlSdr(object):
     @param dev_ID : device numeric ID
     @type  dev_ID : int
     """
+    if rtlsdrlib == None:
+      raise RtlSdrException(None, "librtlsdr.so is not installed")
     self.devp = self._open(dev_ID)
     self.blk_size = dflt_blk_size
+    self.pool = BufferPool(dflt_blk_size)
+    self.decoder = IQDecoder()
+    # the library reports the number of bytes read through this
+    self._nread = ct.c_int()
 
   def _open(self, dev_ID):
     """
@@ -319,48 +356,157 @@ class RtlSdr(object):
       raise RtlSdrException(status, "error return in reset_buffer")
     return True
 
-  def synch_read(self, num=None):
+  def synch_read_raw(self, num=None):
     """
-    Request a read operation and wait for the results
+    Request a read operation and wait for the unconverted results
+
+    The library writes directly into the next buffer of the instance's pool,
+    so the returned array is only valid until the pool comes round to that
+    buffer again.  Copy it if it must be kept longer.
 
-    @param num : number of samples
+    @param num : number of bytes (two per complex sample)
     @type  num : int
+
+    @return: numpy array of uint8 in offset binary (128 is zero)
     """
-    # create a buffer to hold the data
     if num == None:
       num = self.blk_size
-    module_logger.debug("synch_read: requesting %d samples", num)
-    buf = ct.create_string_buffer(num)
-    # create a pointer to the integer which records how many bytes were read
-    # note that invoking the type as a class creates an instance of an int
-    nreadp = ct.pointer(ct.c_int())
+    module_logger.debug("synch_read_raw: requesting %d bytes", num)
+    buf = self.pool.next(num)
     # Now we read from the device
-    status = read_sync(self.devp, buf, num, nreadp)
+    status = read_sync(self.devp, buf.ctypes.data, num, ct.byref(self._nread))
     if status:
       if libusb_error_text.has_key(status):
         raise RtlSdrException(status, libusb_error_text[status])
       else:
         raise RtlSdrException(status, "error return in synch_read")
-    datalen = nreadp.contents.value
-    module_logger.debug("synch_read: got %d samples", datalen)
-    # now decode the data
+    datalen = self._nread.value
+    module_logger.debug("synch_read_raw: got %d bytes", datalen)
+    return buf[:datalen]
+
+  def synch_read(self, num=None, dtype=int8):
+    """
+    Request a read operation and wait for the results
+
+    The samples are converted in place in the pool buffer used by
+    'synch_read_raw' and are subject to the same lifetime.
+
+    @param num : number of bytes (two per complex sample)
+    @type  num : int
+
+    @param dtype : int8 (default) or float32
+    @type  dtype : numpy type
+
+    @return: numpy array of signed I and Q samples
+    """
+    rawdata = self.synch_read_raw(num)
+    signed = rawdata.view(int8)
+    # flipping the top bit of an offset binary byte subtracts 128
+    bitwise_xor(rawdata, 0x80, out=rawdata)
+    if dtype == float32:
+      floats = self.pool.floats(len(signed))
+      floats[:] = signed
+      return floats
+    return signed
+
+  def stream(self, blk_size=None, num_blocks=DEFAULT_NUM_BLOCKS, dtype=None):
+    """
+    Generator of gapless sample blocks from an asynchronous read
+
+    A reader thread runs 'rtlsdr_read_async', whose callback copies every
+    USB transfer into a BlockRing.  This generator hands the blocks out in
+    order.  If the consumer falls behind, blocks are dropped and counted in
+    'self.ring.dropped' instead of stalling the USB transfers.  Closing the
+    generator (or leaving a 'for' loop over it) cancels the read.
+
+    Each block is a view of a ring slot and is only valid until the next one
+    is requested.
+
+    @param blk_size : bytes per block; must be a multiple of 512
+    @type  blk_size : int
+
+    @param num_blocks : number of blocks the ring holds
+    @type  num_blocks : int
+
+    @param dtype : None for raw uint8 or int8 for signed samples
+    @type  dtype : numpy type
+
+    @return: numpy array of uint8 or int8 per iteration
+    """
+    if blk_size == None:
+      blk_size = self.blk_size
+    if blk_size % 512:
+      raise RtlSdrException(blk_size, "stream block size must be n*512")
+    self.ring = BlockRing(blk_size, num_blocks)
+    ring = self.ring
+    reader = self._start_reader(blk_size)
     try:
-      unsigned_data = struct.unpack(str(datalen)+'B', buf.raw)
-    except Exception, details:
-      module_logger.debug("synch_read: buffer length is %d", len(buf.raw))
-      print buf.raw
-      raise RtlSdrException(details)
-    return array(unsigned_data)-128
+      while True:
+        block = ring.get()
+        if block is None:
+          break
+        if dtype == int8:
+          bitwise_xor(block, 0x80, out=block)
+          block = block.view(int8)
+        yield block
+    finally:
+      self._stop_reader(reader)
+      module_logger.info("stream: %d blocks received, %d dropped",
+                         ring.received, ring.dropped)
 
-  def get_data_block(self, num_samples=None):
+  def _start_reader(self, blk_size):
     """
+    Starts the thread which fills 'self.ring' for 'stream'
+
+    @return: the reader thread
     """
-    rawdata = self.synch_read(num=num_samples)
-    if rawdata.min() < -125 or rawdata.max() > 125:
+    ring = self.ring
+    def callback(buf, length, context):
+      ring.put(buf, length)
+    # keep a reference so the callback is not garbage collected
+    self._callback = read_async_cb_t(callback)
+    self.reset_buffer()
+    reader = threading.Thread(target=self._read_async, args=(blk_size,))
+    reader.daemon = True
+    reader.start()
+    return reader
+
+  def _stop_reader(self, reader):
+    """
+    Stops the thread started by '_start_reader'
+    """
+    cancel_async(self.devp)
+    reader.join()
+
+  def _read_async(self, blk_size):
+    """
+    Body of the stream reader thread; returns when the read is cancelled
+    """
+    status = read_async(self.devp, self._callback, None, 0, blk_size)
+    if status:
+      if libusb_error_text.has_key(status):
+        module_logger.error("_read_async: %s", libusb_error_text[status])
+      else:
+        module_logger.error("_read_async: error return %d", status)
+    self.ring.close()
+
+  def get_data_block(self, num_samples=None, out=None):
+    """
+    Reads a block and returns it as complex samples
+
+    @param num_samples : number of bytes to read (two per complex sample)
+    @type  num_samples : int
+
+    @param out : optional array for the result
+    @type  out : numpy array of complex64
+
+    @return: numpy array of complex64
+    """
+    rawdata = self.synch_read_raw(num=num_samples)
+    if rawdata.min() < 3 or rawdata.max() > 253:
       module_logger.warning("data min=%d, max=%d",
-                            rawdata.min(), rawdata.max())
-    data = unpack_to_complex(rawdata)
-    return data
+                            int(rawdata.min())-128, int(rawdata.max())-128)
+    return self.decoder(rawdata, out=out)
 
   def get_tuner_gains(self):
     """
@@ -436,12 +582,29 @@ class RtlSdr(object):
     module_logger.info("configure: reset_buffer status: %s",status)
     return centerfreq, samplerate
 
-  def get_power_scan(self, start, end, step, gain=0):
+  def get_power_scan(self, start, end, step, gain=0, hist_bins=None,
+                     hist_limits=HIST_LIMITS, sidebands=True):
     """
     Performs a power scan between two frequencies with a given step size.
 
-    Returns lists with frequencies, LSB powers, USB powers, total powers,
-    LSB voltages, USB voltages.
+    The result has one record per tuning with fields 'freq' (center, MHz),
+    'lsb', 'usb' and 'total'.  'total' is the mean of |x|**2 per sample,
+    looked up from the raw bytes, however the scan is made.  'lsb' and 'usb'
+    are the mean squares of the sideband voltages, each of which carries the
+    power of its half of the band at full weight.  The DC and Nyquist bins
+    go into both sidebands at half weight, so the sideband powers do not add
+    up to twice 'total'; with the DC spike of the dongle they fall short by
+    about half its power.  The LSB power belongs at freq-step/4 and the USB
+    power at freq+step/4.
+
+    If 'hist_bins' is given, the LSB and USB voltages of every sample are
+    also counted into fixed-bin histograms, so the memory used does not grow
+    with the length of the scan.  The histograms need the sideband voltages,
+    so asking for them separates the sidebands, and fills in 'lsb' and 'usb',
+    even if 'sidebands' is False.  Without histograms the sideband powers
+    are obtained from a forward FFT alone, which is much faster.  If the
+    sidebands are not wanted at all, 'lsb' and 'usb' are left at zero and
+    the samples are not decoded.
 
     @param start : lower end of scan in MHz.
     @type  start : float or int.
@@ -452,39 +615,59 @@ class RtlSdr(object):
     @param step : step size and sampling rate in MHz
     @type  step : float or int
 
-    @return: tuple(freqs,pwrl,pwru,pwr,signll,signlu)
-    """
-    freqs = []
-    signlu = []
-    signll = []
-    pwru = []
-    pwrl = []
-    pwr = []
-    for freq in arange(start,end,step): # MHz
-      cf = self.set_freq(int(int(freq*1000000)))
-      freqs.append(cf/1e6-0.25*step)
-      freqs.append(cf/1e6+0.25*step)
+    @param hist_bins : number of histogram bins; None for no histograms
+    @type  hist_bins : int
+
+    @param hist_limits : voltage range covered by the histograms
+    @type  hist_limits : tuple of float
+
+    @param sidebands : separate the sidebands; False for total power only,
+                       unless there are histograms
+    @type  sidebands : bool
+
+    @return: tuple(scan, LSB histogram, USB histogram)
+    """
+    cfs = arange(start,end,step) # MHz
+    scan = zeros(len(cfs), dtype=SCAN_DTYPE)
+    if hist_bins:
+      lsb_hist = StreamingHistogram(hist_bins, hist_limits)
+      usb_hist = StreamingHistogram(hist_bins, hist_limits)
+    else:
+      lsb_hist = usb_hist = None
+    data = empty(self.blk_size//2, dtype=complex64)
+    for hop in range(len(cfs)):
+      cf = self.set_freq(int(int(cfs[hop]*1000000)))
       status = self.reset_buffer()
       sleep(0.01)
-      rawdata = self.synch_read()
-      if rawdata.min() < -120 or rawdata.max() > 120:
+      rawdata = self.synch_read_raw()
+      if rawdata.min() < 8 or rawdata.max() > 248:
         module_logger.warning(
                        "get_power_scan: saturating; %7.2f MHz, min=%d, max=%d",
-                       cf/1.e6, rawdata.min(), rawdata.max())
-      data = unpack_to_complex(rawdata)
-      module_logger.debug("get_power_scan: %7.2f MHz, min=%s, max=%s",
-                    cf/1.e6, str(data.min()),str(data.max()))
-      datalen = len(data)
-      lsb,usb = sideband_separate(data)
-      signll += list(lsb)
-      signlu += list(usb)
-      LSB = (lsb**2).sum()/datalen
-      USB = (usb**2).sum()/datalen
-      pwrl.append(LSB)
-      pwru.append(USB)
-      pwr.append(LSB)
-      pwr.append(USB)
-    return freqs,pwrl,pwru,pwr,signll,signlu
+                       cf/1.e6, int(rawdata.min())-128, int(rawdata.max())-128)
+      datalen = len(rawdata)//2
+      record = scan[hop]
+      record['freq'] = cf/1e6
+      # the sidebands share the DC and Nyquist bins, so their powers do not
+      # give the total; it is taken from the raw bytes in every case
+      record['total'] = self.decoder.power(rawdata)/datalen
+      if not (sidebands or hist_bins):
+        module_logger.debug("get_power_scan: %7.2f MHz, total=%f",
+                            cf/1.e6, record['total'])
+        continue
+      samples = self.decoder(rawdata, out=data[:datalen])
+      if hist_bins:
+        # the sideband voltages themselves are needed
+        lsb,usb = sideband_separate(samples)
+        lsb_hist.update(lsb)
+        usb_hist.update(usb)
+        record['lsb'] = dot(lsb, lsb)/datalen
+        record['usb'] = dot(usb, usb)/datalen
+      else:
+        record['lsb'], record['usb'] = sideband_power(samples)
+      module_logger.debug(
+                       "get_power_scan: %7.2f MHz, LSB=%f, USB=%f, total=%f",
+                       cf/1.e6, record['lsb'], record['usb'], record['total'])
+    return scan, lsb_hist, usb_hist
 
 ################### module methods ############################################
 
@@ -492,6 +675,8 @@ def get_device_count():
   """
   Returns the number of RTL SDR devices on the bus
   """
+  if rtlsdrlib == None:
+    return 0
   return rtlsdrlib.rtlsdr_get_device_count()
 
 def get_devices():
@@ -618,6 +803,8 @@ def show_image(image, extent):
   
   @return: matplotlib Figure instance
   """
+  # imported here so that the package does not need matplotlib
+  import pylab as pl
   fig = pl.figure()
   pl.imshow(image, extent=extent, aspect="auto")
   pl.grid()
@@ -630,10 +817,9 @@ def show_image(image, extent):
 
 if __name__ == "__main__":
   from pylab import *
-  from Graphics import make_spectrogram
+  from RealtekSDR.Signals import make_spectrogram
   from stations import FM_freq
-  from cPickle import load
-  from numpy.polynomial.chebyshev import chebval
+  from RealtekSDR.Calibration import BaselineStore
 
   mylogger = logging.getLogger()
   logging.basicConfig()
@@ -673,14 +859,14 @@ if __name__ == "__main__":
                          centerfreq+samplerate/2,
                          samplerate/num_bins))/1e6 # MHz
     if normalize:
-      coeffile = open("baseline_coefs.pkl","rb")
-      coef_dict = load(coeffile)
-      coeffile.close()
-      coefs = coef_dict[float(sr/1e6)]
-      print "Coefficients loaded"
-      normalizer = 1./chebval(freqs-centerfreq/1.e6,coefs)
+      baselines = BaselineStore()
+      normalizer = baselines.normalizer(samplerate, num_bins, gain=gain,
+                                        freq=centerfreq)
+      print "Baseline loaded"
+      # the baseline is a fit to power spectra, so it divides the power; the
+      # old demo squared it as a voltage factor, deepening the correction
       image = make_spectrogram(data, num_spec, num_bins, log=True,
-                               normalizer=normalizer)
+                               power_normalizer=normalizer)
     else:
       image = make_spectrogram(data, num_spec, num_bins, log=True)
 
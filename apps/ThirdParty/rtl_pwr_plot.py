@@ -1,106 +1,126 @@
 #! /usr/bin/env python2
 
 from PIL import Image, ImageDraw, ImageFont
-import sys, gzip, math, colorsys, datetime
-from collections import defaultdict
-from itertools import *
+import sys, gzip, math, datetime
+import numpy
 
 # todo: matplotlib powered --interactive
 # arbitrary freq marker spacing
 
+# The file is read once.  Each line goes straight into a float32 grid, its
+# row found from its timestamp with a dict and its column from its lowest
+# frequency, and the grid grows by doubling when it fills.  The colours come
+# from a 256 entry table applied to the whole grid, and the image is made
+# from the resulting array in one call.
+
 path = sys.argv[1]
 output = sys.argv[2]
 
-raw_data = lambda: open(path)
 if path.endswith('.gz'):
-    raw_data = lambda: gzip.open(path, 'rb')
-
-def frange(start, stop, step):
-    i = 0
-    while (i*step + start <= stop):
-        yield i*step + start
-        i += 1
+    raw_data = gzip.open(path, 'rb')
+else:
+    raw_data = open(path, 'rb')
 
 print("loading")
 
-freqs = set()
-f_cache = set()
-times = set()
+grid = numpy.empty((256, 1024), dtype=numpy.float32)
+grid.fill(numpy.nan)     # NaN marks pixels with no data
+rows = {}                # timestamp -> row
+f_origin = None          # frequency of column 0
+f_high = None            # highest frequency
+used = 0                 # columns with data
 labels = set()
-min_z = 0
-max_z = -100
-start, stop = None, None
-for line in raw_data():
-    line = [s.strip() for s in line.strip().split(',')]
-    line = [line[0], line[1]] + [float(s) for s in line[2:] if s]
-
-    low = line[2]
-    high = line[3]
-    step = line[4]
-    f_key = (int(low), int(high), step)
-    if f_key not in f_cache:
-        freqs.update(list(frange(int(low), int(high), step)))
-        freqs.add(high)
-        labels.add(low)
-        f_cache.add(f_key)
-
-    t = line[0] + ' ' + line[1]
-    times.add(t)
-
-    zs = line[6:]
-    min_z = min(min_z, min(z for z in zs if not math.isinf(z)))
-    max_z = max(max_z, max(zs))
-
-    if start is None:
-        start = datetime.datetime.strptime(line[0] + ' ' + line[1], '%Y-%m-%d %H:%M:%S')
-    stop = datetime.datetime.strptime(line[0] + ' ' + line[1], '%Y-%m-%d %H:%M:%S')
-
-freqs = list(sorted(list(freqs)))
-times = list(sorted(list(times)))
-labels = list(sorted(list(labels)))
-
+first_time, last_time = None, None
+for line in raw_data:
+    if isinstance(line, bytes):
+        line = line.decode('ascii')
+    fields = line.split(',', 6)
+    if len(fields) < 7:
+        continue
+    t = fields[0].strip() + ' ' + fields[1].strip()
+    try:
+        low = int(fields[2])
+        high = int(fields[3])
+        step = float(fields[4])
+        # empty values, as from a trailing comma, are left out as before
+        zs = numpy.array([s for s in fields[6].split(',') if s.strip()],
+                         dtype=numpy.float32)
+    except ValueError:
+        print("skipping bad line: %s" % line.strip())
+        continue
+    # -inf and nan are drawn at the lowest level
+    zs[~numpy.isfinite(zs)] = -numpy.inf
+    labels.add(low)
+    f_high = max(f_high, high) if f_high is not None else high
+
+    if first_time is None:
+        first_time = t
+    last_time = t
+    y = rows.setdefault(t, len(rows))
+    if f_origin is None:
+        f_origin = low
+    x = int(round((low - f_origin) / step))
+    if x < 0:
+        # a hop below any seen so far; move everything right
+        grid = numpy.concatenate((numpy.full((grid.shape[0], -x), numpy.nan,
+                                             dtype=numpy.float32), grid),
+                                 axis=1)
+        f_origin = low
+        used -= x
+        x = 0
+    x_end = x + len(zs)
+    used = max(used, x_end)
+    if y >= grid.shape[0] or x_end > grid.shape[1]:
+        bigger = numpy.full((max(grid.shape[0], 2*(y + 1)),
+                             max(grid.shape[1], x_end)),
+                            numpy.nan, dtype=numpy.float32)
+        bigger[:grid.shape[0], :grid.shape[1]] = grid
+        grid = bigger
+    grid[y, x:x_end] = zs
+raw_data.close()
+
+# columns run from the lowest frequency to the highest, as in the original
+# plotter
+width = max(int(round((f_high - f_origin) / step)) + 1, used)
+if width > grid.shape[1]:
+    grid = numpy.concatenate((grid, numpy.full((grid.shape[0],
+                                                width - grid.shape[1]),
+                                               numpy.nan,
+                                               dtype=numpy.float32)),
+                             axis=1)
+grid = grid[:len(rows), :width]
+# the timestamps are in time order in the file, but sort them to be sure
+times = sorted(rows.keys())
+grid = grid[[rows[t] for t in times]]
+f_max = f_origin + (width - 1) * step
+
+finite = grid[numpy.isfinite(grid)]
+min_z = min(0, float(finite.min())) if len(finite) else 0
+max_z = max(-100, float(finite.max())) if len(finite) else -100
+
+labels = list(sorted(labels))
 if len(labels) == 1:
-    delta = (max(freqs) - min(freqs)) / (len(freqs) / 500)
+    delta = (f_max - f_origin) / (width / 500)
     delta = round(delta / 10**int(math.log10(delta))) * 10**int(math.log10(delta))
     delta = int(delta)
-    lower = int(math.ceil(min(freqs) / delta) * delta)
-    labels = list(range(lower, int(max(freqs)), delta))
-
-print("x: %i, y: %i, z: (%f, %f)" % (len(freqs), len(times), min_z, max_z))
-
-def rgb2(z):
-    g = (z - min_z) / (max_z - min_z)
-    return (int(g*255), int(g*255), 50)
+    lower = int(math.ceil(f_origin / delta) * delta)
+    labels = list(range(lower, int(f_max), delta))
 
-def rgb3(z):
-    g = (z - min_z) / (max_z - min_z)
-    c = colorsys.hsv_to_rgb(0.65-(g-0.08), 1, 0.2+g)
-    return (int(c[0]*256),int(c[1]*256),int(c[2]*256))
+print("x: %i, y: %i, z: (%f, %f)" % (width, len(times), min_z, max_z))
 
 print("drawing")
-img = Image.new("RGB", (len(freqs), len(times)))
-pix = img.load()
-x_size = img.size[0]
-for line in raw_data():
-    line = [s.strip() for s in line.strip().split(',')]
-    line = [line[0], line[1]] + [float(s) for s in line[2:] if s]
-    t = line[0] + ' ' + line[1]
-    if t not in times:
-        continue  # happens with live files
-    y = times.index(t)
-    low = line[2]
-    high = line[3]
-    step = line[4]
-    x_start = freqs.index(low)
-    for i in range(len(line[6:])):
-        x = x_start + i
-        if x >= x_size:
-            continue
-        z = line[6+i]
-        # fast check for nan/-inf
-        if not z >= min_z:
-            z = min_z
-        pix[x,y] = rgb2(z)
+# the rgb2 colours of the original plotter as a lookup table
+g = numpy.arange(256) / 255.
+lut = numpy.empty((256, 3), dtype=numpy.uint8)
+lut[:, 0] = lut[:, 1] = (g * 255).astype(numpy.uint8)
+lut[:, 2] = 50
+levels = (grid - min_z) * (255. / (max_z - min_z))
+missing = numpy.isnan(levels)
+levels[missing] = 0
+numpy.clip(levels, 0, 255, out=levels)
+pixels = lut[levels.astype(numpy.uint8)]
+pixels[missing] = 0
+img = Image.fromarray(pixels, "RGB")
 
 print("labeling")
 draw = ImageDraw.Draw(img)
@@ -108,21 +128,22 @@ font = ImageFont.load_default()
 pixel_width = step
 for label in labels:
     y = 10
-    #x = freqs.index(label)
-    x = int((label-min(freqs)) / pixel_width)
+    x = int((label - f_origin) / pixel_width)
     s = '%.3fMHz' % (label/1000000.0)
     draw.text((x, y), s, font=font, fill='white')
 
+start = datetime.datetime.strptime(first_time, '%Y-%m-%d %H:%M:%S')
+stop = datetime.datetime.strptime(last_time, '%Y-%m-%d %H:%M:%S')
 duration = stop - start
 duration = duration.seconds
 pixel_height = duration / len(times)
 hours = int(duration / 3600)
 minutes = int((duration - 3600*hours) / 60)
 draw.text((2, img.size[1] - 45), 'Duration: %i:%02i' % (hours, minutes), font=font, fill='white')
-draw.text((2, img.size[1] - 35), 'Range: %.2fMHz - %.2fMHz' % (min(freqs)/1e6, max(freqs)/1e6), font=font, fill='white')
+draw.text((2, img.size[1] - 35), 'Range: %.2fMHz - %.2fMHz' % (f_origin/1e6, f_max/1e6), font=font, fill='white')
 draw.text((2, img.size[1] - 25), 'Pixel: %.2fHz x %is' % (pixel_width, int(round(pixel_height))), font=font, fill='white')
 draw.text((2, img.size[1] - 15), 'Started: {0}'.format(start), font=font, fill='white')
 # bin size
 
 print("saving")
-img.save(output) 
+img.save(output)
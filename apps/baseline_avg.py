@@ -1,59 +1,64 @@
 """
-The data files consist of rows with (freq, power) pairs. There are 64 pairs for
-each spectrum.  The spectra are taken so that the frequencies increase
-monotonically.  The number of rows must be n*64, where n is the number of
-spectra.
+Fits passband baselines to the spectra in hires_scan baseline files.
+
+The data are hires_scan archives (baselines_*MHz.spec) or older text files
+(baselines_*MHz.dat) with the bandwidth in the name.  All the files given
+(by default every one here) are read, a baseline is fitted for each
+bandwidth found and the fits are added to the baseline store.
+
+Example::
+
+  python baseline_avg.py --method clip
 """
+import argparse
+import glob
+import logging
 from pylab import *
-from numpy.polynomial.chebyshev import chebfit, chebval
-from cPickle import dump, load
-from support.text import select_files, user_input
-
-files = select_files("baselines_*MHz.dat","Select one file by number: ")
-data = loadtxt(files)
-nrows,ncols = data.shape
-if nrows % 64:
-  raise RuntimeError("%d rows is not a multiple of 64" % nrows)
-num_spectra = nrows/64
-use_spectra = user_input("Select spectra",range(num_spectra)).split(',')
-
-avg = zeros(64)
-for spectrum in use_spectra:
-  base_index = int(spectrum)*64
-  for index in range(64):
-    avg[index] += data[base_index+index,1]
-averages = avg/num_spectra
-# normalize the spectrum
-mean = averages.mean()
-averages /= mean
-# fit the normalized spectrum
-freqs = data[:64,0] - data[:64,0].mean()
-coefs = chebfit(freqs,averages,11)
-model = chebval(freqs,coefs)
-
-freqstep = freqs[1]-freqs[0]
-bandwidth = freqs[-1]-freqs[0]+freqstep
-coeffile = open("baseline_coefs.pkl","rb")
-try:
-  coef_dict = load(coeffile)
-  print "Loaded:",coef_dict.keys()
-except EOFError:
-  print "Empty coefficients file"
-coeffile.close()
-try:
-  coef_dict[bandwidth] = coefs
-except NameError:
-  coef_dict = {bandwidth: coefs}
-print "Dumping:",coef_dict.keys()
-coeffile = open("baseline_coefs.pkl","wb")
-dump(coef_dict, coeffile)
-coeffile.close()
-
-plot(freqs,averages,'.')
-plot(freqs,model)
-title(str(bandwidth)+" MHz Bandwidth")
-xlabel("Frequency (MHz)")
-ylabel("Normalized Power")
-grid()
-savefig("Figures/baseline-"+str(bandwidth)+".png")
-show()
+from numpy.polynomial.chebyshev import chebval
+
+from RealtekSDR.Calibration import BASELINE_DEGREE, BASELINE_FILE
+from RealtekSDR.Calibration import BaselineStore, fit_baselines
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("files", nargs="*",
+                    help="baseline files; default baselines_*MHz.*")
+parser.add_argument("--method", default="median",
+                    choices=["median", "clip", "mean"],
+                    help="how the spectra are averaged")
+parser.add_argument("--sigma", type=float, default=3.,
+                    help="clipping limit for --method clip")
+parser.add_argument("--degree", type=int, default=BASELINE_DEGREE,
+                    help="degree of the Chebyshev fit")
+parser.add_argument("--store", default=BASELINE_FILE,
+                    help="baseline store to add the fits to")
+parser.add_argument("--no-plot", dest="plot", action="store_false",
+                    help="do not plot the fits")
+args = parser.parse_args()
+
+files = args.files or sorted(glob.glob("baselines_*MHz.dat") +
+                             glob.glob("baselines_*MHz.spec"))
+fits = fit_baselines(files, args.method, args.sigma, args.degree)
+
+baselines = BaselineStore(args.store)
+for bandwidth in sorted(fits.keys()):
+  offsets, average, coefs = fits[bandwidth]
+  baselines.add(coefs, bandwidth)
+  if args.plot:
+    figure()
+    plot(offsets, average, '.')
+    plot(offsets, chebval(offsets, coefs))
+    title(str(bandwidth/1e6)+" MHz Bandwidth")
+    xlabel("Frequency (MHz)")
+    ylabel("Normalized Power")
+    grid()
+    savefig("Figures/baseline-"+str(bandwidth/1e6)+".png")
+baselines.save()
+mylogger.info(" saved %s MHz to %s",
+              ", ".join([str(bw/1e6) for bw in sorted(fits.keys())]),
+              args.store)
+if args.plot:
+  show()
@@ -0,0 +1,50 @@
+"""
+Compares the FFT backends available in RealtekSDR.FFTbackend.
+
+For each size a batch of complex64 rows totalling about a million samples is
+transformed along the rows, as 'make_spectrogram' does.  The first call,
+which builds the plan, is not timed.
+
+Example::
+
+  python bench_fft.py --sizes 64 512 1024 65536 --workers 4
+"""
+import argparse
+import logging
+import timeit
+from numpy import complex64
+from numpy.random import randn
+
+from RealtekSDR import FFTbackend
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", type=int, nargs="+",
+                    default=[64, 512, 1024, 65536],
+                    help="transform lengths")
+parser.add_argument("--samples", type=int, default=2**20,
+                    help="samples per batch")
+parser.add_argument("--workers", type=int, default=None,
+                    help="threads for scipy and FFTW")
+parser.add_argument("--repeat", type=int, default=10,
+                    help="number of batches to time")
+args = parser.parse_args()
+
+backends = FFTbackend.available_backends()
+print("%8s" % "size" + "".join(["%12s" % name for name in backends]) +
+      "   (us per transform)")
+for size in args.sizes:
+  rows = max(args.samples//size, 1)
+  data = (randn(rows, size) + 1j*randn(rows, size)).astype(complex64)
+  times = []
+  for name in backends:
+    FFTbackend.set_backend(name, workers=args.workers)
+    FFTbackend.fft(data)
+    per_batch = timeit.timeit(lambda: FFTbackend.fft(data),
+                              number=args.repeat)/args.repeat
+    times.append(per_batch/rows*1e6)
+  print("%8d" % size + "".join(["%12.2f" % t for t in times]))
+FFTbackend.set_backend()
@@ -0,0 +1,64 @@
+"""
+Compares ways of decoding raw dongle bytes into complex samples.
+
+ * struct  - the original path: struct.unpack to a tuple, an int64 array
+             less 128, then Signals.unpack_to_complex (complex128);
+ * int8    - the pooled int8 view from 'synch_read' fed to unpack_to_complex;
+ * LUT     - Signals.IQDecoder, one table lookup per byte pair (complex64);
+ * LUT/out - the same, writing into a preallocated array.
+
+Example::
+
+  python bench_iq_decode.py --blocks 20
+"""
+import argparse
+import logging
+import struct
+import timeit
+from numpy import abs, array, bitwise_xor, complex64, empty, int8, uint8
+from numpy.random import randint
+
+from RealtekSDR import DEFAULT_BUF_LENGTH
+from RealtekSDR.Signals import IQDecoder, unpack_to_complex
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--blocks", type=int, default=20,
+                    help="number of blocks to time")
+parser.add_argument("--size", type=int, default=DEFAULT_BUF_LENGTH,
+                    help="bytes per block")
+args = parser.parse_args()
+
+rawdata = randint(0, 256, args.size).astype(uint8)
+source = rawdata.tobytes()
+decoder = IQDecoder()
+out = empty(args.size//2, dtype=complex64)
+
+def struct_path():
+  unsigned_data = struct.unpack(str(args.size)+'B', source)
+  return unpack_to_complex(array(unsigned_data)-128)
+
+def int8_path():
+  signed = bitwise_xor(rawdata, 0x80).view(int8)
+  return unpack_to_complex(signed)
+
+def lut_path():
+  return decoder(rawdata)
+
+def lut_out_path():
+  return decoder(rawdata, out=out)
+
+if abs(struct_path() - lut_path()).max() > 0:
+  raise RuntimeError("LUT decoder disagrees with unpack_to_complex")
+
+block_time = args.size/2/2.4e6
+print("%d byte blocks; %.2f ms of data each at 2.4 MS/s" %
+      (args.size, block_time*1e3))
+for name, func in [("struct", struct_path), ("int8", int8_path),
+                   ("LUT", lut_path), ("LUT/out", lut_out_path)]:
+  per_block = timeit.timeit(func, number=args.blocks)/args.blocks
+  print("%8s: %8.3f ms/block, %5.1f%% of real time" %
+        (name, per_block*1e3, 100*per_block/block_time))
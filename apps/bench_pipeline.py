@@ -0,0 +1,131 @@
+"""
+Measures the throughput and latency of a chain of processing threads.
+
+The samples come from a ReplaySdr, either a recording or made-up tones, so
+the same load can be run on any machine.  As in chained_queues.py, blocks
+are read from the SDR's stream and passed through queues between threads,
+here decoding, then making spectra, then averaging them.  Each block carries
+the time it would have arrived from a dongle, or with --max-speed the time
+it was read, and its latency is measured when it leaves the last thread.
+
+Paced, the chain keeps up if nothing is dropped and the latency stays put.
+With --max-speed the replay waits for the chain, so the throughput is the
+most the chain can do.
+
+Example::
+
+  python bench_pipeline.py --file /tmp/capture.bin --rate 2.4e6 --loop
+  python bench_pipeline.py --max-speed --blocks 1000
+"""
+import argparse
+import logging
+import Queue
+import threading
+import time
+from numpy import array, median, percentile
+
+from RealtekSDR import DEFAULT_BUF_LENGTH
+from RealtekSDR.Replay import ReplaySdr
+from RealtekSDR.Signals import IQDecoder, make_spectrogram
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--file", default=None,
+                    help="recording to replay; default made-up tones")
+parser.add_argument("--rate", type=float, default=2400000,
+                    help="samples per second")
+parser.add_argument("--max-speed", dest="pace", action="store_false",
+                    help="do not pace the samples to the sample rate")
+parser.add_argument("--loop", action="store_true",
+                    help="replay the recording over and over")
+parser.add_argument("--blocks", type=int, default=200,
+                    help="number of blocks to send down the chain")
+parser.add_argument("--size", type=int, default=DEFAULT_BUF_LENGTH,
+                    help="bytes per block")
+parser.add_argument("--bins", type=int, default=1024,
+                    help="channels in each spectrum")
+args = parser.parse_args()
+
+class Stage(threading.Thread):
+  """
+  One link of the chain
+
+  Items are (time, data); a None ends the thread and is passed on.  The
+  last link records the latency of each item instead of passing it on.
+  """
+  def __init__(self, name, func, Qin, Qout=None):
+    threading.Thread.__init__(self, name=name)
+    self.func = func
+    self.Qin = Qin
+    self.Qout = Qout
+    self.busy = 0.
+    self.latencies = []
+
+  def run(self):
+    while True:
+      item = self.Qin.get()
+      if item == None:
+        break
+      stamp, data = item
+      started = time.time()
+      result = self.func(data)
+      done = time.time()
+      self.busy += done - started
+      if self.Qout:
+        self.Qout.put((stamp, result))
+      else:
+        self.latencies.append(done - stamp)
+    if self.Qout:
+      self.Qout.put(None)
+
+decoder = IQDecoder()
+num_bins = args.bins
+def spectra(data):
+  return make_spectrogram(data, len(data)//num_bins, num_bins)
+def average(image):
+  return image.mean(axis=0)
+
+sdr = ReplaySdr(args.file, sample_rate=args.rate, pace=args.pace,
+                loop=args.loop, dflt_blk_size=args.size)
+queues = [Queue.Queue() for index in range(3)]
+stages = [Stage("decode", decoder, queues[0], queues[1]),
+          Stage("spectra", spectra, queues[1], queues[2]),
+          Stage("average", average, queues[2])]
+for stage in stages:
+  stage.start()
+
+samples = 0
+sent = 0
+started = time.time()
+for block in sdr.stream():
+  # count the samples of blocks dropped before this one
+  samples += sdr.ring.gap*args.size//2 + len(block)//2
+  if args.pace:
+    stamp = sdr.due_time(samples)
+  else:
+    stamp = time.time()
+  # the block is only valid until the next one is read
+  queues[0].put((stamp, block.copy()))
+  sent += 1
+  if sent == args.blocks:
+    break
+queues[0].put(None)
+for stage in stages:
+  stage.join()
+elapsed = time.time() - started
+
+latencies = array(stages[-1].latencies)*1e3
+processed = sent*args.size//2
+print("%d blocks of %d bytes, %d dropped, in %.2f s" %
+      (sent, args.size, sdr.ring.dropped, elapsed))
+print("throughput %.2f MS/s, %.2f times real time at %.2f MS/s" %
+      (processed/elapsed/1e6, processed/elapsed/sdr.samplerate,
+       sdr.samplerate/1e6))
+print("latency ms: median %.2f, 95%% %.2f, max %.2f" %
+      (median(latencies), percentile(latencies, 95), latencies.max()))
+for stage in stages:
+  print("%10s busy %5.1f%%" % (stage.name, 100*stage.busy/elapsed))
+sdr.close()
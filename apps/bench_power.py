@@ -0,0 +1,60 @@
+"""
+Compares ways of finding the total power of raw dongle bytes.
+
+ * complex - the old path: the int8 view through Signals.unpack_to_complex
+             (complex128) and then (data*conj(data)).sum();
+ * decode  - Signals.IQDecoder into a preallocated complex64 array and vdot;
+ * table   - IQDecoder.power, which looks up each pair's power from the raw
+             bytes and either sums the lookups or, for blocks of more than
+             65536 pairs, takes the dot product of the pair counts with the
+             table.
+
+Example::
+
+  python bench_power.py --sizes 16384 262144 2097152
+"""
+import argparse
+import logging
+import timeit
+from numpy import bitwise_xor, complex64, conj, empty, int8, uint8, vdot
+from numpy.random import randint
+
+from RealtekSDR.Signals import IQDecoder, unpack_to_complex
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", type=int, nargs="+",
+                    default=[16384, 262144, 2097152],
+                    help="bytes per block")
+parser.add_argument("--blocks", type=int, default=20,
+                    help="number of blocks to time")
+args = parser.parse_args()
+
+decoder = IQDecoder()
+
+print("%10s%12s%12s%12s   (ms per block)" %
+      ("bytes", "complex", "decode", "table"))
+for size in args.sizes:
+  rawdata = randint(0, 256, size).astype(uint8)
+  out = empty(size//2, dtype=complex64)
+
+  def complex_path():
+    data = unpack_to_complex(bitwise_xor(rawdata, 0x80).view(int8))
+    return (data*conj(data)).sum().real
+
+  def decode_path():
+    data = decoder(rawdata, out=out)
+    return vdot(data, data).real
+
+  def table_path():
+    return decoder.power(rawdata)
+
+  if complex_path() != table_path():
+    raise RuntimeError("power table disagrees with the complex sum")
+  times = []
+  for func in [complex_path, decode_path, table_path]:
+    times.append(timeit.timeit(func, number=args.blocks)/args.blocks)
+  print("%10d" % size + "".join(["%12.3f" % (t*1e3) for t in times]))
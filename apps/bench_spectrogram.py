@@ -0,0 +1,66 @@
+"""
+Compares the batched Signals.make_spectrogram with the original per-slice loop.
+
+The loop version below is the implementation 'make_spectrogram' used to
+have: one FFT, fftshift and power computation per spectrum.
+
+Example::
+
+  python bench_spectrogram.py --spectra 2048 --bins 1024
+"""
+import argparse
+import logging
+import timeit
+from numpy import abs, complex64, conj, empty, float32, hanning, log10
+from numpy.fft import fft, fftshift
+from numpy.random import randn
+
+from RealtekSDR.Signals import make_spectrogram
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--spectra", type=int, default=2048,
+                    help="number of spectra")
+parser.add_argument("--bins", type=int, default=1024,
+                    help="number of channels per spectrum")
+parser.add_argument("--repeat", type=int, default=5,
+                    help="number of times to time each version")
+args = parser.parse_args()
+
+def loop_spectrogram(data, num_spec, num_bins, log=False):
+  image = empty((num_spec, num_bins))
+  for index in range(0, num_spec*num_bins, num_bins):
+    spectrum = fftshift(fft(data[index:index+num_bins]))
+    if log:
+      image[index//num_bins] = log10(abs(spectrum*conj(spectrum)))
+    else:
+      image[index//num_bins] = abs(spectrum*conj(spectrum))
+  return image
+
+num_samples = args.spectra*args.bins
+data = (randn(num_samples) + 1j*randn(num_samples)).astype(complex64)
+out = empty((args.spectra, args.bins), dtype=float32)
+window = hanning(args.bins).astype(float32)
+
+reference = loop_spectrogram(data, args.spectra, args.bins, log=True)
+result = make_spectrogram(data, args.spectra, args.bins, log=True, out=out)
+print("largest difference in log power: %g" % abs(reference - result).max())
+
+timings = {}
+for name, func in [
+        ("loop", lambda: loop_spectrogram(data, args.spectra, args.bins,
+                                          log=True)),
+        ("batched", lambda: make_spectrogram(data, args.spectra, args.bins,
+                                             log=True)),
+        ("batched/out", lambda: make_spectrogram(data, args.spectra,
+                                                 args.bins, log=True,
+                                                 out=out)),
+        ("batched/window", lambda: make_spectrogram(data, args.spectra,
+                                                    args.bins, log=True,
+                                                    window=window, out=out))]:
+  timings[name] = timeit.timeit(func, number=args.repeat)/args.repeat
+  print("%16s: %8.1f ms, %5.1f x loop" %
+        (name, timings[name]*1e3, timings["loop"]/timings[name]))
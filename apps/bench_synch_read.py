@@ -0,0 +1,83 @@
+"""
+Compares the old and new ways of turning a librtlsdr read into samples.
+
+The old 'synch_read' allocated a ctypes string buffer for every read, unpacked
+it with 'struct' into a tuple and made an int64 array from that.  The new one
+reads into a pooled numpy buffer and flips the sign bit in place to get an
+int8 view.  Both are timed here on a block of random bytes so no dongle is
+needed.  With a dongle attached, '--device' also times complete reads.
+
+Example::
+
+  python bench_synch_read.py --blocks 100 --device 0
+"""
+import argparse
+import ctypes as ct
+import logging
+import struct
+import timeit
+from numpy import array, bitwise_xor, float32, int8, uint8
+from numpy.random import randint
+
+from RealtekSDR import DEFAULT_BUF_LENGTH
+from RealtekSDR.Buffers import BufferPool
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--blocks", type=int, default=50,
+                    help="number of blocks to time")
+parser.add_argument("--size", type=int, default=DEFAULT_BUF_LENGTH,
+                    help="bytes per block")
+parser.add_argument("--device", type=int, default=None,
+                    help="also time reads from this dongle")
+args = parser.parse_args()
+
+source = randint(0, 256, args.size).astype(uint8).tobytes()
+pool = BufferPool(args.size)
+
+def old_path():
+  buf = ct.create_string_buffer(args.size)
+  ct.memmove(buf, source, args.size)
+  unsigned_data = struct.unpack(str(args.size)+'B', buf.raw)
+  return array(unsigned_data)-128
+
+def new_path():
+  buf = pool.next()
+  ct.memmove(buf.ctypes.data, source, args.size)
+  bitwise_xor(buf, 0x80, out=buf)
+  return buf.view(int8)
+
+def new_float_path():
+  signed = new_path()
+  floats = pool.floats(len(signed))
+  floats[:] = signed
+  return floats
+
+if (old_path() != new_path()).any():
+  raise RuntimeError("old and new conversions disagree")
+
+rate = 2.4e6 # complex samples/s
+block_time = args.size/2/rate
+print("%d byte blocks; %.2f ms of data each at 2.4 MS/s" %
+      (args.size, block_time*1e3))
+for name, func in [("struct.unpack", old_path),
+                   ("pooled int8", new_path),
+                   ("pooled float32", new_float_path)]:
+  per_block = timeit.timeit(func, number=args.blocks)/args.blocks
+  print("%16s: %8.3f ms/block, %5.1f%% of real time" %
+        (name, per_block*1e3, 100*per_block/block_time))
+
+if args.device != None:
+  from RealtekSDR import init_sdr
+  sdr = init_sdr(dev_ID=args.device, sample_rate=int(rate),
+                 dflt_blk_size=args.size)
+  sdr.reset_buffer()
+  for dtype in [int8, float32]:
+    per_block = timeit.timeit(lambda: sdr.synch_read(dtype=dtype),
+                              number=args.blocks)/args.blocks
+    print("%16s: %8.3f ms/block from the dongle" %
+          ("read "+dtype.__name__, per_block*1e3))
+  sdr.close()
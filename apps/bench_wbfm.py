@@ -0,0 +1,74 @@
+"""
+Measures how much faster than real time the WBFM demodulator runs.
+
+Recorded IQ from 'rtl_sdr' (unsigned 8-bit pairs) is fed through the decoder
+and demodulator block by block as fast as possible.  Without a file, a
+synthetic FM station with a 1 kHz tone is generated.  The headroom factor is
+the seconds of signal processed per second of processing; it must stay above
+1 for live reception.
+
+Examples::
+
+  python bench_wbfm.py
+  python bench_wbfm.py --file /tmp/capture.bin --rate 2400000 --wav out.wav
+"""
+import argparse
+import logging
+import time
+from numpy import arange, cumsum, empty, exp, fromfile, pi, sin, uint8
+from numpy.random import randn
+
+from RealtekSDR import DEFAULT_BUF_LENGTH
+from RealtekSDR.Audio import WAVSink
+from RealtekSDR.Signals import IQDecoder, WBFMDemodulator
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--file", default=None,
+                    help="rtl_sdr capture file; default synthetic signal")
+parser.add_argument("--rate", type=float, default=2.4e6,
+                    help="sample rate of the capture")
+parser.add_argument("--offset", type=float, default=0,
+                    help="station frequency relative to the center")
+parser.add_argument("--seconds", type=float, default=10,
+                    help="length of the synthetic signal")
+parser.add_argument("--wav", default=None, help="also write the audio")
+args = parser.parse_args()
+
+if args.file:
+  rawdata = fromfile(args.file, dtype=uint8)
+else:
+  # a 1 kHz tone at 75 kHz deviation plus some noise, quantized like the
+  # dongle's output
+  t = arange(int(args.seconds*args.rate))/args.rate
+  phase = 2*pi*75e3*cumsum(0.5*sin(2*pi*1000*t))/args.rate
+  phase += 2*pi*args.offset*t
+  iq = 64*exp(1j*phase)
+  rawdata = empty(2*len(t), dtype=uint8)
+  rawdata[0::2] = (iq.real + 2*randn(len(t)) + 128).clip(0, 255)
+  rawdata[1::2] = (iq.imag + 2*randn(len(t)) + 128).clip(0, 255)
+  del t, phase, iq
+
+decoder = IQDecoder()
+demodulator = WBFMDemodulator(args.rate, offset=args.offset)
+if args.wav:
+  sink = WAVSink(args.wav, demodulator.audio_rate)
+print("%.0f S/s in, %.0f S/s discriminated, %.0f S/s audio" %
+      (args.rate, demodulator.quad_rate, demodulator.audio_rate))
+
+num_blocks = len(rawdata)//DEFAULT_BUF_LENGTH
+t0 = time.time()
+for block in range(num_blocks):
+  first = block*DEFAULT_BUF_LENGTH
+  audio = demodulator(decoder(rawdata[first:first+DEFAULT_BUF_LENGTH]))
+  if args.wav:
+    sink.write(audio)
+elapsed = time.time() - t0
+if args.wav:
+  sink.close()
+signal_time = num_blocks*DEFAULT_BUF_LENGTH/2/args.rate
+print("%.1f s of signal in %.2f s: headroom %.1f x real time" %
+      (signal_time, elapsed, signal_time/elapsed))
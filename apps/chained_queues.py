@@ -26,6 +26,8 @@ import logging
 import Queue
 import math
 from pylab import *
+from RealtekSDR.Monitors import EventDetector
+from RealtekSDR.Signals import WelchAccumulator, make_spectrogram
 from RealtekSDR.Signals import unpack_to_complex
 
 module_logger = logging.getLogger(__name__)
@@ -119,30 +121,54 @@ class BaseThread(threading.Thread):
 class CaptureThread(BaseThread):
   """
   Class to capture signals with SDR
+
+  With 'streaming' the samples come from the SDR's asynchronous 'stream' so
+  there are no gaps between blocks; otherwise each block is a separate
+  synchronous read.
   """
-  def __init__(self, sdr, Qin=None, Qout=None):
+  def __init__(self, sdr, Qin=None, Qout=None, streaming=False):
     logger = logging.getLogger(module_logger.name+".CaptureThread")
     super(CaptureThread, self).__init__(Qin=Qin, Qout=Qout)
     self.logger = logger
     self.logger.debug("%s created",self.logger.name)
     self.sdr = sdr
     self.Qout = Qout
+    if streaming:
+      self.blocks = sdr.stream(dtype=int8)
+    else:
+      self.blocks = None
 
   def thread_task(self):
     try:
-      data = self.sdr.get_data_block()
+      if self.blocks:
+        data = unpack_to_complex(next(self.blocks))
+      else:
+        data = self.sdr.get_data_block()
     except rtlsdr.RtlSdrException, details:
       self.logger.error("thread_task: capture failed to get data: %s",str(details))
       self.terminate()
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, StopIteration):
       self.terminate()
     else:
       self.Qout.put(data)
 
+  def run(self):
+    """
+    Closes the stream, if any, from this thread when the thread ends
+    """
+    super(CaptureThread, self).run()
+    if self.blocks:
+      self.blocks.close()
+      self.logger.info("run: %d of %d blocks dropped",
+                       self.sdr.ring.dropped, self.sdr.ring.received)
+
 class SpectrumMonitor(BaseThread):
   """
   Class to grab a dynamic spectrum
 
+  The plot shows the running average of all the spectra so far; the
+  average is kept as a sum so the integration uses constant memory.
+
   Once created this is automatically suspended until a snapshot is
   required.  In suspended mode the thread just passes on the data.
   """
@@ -154,6 +180,7 @@ class SpectrumMonitor(BaseThread):
     self.Qin = Qin
     self.Qout = Qout
     self.num_freqs = num_freqs
+    self.accumulator = WelchAccumulator(num_freqs)
     sbplt = subplots()
     self.logger.debug("__init__: created %s", sbplt)
     self.specfig, self.specaxes =  sbplt
@@ -164,28 +191,80 @@ class SpectrumMonitor(BaseThread):
     self.data = self.Qin.get()
     if self.Qout:
       self.Qout.put(self.data)
-    cmplx_data = unpack_to_complex(self.data)
-    datalen = len(cmplx_data)
+    # CaptureThread queues complex samples
     self.logger.debug("thread_task: obtained %d complex samples from the queue",
-                      datalen)
-    num_spectra = datalen/self.num_freqs
-    self.logger.debug("thread_task: %d spectra will be processed",num_spectra)
-    avg = zeros(self.num_freqs)
-    for i in range(num_spectra-1):
-      index = i*self.num_freqs
-      self.logger.debug("thread_task: taking data from %d to %d",
-                          index,index+self.num_freqs)
-      dataslice = cmplx_data[index:index+self.num_freqs]
-      self.logger.debug("thread_task: spectrum has %d points", len(dataslice))
-      xform = fft(dataslice)
-      spectrum = fftshift(xform)
-      avg += abs(spectrum*conj(spectrum))
+                      len(self.data))
+    num_spectra = self.accumulator.add(self.data)
+    self.logger.debug("thread_task: %d spectra added, %d in the average",
+                      num_spectra, self.accumulator.count)
+    avg = self.accumulator.mean()
     self.logger.debug("thread_task: plotting")
     self.specaxes.clear()
     self.specaxes.semilogy(avg)
     self.logger.debug("thread_task: plot done")
     grid()
    
+class EventMonitor(BaseThread):
+  """
+  Class to look for bursts in the data
+
+  Each block is turned into spectra which are averaged in groups of
+  'integration' and given to an EventDetector.  Only the detector's noise
+  estimates are kept, not the spectra.  The times are counted in samples
+  from the first block, so they are exact for a gapless stream.  Events are
+  logged and, if 'events_file' is given, appended to it one per line as
+  time, frequency (Hz), SNR and duration.
+  """
+  def __init__(self, num_bins, sample_rate, Qin, Qout=None, integration=16,
+               center_freq=0, events_file=None, **kwargs):
+    logger = logging.getLogger(module_logger.name+".EventMonitor")
+    super(EventMonitor, self).__init__(Qin=Qin, Qout=Qout)
+    self.logger = logger
+    self.logger.debug("__init__: %s created",self.logger.name)
+    self.num_bins = num_bins
+    self.sample_rate = float(sample_rate)
+    self.integration = integration
+    self.detector = EventDetector(num_bins, **kwargs)
+    self.window = hanning(num_bins).astype(float32)
+    self.freqs = center_freq + fftshift(fftfreq(num_bins, 1/self.sample_rate))
+    self.events_file = events_file
+    self._image = None
+    self._t0 = None
+    self._samples = 0
+
+  def thread_task(self):
+    """
+    Processes the block fetched by '_pass_on'
+    """
+    data = self.data
+    if self._t0 == None:
+      self._t0 = time.time()
+    num_spec = len(data)//self.num_bins
+    num_int = num_spec//self.integration
+    if self._image is None or len(self._image) != num_spec:
+      self._image = empty((num_spec, self.num_bins), dtype=float32)
+    make_spectrogram(data, num_spec, self.num_bins, window=self.window,
+                     out=self._image)
+    spectra = self._image[:num_int*self.integration].reshape(
+                    num_int, self.integration, self.num_bins).mean(axis=1)
+    interval = self.integration*self.num_bins/self.sample_rate
+    times = self._t0 + self._samples/self.sample_rate + \
+                                                  arange(num_int)*interval
+    self._samples += len(data)
+    events = self.detector.process(spectra, times)
+    for event in events:
+      self.logger.info("thread_task: %s %.3f MHz SNR %.1f for %.3f s",
+                       time.strftime("%H:%M:%S", time.gmtime(event['time'])),
+                       self.freqs[event['channel']]/1e6, event['snr'],
+                       event['duration'])
+    if self.events_file and len(events):
+      fd = open(self.events_file, "a")
+      for event in events:
+        fd.write("%.3f\t%.0f\t%.2f\t%.3f\n" % (event['time'],
+                 self.freqs[event['channel']], event['snr'],
+                 event['duration']))
+      fd.close()
+
 if __name__ == "__main__":
   from RealtekSDR.stations import FM_freq
    
@@ -211,12 +290,18 @@ if __name__ == "__main__":
 
   threads = []
   Qreceived = Queue.Queue()
-  rcvr = CaptureThread(sdr, Qout=Qreceived)
+  rcvr = CaptureThread(sdr, Qout=Qreceived, streaming=True)
   rcvr.start()
   mylogger.debug(" CaptureThread started")
   threads.append(rcvr)
+  Qevents = Queue.Queue()
+  evmon = EventMonitor(1024, samplerate, Qreceived, Qout=Qevents,
+                       center_freq=centerfreq, events_file="events.txt")
+  evmon.start()
+  mylogger.debug(" EventMonitor started")
+  threads.append(evmon)
   QmonOut = Queue.Queue()
-  mon = SpectrumMonitor(1024, Qreceived, Qout=QmonOut)
+  mon = SpectrumMonitor(1024, Qevents, Qout=QmonOut)
   mon.start()
   mylogger.debug(" SpectrumMonitor started")
   threads.append(mon)
@@ -236,9 +321,11 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
       busy = False
       rcvr.terminate()
+      evmon.terminate()
       mon.terminate()
       mylogger.info(" terminated")
   rcvr.join()
+  evmon.join()
   mon.join()
   mylogger.info(" finished")
   sdr.close()
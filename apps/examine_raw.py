@@ -1,11 +1,33 @@
-from struct import *
+"""
+Histograms of the I and Q values in a capture file.
+
+The file is memory-mapped and read a chunk at a time, so captures of any
+size can be examined.
+
+Example::
+
+  python examine_raw.py /tmp/capture.bin
+"""
+import sys
 from pylab import *
 
-fd = open("/tmp/capture.bin","r")
-buf = fd.read()
-fd.close()
+from RealtekSDR.Capture import CaptureFile
+from RealtekSDR.Signals import StreamingHistogram
+
+if len(sys.argv) > 1:
+  filename = sys.argv[1]
+else:
+  filename = "/tmp/capture.bin"
+capture = CaptureFile(filename)
+# one bin for each possible byte value
+i_hist = StreamingHistogram(256, (-128.5, 127.5))
+q_hist = StreamingHistogram(256, (-128.5, 127.5))
+capture.histogram(i_hist, q_hist)
 
-rawdata = unpack(str(len(buf))+'b', buf)
 figure()
-hist(rawdata, bins=100)
-show()
\ No newline at end of file
+for index, (name, h) in enumerate([("I", i_hist), ("Q", q_hist)]):
+  subplot(1, 2, index+1)
+  hist(h.centers, bins=h.edges, weights=h.counts)
+  title(name)
+  grid()
+show()
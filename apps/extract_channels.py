@@ -0,0 +1,53 @@
+"""
+Extracts several narrow aeronautical channels from one 2.4 MS/s stream.
+
+Each channel within the tuned band gets its own DownConverter, which mixes it
+to zero frequency and decimates by 100 to 24 kS/s.  The mean power in every
+channel is printed each second, without retuning the dongle.
+"""
+import logging
+from numpy import vdot
+
+from RealtekSDR import init_sdr
+from RealtekSDR.Signals import DownConverter, IQDecoder
+from RealtekSDR.stations import air_nav
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+cf = 121000000
+sr = 2400000
+usable = 0.9*sr/2 # keep clear of the band edges
+
+channels = {}
+for name in air_nav.keys():
+  offset = air_nav[name]*1e6 - cf
+  if abs(offset) < usable:
+    channels[name] = DownConverter(sr, offset, 10, 10, bandwidth=16000)
+mylogger.info(" %d channels in the band", len(channels))
+
+sdr = init_sdr(sample_rate=sr)
+sdr.set_freq(cf)
+decoder = IQDecoder()
+blocks_per_report = int(sr*2/sdr.blk_size)
+powers = dict.fromkeys(channels.keys(), 0.)
+count = 0
+try:
+  for rawdata in sdr.stream():
+    data = decoder(rawdata)
+    for name in channels.keys():
+      baseband = channels[name](data)
+      powers[name] += vdot(baseband, baseband).real/len(baseband)
+    count += 1
+    if count == blocks_per_report:
+      for name in sorted(channels.keys(), key=lambda n: air_nav[n]):
+        print("%8.3f MHz %-26s %10.2f" %
+              (air_nav[name], name, powers[name]/count))
+      print("")
+      powers = dict.fromkeys(channels.keys(), 0.)
+      count = 0
+except KeyboardInterrupt:
+  pass
+mylogger.info(" %d blocks dropped", sdr.ring.dropped)
+sdr.close()
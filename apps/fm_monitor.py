@@ -0,0 +1,43 @@
+"""
+Monitors the power of every LA broadcast FM station.
+
+All the stations in RealtekSDR.stations.FM_station are covered by about a
+dozen 2.4 MHz captures, so each cycle retunes that many times instead of
+once per station.  The power of each station is plotted against time.
+
+Example::
+
+  python fm_monitor.py 100
+"""
+import logging
+import sys
+from pylab import *
+
+from RealtekSDR import init_sdr
+from RealtekSDR.Monitors import StationMonitor
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+num_cycles = int(sys.argv[1])
+
+sdr = init_sdr(sample_rate=2400000)
+monitor = StationMonitor(sdr)
+for center, calls in monitor.captures:
+  mylogger.info(" %7.3f MHz: %s", center/1e6, ", ".join(calls))
+try:
+  times, series = monitor.run(num_cycles)
+except KeyboardInterrupt:
+  times, series = monitor.time_series()
+sdr.close()
+mylogger.info(" %d cycles with %d retunes", len(times), monitor.retunes)
+
+figure()
+for call in sorted(series.keys(), key=lambda c: monitor.stations[c]):
+  semilogy(times-times[0], series[call], label=call)
+xlabel("Time (s)")
+ylabel("Power")
+legend(loc="upper left", ncol=4, fontsize="small")
+grid()
+show()
@@ -0,0 +1,52 @@
+"""
+Records a broadcast FM station to a WAV file.
+
+The dongle is tuned 250 kHz below the station, away from its DC spike, and
+the stream is demodulated block by block.  Stop with Ctrl-C.  If a host is
+given the samples come from an rtl_tcp server there instead of a local
+dongle.
+
+Example::
+
+  python fm_radio.py KCRW 60 kcrw.wav
+  python fm_radio.py KCRW 60 kcrw.wav 192.168.0.13
+"""
+import logging
+import sys
+
+from RealtekSDR import init_sdr
+from RealtekSDR.Audio import WAVSink
+from RealtekSDR.Signals import IQDecoder, WBFMDemodulator
+from RealtekSDR.TCPclient import RtlTCP
+from RealtekSDR.stations import FM_freq
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+station = sys.argv[1]
+seconds = float(sys.argv[2])
+filename = sys.argv[3]
+
+sr = 2400000
+offset = 250000
+freq = int(FM_freq[station]*1e6) - offset
+if len(sys.argv) > 4:
+  sdr = RtlTCP(samplerate=sr, freq=freq, host=sys.argv[4])
+else:
+  sdr = init_sdr(sample_rate=sr)
+  sdr.set_freq(freq)
+decoder = IQDecoder()
+demodulator = WBFMDemodulator(sr, offset=offset)
+sink = WAVSink(filename, demodulator.audio_rate)
+try:
+  for rawdata in sdr.stream():
+    sink.write(demodulator(decoder(rawdata)))
+    if sink.written >= seconds*demodulator.audio_rate:
+      break
+except KeyboardInterrupt:
+  pass
+sink.close()
+mylogger.info(" %.1f s recorded; %d blocks dropped",
+              sink.written/demodulator.audio_rate, sdr.ring.dropped)
+sdr.close()
@@ -3,15 +3,15 @@ Scans through the spectrum with a 'step' MHz band and tranforming the
 data into a 64 point spectrum.
 """
 from pylab import *
-from time import sleep
+from time import sleep, time
 from sys import stdout
-from numpy.polynomial.chebyshev import chebval
-from cPickle import load
 import logging
 
 from RealtekSDR import *
+from RealtekSDR.Archive import SpectrogramArchive
+from RealtekSDR.Calibration import BaselineStore
 from RealtekSDR.stations import FM_station, TV_station
-from RealtekSDR.Signals import make_spectrogram
+from RealtekSDR.Signals import WelchAccumulator
 
 mylogger = logging.getLogger()
 logging.basicConfig()
@@ -44,14 +44,14 @@ status = rtlsdr.reset_buffer()
 mylogger.info(" reset_buffer status: %s",status)
 
 if normalize:
-  coeffile = open("baseline_coefs.pkl","rb")
-  coef_dict = load(coeffile)
-  coeffile.close()
-  coefs = coef_dict[float(step)]
-  print "Coefficients loaded"
+  baselines = BaselineStore()
+  normalizer = baselines.normalizer(step*1e6, num_bins, gain=gain)
+  print "Baseline loaded"
 fig = figure()
 freqs = []
 signl = []
+# the baselines were fitted to contiguous, unwindowed spectra
+accumulator = WelchAccumulator(num_bins, overlap=0, window=ones(num_bins))
 for freq in arange(start,end,step): # MHz
   cf = rtlsdr.set_freq(int(freq*1000000))
   status = rtlsdr.reset_buffer()
@@ -61,18 +61,17 @@ for freq in arange(start,end,step): # MHz
   data = rtlsdr.get_data_block()
   print cf/1.e6,
   stdout.flush()
-  datalen = len(data)
   halfwidth = num_bins/2
-  num_spec = datalen/num_bins
-  image = make_spectrogram(data, num_spec, num_bins, log=False)
-  spectrum = image.mean(axis=0)
+  accumulator.reset()
+  accumulator.add(data)
+  spectrum = accumulator.mean()
   # fix up center channel
   spectrum[halfwidth] = (spectrum[halfwidth-1]+spectrum[halfwidth+1])/2
   offset = float(halfwidth-0.5)/num_bins
   specfreqs = linspace(-step*offset, +step*offset, num_bins)
   freqs += list(specfreqs+cf/1.e6)
   if normalize:
-    signl += list(spectrum/chebval(specfreqs,coefs))
+    signl += list(spectrum*normalizer)
   else:
     signl += list(spectrum)
 status = rtlsdr.close()
@@ -108,9 +107,10 @@ if normalize:
   savefig("Figures/hiresscan-norm_%s.png" % freq_string)
 else:
   savefig("Figures/hiresscan-raw_%s.png" % freq_string)
-  f = open("baselines_%s.dat" % freq_string, "w")
-  for index in range(len(freqs)):
-    f.write(str(freqs[index])+"\t"+str(signl[index])+"\n")
-  f.close()
+  # each scan is one row; the channels are evenly spaced across the hops
+  archive = SpectrogramArchive("baselines_%s.spec" % freq_string, len(freqs))
+  archive.set_frequency(freqs[0]*1e6, step*1e6/num_bins)
+  archive.append(array(signl), time())
+  archive.close()
 show()
 
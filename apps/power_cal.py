@@ -6,14 +6,17 @@ It also will accomodate scans at various gain settings.
 Steps through the spectrum in 1 MHz steps, capturing data at 1 MS/s and
 converting that to LSB and USB.  In effect, 500 kHz resolution.
 
-According to the scanner() code in /opt/rtl-sdr/src/rtl_power.c, the buffer is
-not reset between tunings.
+All the gains are measured at each frequency before retuning, so the dongle
+is tuned once per frequency rather than once per frequency and gain.  The
+results are saved as the sweep goes and an interrupted sweep is resumed
+when the script is run again.
 """
 from rtlsdr import *
 from pylab import *
-import scipy.fftpack
 import logging
 
+from RealtekSDR.Calibration import GainSweep
+
 mylogger = logging.getLogger()
 logging.basicConfig()
 mylogger.setLevel(logging.WARNING)
@@ -25,14 +28,14 @@ def plot_spectrum(fignum,gain,freqs,pwr):
   #  semilogy(freqs[0:len(freqs):2],pwrl,'.', label=str(gain)+" LSB")
   #  semilogy(freqs[1:len(freqs):2],pwru,'.', label=str(gain)+" USB")
 
-def plot_data_histogram(fignum,signll,signlu, savefig=False):
+def plot_data_histogram(fignum,lsb_hist,usb_hist, savefig=False):
   figure(fignum)
   subplot(1,2,1)
-  hist(signll,bins=100)
+  hist(lsb_hist.centers, bins=lsb_hist.edges, weights=lsb_hist.counts)
   grid()
   title("LSB")
   subplot(1,2,2)
-  hist(signlu,bins=100)
+  hist(usb_hist.centers, bins=usb_hist.edges, weights=usb_hist.counts)
   grid()
   title("USB")
   if savefig:
@@ -51,16 +54,23 @@ rtlsdr = init_sdr(sample_rate=step*1000000, dflt_blk_size=2048)
 gains = rtlsdr.get_tuner_gains()
 print "gains =", gains
 
+gains = [gains[gain_idx] for gain_idx in [4,7,13,17,22]]
+print "gains used =", gains
+sweep = GainSweep(rtlsdr, arange(start,end,step)*1e6, gains,
+                  filename="power_cal_%06.1f-%06.1fMHz.npz" % (start,end))
+try:
+  power = sweep.run()
+except KeyboardInterrupt:
+  print "Interrupted; run again to finish the sweep"
+  power = sweep.power
+
 specfig = figure(1)
-for gain_idx in [4,7,13,17,22]:
-  status = rtlsdr.set_gain(gains[gain_idx])
-  gain = gains[gain_idx]
-  print "gain =", gain
-  status = rtlsdr.reset_buffer()
-  print "reset_buffer status:",status
-  freqs,pwrl,pwru,pwr,signll,signlu = rtlsdr.get_power_scan(start,end,step,
-                                             gain=gain)
-  plot_spectrum(specfig,gain,freqs,pwr)
+for gain_idx in range(len(gains)):
+  scan = power[:,gain_idx]
+  freqs = column_stack((sweep.freqs/1e6-0.25*step,
+                        sweep.freqs/1e6+0.25*step)).ravel()
+  pwr = column_stack((scan['lsb'], scan['usb'])).ravel()
+  plot_spectrum(specfig,gains[gain_idx],freqs,pwr)
 
 status = rtlsdr.close()
 print "Close status:",status
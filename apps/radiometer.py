@@ -0,0 +1,43 @@
+"""
+Records the total power at one frequency for a long time.
+
+The power is integrated into bins of fixed length and one line per bin,
+with the time, mean power, samples integrated and duty cycle, is appended to
+the output file.  Stop it with Ctrl-C.
+
+Example::
+
+  python radiometer.py 25e6 --bin 10 --gain 400 --out jupiter.txt
+"""
+import argparse
+import logging
+
+from RealtekSDR import init_sdr
+from RealtekSDR.Monitors import Radiometer
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("freq", type=float, help="center frequency, Hz")
+parser.add_argument("--rate", type=int, default=1024000,
+                    help="samples per second")
+parser.add_argument("--bin", type=float, default=1.0,
+                    help="integration time per record, s")
+parser.add_argument("--gain", type=int, default=0,
+                    help="tuner gain, tenths of dB; 0 for automatic")
+parser.add_argument("--duration", type=float, default=None,
+                    help="seconds to run; default until Ctrl-C")
+parser.add_argument("--out", default="radiometer.txt",
+                    help="file the records are appended to")
+args = parser.parse_args()
+
+sdr = init_sdr(sample_rate=args.rate)
+sdr.set_freq(int(args.freq))
+if args.gain:
+  sdr.set_gain(args.gain)
+radiometer = Radiometer(sdr, bin_time=args.bin, filename=args.out)
+duty = radiometer.run(args.duration)
+sdr.close()
+print("duty cycle %.4f, %d samples lost" % (duty, radiometer.lost))
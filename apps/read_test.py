@@ -13,13 +13,11 @@ dropped is 2.8 MSs.
 Format example obtained from http://pastebin.com/hcwyKvX7
 """
 
-from struct import *
 from numpy import array
 from pylab import *
 import argparse
-from rtlsdr import show_image
-from Graphics import make_spectrogram
-from RealtekSDR.Signals import unpack_to_complex
+from RealtekSDR import show_image
+from RealtekSDR.Capture import CaptureFile
 
 files = {1: "/tmp/capture.bin"}
 for f in files.keys():
@@ -30,6 +28,8 @@ if choice == 1:
   parser = argparse.ArgumentParser()
   parser.add_argument("-f", dest="centerfreq")
   parser.add_argument("-s", dest="samplerate", default=2048000)
+  parser.add_argument("-t", dest="start", default=0,
+                      help="seconds into the file")
   args = parser.parse_args(command.split())
   print args
 
@@ -47,14 +47,10 @@ freqs = array(arange(centerfreq-samplerate/2,
                      centerfreq+samplerate/2,
                      samplerate/num_bins))/1e6 # kHz
 
-fd = open(files[choice],"r")
-buf = fd.read()
-fd.close()
-
-rawdata = unpack(str(len(buf))+'b', buf)
-data = unpack_to_complex(array(rawdata))
-
-image = make_spectrogram(data,num_spec,num_bins)
+capture = CaptureFile(files[choice], samplerate, centerfreq)
+print "%.1f s of data" % capture.duration()
+start = capture.index(float(args.start))
+first, image = capture.spectrogram(num_bins, num_spec, start=start).next()
 extent=(freqs[0], freqs[-1], 0, num_spec*refreshinterval)
 show_image(image, extent)
 show()
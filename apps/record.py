@@ -0,0 +1,46 @@
+"""
+Records raw samples to disk, in place of shelling out to rtl_sdr.
+
+The files are named <base>_0000.sigmf-data, <base>_0001.sigmf-data, ...
+each with a .sigmf-meta description giving the frequency, sample rate,
+gain, start time and any blocks dropped.
+
+Example::
+
+  python record.py 392e6 --rate 2.4e6 --duration 60 --max-mb 1024 /tmp/capture
+"""
+import argparse
+import logging
+
+from RealtekSDR import init_sdr
+from RealtekSDR.Capture import record
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("freq", type=float, help="center frequency, Hz")
+parser.add_argument("base", help="path and start of the file names")
+parser.add_argument("--rate", type=float, default=2400000,
+                    help="samples per second")
+parser.add_argument("--gain", type=int, default=0,
+                    help="tuner gain, tenths of dB; 0 for automatic")
+parser.add_argument("--duration", type=float, default=None,
+                    help="seconds to record; default until Ctrl-C")
+parser.add_argument("--max-mb", type=int, default=None,
+                    help="start a new file after this many MB")
+args = parser.parse_args()
+
+sdr = init_sdr(sample_rate=int(args.rate))
+sdr.set_freq(int(args.freq))
+if args.gain:
+  sdr.set_gain(args.gain)
+if args.max_mb:
+  max_bytes = args.max_mb*2**20
+else:
+  max_bytes = None
+recorder = record(sdr, args.base, args.duration, max_bytes=max_bytes)
+sdr.close()
+print("%d MB in %d files, %d blocks dropped" %
+      (recorder.written//2**20, len(recorder.files), recorder.dropped()))
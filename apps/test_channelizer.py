@@ -0,0 +1,34 @@
+"""
+Compares channel isolation of a plain FFT and the polyphase filter bank.
+
+A strong carrier between two channels and a weak one 80 dB below it are
+averaged over 500 spectra both ways.  With the FFT the weak carrier is
+buried in the strong one's leakage; the filter bank shows it clearly.
+"""
+from pylab import *
+
+from RealtekSDR.Signals import PolyphaseChannelizer, WelchAccumulator
+
+num_chans = 64
+num_frames = 500
+t = arange(num_chans*num_frames)
+data = (exp(2j*pi*t*5.4/num_chans) +
+        1e-4*exp(2j*pi*t*12./num_chans)).astype(complex64)
+
+accumulator = WelchAccumulator(num_chans, overlap=0, window=ones(num_chans))
+accumulator.add(data)
+fft_spectrum = accumulator.mean()
+
+channelizer = PolyphaseChannelizer(num_chans)
+channels = channelizer(data)
+# skip the frames which still contain the initial zero history
+pfb_spectrum = (abs(channels[channelizer.taps_per_chan:])**2).mean(axis=0)
+
+chans = arange(num_chans) - num_chans/2
+plot(chans, 10*log10(fft_spectrum/fft_spectrum.max()), label="FFT")
+plot(chans, 10*log10(pfb_spectrum/pfb_spectrum.max()), label="PFB")
+xlabel("Channel")
+ylabel("Relative power (dB)")
+legend()
+grid()
+show()
@@ -5,7 +5,8 @@ to bar graph spectra taken with various resolutions from 4 to 16 channels.
 from rtlsdr import *
 from pylab import *
 
-from Data_Reduction import sideband_separate, unpack_to_complex
+from RealtekSDR.Signals import WelchAccumulator, sideband_separate
+from RealtekSDR.Signals import unpack_to_complex
 
 
 rawdata = get_sdr_samples()
@@ -20,13 +21,11 @@ factor = 1024./datalen
 bar([0,500], [(lsb**2).sum()*factor,(usb**2).sum()*factor],
     width=500, color=colors[0], label="LSB,USB")
 for num_bins in [4,8,16]:
-  avg = zeros(num_bins)
-  for index in range(0,64,num_bins):
-    dataslice = data[index:index+num_bins]
-    xform = fft(dataslice)
-    spectrum = fftshift(xform)
-    avg += abs(spectrum*conj(spectrum))
-  avg *= 64./num_bins
+  accumulator = WelchAccumulator(num_bins, overlap=0, window=ones(num_bins))
+  accumulator.add(data)
+  # same scale as summing the spectra of 64 samples and multiplying by
+  # 64/num_bins
+  avg = accumulator.mean()*(64./num_bins)**2
   print avg
   freqs = arange(0,1000,1000./num_bins)
   bar(freqs, avg, width=1000./num_bins, color=colors[int(log2(num_bins))], label=str(num_bins))
@@ -40,8 +40,9 @@ from matplotlib import pyplot as plt
 from matplotlib import animation
 from matplotlib.figure import Figure
 
-from numpy import append, linspace, log10, zeros
+from numpy import linspace, log10
 
+from RealtekSDR.Archive import SpectrogramArchive
 from RealtekSDR.TCPclient import RtlTCP, BUFFER_SIZE
 from RealtekSDR.stations import FM_freq
 
@@ -58,8 +59,9 @@ sdr = RtlTCP(samplerate=sr, freq=int(freq*1e6))
 nspec = 256
 last_read = nspec # initial value
 nch = BUFFER_SIZE/2
-oldest_displayed = 0
-history = 16384
+# all the spectra are kept on disk
+archive = SpectrogramArchive("waterfall_"+station, nch)
+archive.set_frequency(freq*1e6 - sr/2., sr/float(nch))
 
 sampling_interval = 1./sr
 num_complex_samples = nch
@@ -68,13 +70,12 @@ spectrum_interval_ms = spectrum_interval*1000 # ms
 
 fig = plt.figure()
 waterfall_axes = fig.add_axes([.1,.1,.75,.9])
-data = zeros((nspec,nch))
 t0 = time.time()
 for index in range(nspec):
   time.sleep(spectrum_interval)
-  data[index,:] = log10(sdr.grab_SDR_spectrum())
+  archive.append(log10(sdr.grab_SDR_spectrum()), time.time())
 t1 = time.time()
-image = data[oldest_displayed:oldest_displayed + nspec, :]
+image = archive.last(nspec)
 waterfall_artist = waterfall_axes.imshow(
           image,
           aspect = 'auto',
@@ -103,16 +104,10 @@ def init(*args):
   return waterfall_artist,
 
 def animate(*args):
-  global data, oldest_displayed, sdr, thisimage
+  global sdr, thisimage
   for index in range(16):
-    spectrum = log10(sdr.grab_SDR_spectrum())
-    s = spectrum.reshape(1,nch)
-    data = append(data, s, axis=0)
-  oldest_displayed += 16
-  first = oldest_displayed
-  last = oldest_displayed + nspec
-  mylogger.debug("Displaying from %d to %d", first, last)
-  thisimage = data[first:last, :]
+    archive.append(log10(sdr.grab_SDR_spectrum()), time.time())
+  thisimage = archive.last(nspec)
   mylogger.debug("animate: last image line max is %s", thisimage[-1].argmax())
   waterfall_artist.set_array(thisimage)
   return waterfall_artist,
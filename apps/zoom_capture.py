@@ -0,0 +1,80 @@
+"""
+Browses the dynamic spectrum of a long capture file.
+
+The first time a file is viewed its spectrogram pyramid is built in
+<file>.pyramid; after that the whole recording opens at once.  Zooming or
+panning the plot asks the pyramid for just the window on the screen at the
+resolution of the axes, so only a few rows of one level are read.
+
+Example::
+
+  python zoom_capture.py /tmp/capture.bin --rate 1.8e6 --freq 392e6 --max
+"""
+import argparse
+import logging
+import os
+from pylab import *
+
+from RealtekSDR import show_image
+from RealtekSDR.Capture import CaptureFile
+from RealtekSDR.Pyramid import SpectrogramPyramid, build_pyramid
+
+mylogger = logging.getLogger()
+logging.basicConfig()
+mylogger.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("file", help="raw capture or .sigmf-data file")
+parser.add_argument("--rate", type=float, default=None,
+                    help="samples per second, if there is no .sigmf-meta")
+parser.add_argument("--freq", type=float, default=None,
+                    help="center frequency, Hz, if there is no .sigmf-meta")
+parser.add_argument("--bins", type=int, default=1024,
+                    help="channels at full resolution")
+parser.add_argument("--integrate", type=int, default=1,
+                    help="spectra averaged in each full resolution row")
+parser.add_argument("--max", dest="kind", action="store_const",
+                    const="max", default="mean",
+                    help="show the max-hold instead of the mean")
+args = parser.parse_args()
+
+path = args.file+".pyramid"
+if os.path.exists(os.path.join(path, "pyramid.json")):
+  pyramid = SpectrogramPyramid(path)
+else:
+  capture = CaptureFile(args.file, args.rate, args.freq)
+  mylogger.info(" building %s from %.1f s of data", path, capture.duration())
+  pyramid = build_pyramid(capture, path, args.bins, integrate=args.integrate)
+
+def view(image, extent):
+  """
+  Image in dB and its extent for show_image, in MHz, time running down
+  """
+  low, high, start, stop = extent
+  return 10*log10(image), (low/1e6, high/1e6, stop, start)
+
+def on_zoom(axes):
+  """
+  Replaces the image with the part now in the axes
+  """
+  xlim, ylim = axes.get_xlim(), axes.get_ylim()
+  low, high = sorted(xlim)
+  start, stop = sorted(ylim)
+  image, extent, level = pyramid.query(start, stop, low*1e6, high*1e6,
+                                       int(axes.bbox.width),
+                                       int(axes.bbox.height), args.kind)
+  mylogger.debug(" level %d, %s", level, image.shape)
+  image, extent = view(image, extent)
+  picture.set_data(image)
+  picture.set_extent(extent)
+  # set_extent moves the limits to the image's edges
+  axes.set_xlim(xlim, emit=False)
+  axes.set_ylim(ylim, emit=False)
+
+image, extent, level = pyramid.query(kind=args.kind)
+fig = show_image(*view(image, extent))
+ax = fig.axes[0]
+picture = ax.images[0]
+ax.callbacks.connect("xlim_changed", on_zoom)
+ax.callbacks.connect("ylim_changed", on_zoom)
+show()